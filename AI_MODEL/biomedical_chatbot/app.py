@@ -1,8 +1,11 @@
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 import os
+import json
+import importlib
+import signal
 import traceback
-import joblib
+import threading
 import numpy as np
 from pathlib import Path
 import sys
@@ -34,33 +37,58 @@ try:
         ALL_MEDICATIONS,
         ALL_CONDITIONS
     )
+    from featurizer import featurizer
+    from ml_model import DrugInteractionPredictor
     print("Successfully imported synthetic_data module")
 except Exception as e:
     print(f"Error importing synthetic_data: {e}")
     print(traceback.format_exc())
     sys.exit(1)
 
+# The shared helpers live in common/ at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from common.result_cache import ResultCache
+from common.suggest import PrefixTrie, parse_suggest_params
+
+# The vocabularies are fixed, so they are sorted and indexed once at startup
+SORTED_MEDICATIONS = sorted(ALL_MEDICATIONS)
+SORTED_CONDITIONS = sorted(ALL_CONDITIONS)
+SUGGESTIONS = {'medication': PrefixTrie(), 'condition': PrefixTrie()}
+for field, names in (('medication', ALL_MEDICATIONS), ('condition', ALL_CONDITIONS)):
+    for name in names:
+        SUGGESTIONS[field].add(name, 0)
+
 app = Flask(__name__)
 CORS(app)
 
 # Use an absolute path for the model file
 CURRENT_DIR = Path(__file__).parent.absolute()
-MODEL_PATH = CURRENT_DIR / 'drug_interaction_model.joblib'
-model_data = None
+# The compact export is preferred over the full joblib model
+MODEL_PATH = CURRENT_DIR / 'drug_interaction_model.npz'
+if not MODEL_PATH.exists():
+    MODEL_PATH = CURRENT_DIR / 'drug_interaction_model.joblib'
+
+# Most patients one /api/analyze/batch request may carry
+MAX_BATCH_SIZE = 5000
+# Content types read as one JSON payload per line
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# Analyses of recently checked regimens, keyed by analysis_key(); cleared by
+# reload_model() and reload_rule_tables(). Size 0 disables it.
+analysis_cache = ResultCache(
+    max_entries=int(os.environ.get('CLINIQA_ANALYZE_CACHE_SIZE', '') or 4096),
+    ttl=float(os.environ.get('CLINIQA_ANALYZE_CACHE_TTL', '') or 600)
+)
 
 print(f"Looking for model at: {MODEL_PATH}")
 
-try:
-    if os.path.exists(MODEL_PATH):
-        print(f"Loading model from {MODEL_PATH}...")
-        model_data = joblib.load(MODEL_PATH)
-        print("Model loaded successfully!")
-    else:
-        print(f"Model file {MODEL_PATH} not found. Using rule-based predictions only.")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    print(traceback.format_exc())
-    print("Will use rule-based predictions only.")
+# The model is memory-mapped on first use (or by the warm-up thread started
+# in __main__), so startup does not wait for it
+predictor = DrugInteractionPredictor(MODEL_PATH, lazy=True)
+if predictor.pending_model_path is not None:
+    print(f"Model found at {MODEL_PATH}, it will be loaded on first use")
+else:
+    print(f"Model file {MODEL_PATH} not found. Using rule-based predictions only.")
 
 @app.route('/')
 def home():
@@ -74,7 +102,9 @@ def analyze_medications():
     
     Takes patient data including current medications, drug to check,
     pre-existing conditions, age, and weight to predict potential
-    adverse reactions.
+    adverse reactions. The reactions come from the interaction rules;
+    set include_ml to true to also merge in confident predictions of the
+    trained model, when one is available.
     
     Returns:
         JSON with analysis results or error message
@@ -82,47 +112,14 @@ def analyze_medications():
     try:
         data = request.get_json()
         
-        # Extract patient information
-        current_medications = data.get('current_medications', [])
-        drug_to_use = data.get('drug_to_use', '')
-        preexisting_conditions = data.get('preexisting_conditions', [])
-        
-        # Extract and validate age
-        try:
-            age = int(data.get('age', 0))
-            if age < 1 or age > 120:
-                return jsonify({
-                    'success': False,
-                    'error': 'Age must be between 1 and 120 years'
-                }), 400
-        except (ValueError, TypeError):
+        patients, errors = validate_patients([data])
+        if errors[0]:
             return jsonify({
                 'success': False,
-                'error': 'Invalid age value'
+                'error': errors[0]
             }), 400
         
-        # Extract and validate weight
-        try:
-            weight = float(data.get('weight', 0.0))
-            if weight < 1 or weight > 300:
-                return jsonify({
-                    'success': False,
-                    'error': 'Weight must be between 1 and 300 kg'
-                }), 400
-        except (ValueError, TypeError):
-            return jsonify({
-                'success': False,
-                'error': 'Invalid weight value'
-            }), 400
-        
-        # Run rule-based prediction
-        analysis = rule_based_prediction(
-            current_medications=current_medications,
-            drug_to_use=drug_to_use,
-            preexisting_conditions=preexisting_conditions,
-            age=age,
-            weight=weight
-        )
+        analysis = analyze_patients(patients)[0]
 
         return jsonify({
             'success': True,
@@ -137,6 +134,62 @@ def analyze_medications():
             'error': str(e)
         }), 400
 
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Analyze potential adverse drug reactions for a batch of patients
+    
+    Takes a JSON array of /api/analyze payloads, or NDJSON with one payload
+    per line. Every payload is validated, and the valid ones are analyzed
+    together, so one bad entry does not fail the rest of the batch.
+    
+    Returns:
+        JSON with one result per payload, in request order: the analysis,
+        or the error that payload was rejected with
+    """
+    try:
+        payloads, errors = parse_batch(request)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    if len(payloads) > MAX_BATCH_SIZE:
+        return jsonify({
+            'success': False,
+            'error': f'A batch may hold at most {MAX_BATCH_SIZE} patients'
+        }), 413
+    
+    try:
+        patients, validation_errors = validate_patients(payloads)
+        errors = [error or validation_error for error, validation_error in zip(errors, validation_errors)]
+        
+        valid = [i for i, error in enumerate(errors) if error is None]
+        analyses = dict(zip(valid, analyze_patients([patients[i] for i in valid])))
+        
+        results = []
+        for i, error in enumerate(errors):
+            if error is None:
+                results.append({'index': i, 'success': True, 'analysis': analyses[i]})
+            else:
+                results.append({'index': i, 'success': False, 'error': error})
+        
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'failed': len(results) - len(valid),
+            'results': results
+        })
+    
+    except Exception as e:
+        print(f"Error in batch API: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 def rule_based_prediction(current_medications, drug_to_use, preexisting_conditions, age, weight):
     """
     Use rule-based approach to predict adverse reactions
@@ -172,6 +225,294 @@ def rule_based_prediction(current_medications, drug_to_use, preexisting_conditio
         }
     }
 
+def parse_batch(req):
+    """
+    Read the payloads of an /api/analyze/batch request
+    
+    Returns:
+        Tuple of (payloads, errors); errors[i] is set when payload i was an
+        NDJSON line that could not be parsed
+    
+    Raises:
+        ValueError: If the body is neither a JSON array nor NDJSON
+    """
+    if req.mimetype in NDJSON_TYPES:
+        payloads = []
+        errors = []
+        for number, line in enumerate(req.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                payloads.append(json.loads(line))
+                errors.append(None)
+            except ValueError:
+                payloads.append(None)
+                errors.append(f'Invalid JSON on line {number}')
+        return payloads, errors
+    
+    payloads = req.get_json(silent=True)
+    if not isinstance(payloads, list):
+        raise ValueError('Request body must be a JSON array of patients or NDJSON')
+    return payloads, [None] * len(payloads)
+
+def is_name_list(value):
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+def validate_patients(payloads):
+    """
+    Validate a batch of /api/analyze payloads
+    
+    Age and weight are converted per payload, then range-checked for the
+    whole batch at once.
+    
+    Returns:
+        Tuple of (patients, errors): patients[i] holds the keyword arguments
+        of rule_based_prediction for payload i plus its include_ml flag, or
+        None when errors[i] says why it was rejected
+    """
+    n = len(payloads)
+    patients = [None] * n
+    errors = [None] * n
+    ages = np.zeros(n)
+    weights = np.zeros(n)
+    age_parsed = np.zeros(n, dtype=bool)
+    weight_parsed = np.zeros(n, dtype=bool)
+    
+    for i, data in enumerate(payloads):
+        if not isinstance(data, dict):
+            errors[i] = 'Patient data must be a JSON object'
+            continue
+        
+        current_medications = data.get('current_medications', [])
+        drug_to_use = data.get('drug_to_use', '')
+        preexisting_conditions = data.get('preexisting_conditions', [])
+        if not is_name_list(current_medications):
+            errors[i] = 'Current medications must be a list of names'
+            continue
+        if not isinstance(drug_to_use, str):
+            errors[i] = 'Drug to use must be a name'
+            continue
+        if not is_name_list(preexisting_conditions):
+            errors[i] = 'Pre-existing conditions must be a list of names'
+            continue
+        include_ml = data.get('include_ml', False)
+        if not isinstance(include_ml, bool):
+            errors[i] = 'include_ml must be true or false'
+            continue
+        
+        patients[i] = {
+            'current_medications': current_medications,
+            'drug_to_use': drug_to_use,
+            'preexisting_conditions': preexisting_conditions,
+            'include_ml': include_ml
+        }
+        try:
+            patients[i]['age'] = int(data.get('age', 0))
+            ages[i] = patients[i]['age']
+            age_parsed[i] = True
+        except (ValueError, TypeError, OverflowError):
+            pass
+        try:
+            patients[i]['weight'] = float(data.get('weight', 0.0))
+            weights[i] = patients[i]['weight']
+            weight_parsed[i] = True
+        except (ValueError, TypeError):
+            pass
+    
+    age_in_range = (ages >= 1) & (ages <= 120)
+    weight_in_range = (weights >= 1) & (weights <= 300)
+    
+    for i in range(n):
+        if errors[i] is not None:
+            continue
+        if not age_parsed[i]:
+            errors[i] = 'Invalid age value'
+        elif not age_in_range[i]:
+            errors[i] = 'Age must be between 1 and 120 years'
+        elif not weight_parsed[i]:
+            errors[i] = 'Invalid weight value'
+        elif not weight_in_range[i]:
+            errors[i] = 'Weight must be between 1 and 300 kg'
+        if errors[i] is not None:
+            patients[i] = None
+    
+    return patients, errors
+
+def analyze_patients(patients):
+    """
+    Analyze validated patients
+    
+    Patients whose analysis_key was seen recently are answered from
+    analysis_cache. The rest are analyzed together: the
+    ones that set include_ml are featurized and scored by the model in one
+    pass, when a model is available, and its confident predictions are
+    merged into their rule-based reactions the same way
+    DrugInteractionPredictor.predict does. Everyone else gets the rule-based
+    reactions only.
+    
+    Args:
+        patients: Validated patients as returned by validate_patients()
+        
+    Returns:
+        List with the analysis of each patient
+    """
+    # The model is only loaded once a patient asks for it
+    model_loaded = any(patient['include_ml'] for patient in patients) and predictor.ensure_loaded()
+    
+    reactions = [None] * len(patients)
+    misses = []
+    for i, patient in enumerate(patients):
+        use_ml = model_loaded and patient['include_ml']
+        key = analysis_key(patient, use_ml)
+        reactions[i] = analysis_cache.get(key)
+        if reactions[i] is None:
+            misses.append((i, key, patient, use_ml))
+    
+    if misses:
+        ml_misses = [j for j, (_, _, _, use_ml) in enumerate(misses) if use_ml]
+        ml_reactions = predict_reactions([misses[j][2] for j in ml_misses]) if ml_misses else None
+        ml_by_miss = dict(zip(ml_misses, ml_reactions or []))
+        for j, (i, key, patient, _) in enumerate(misses):
+            reactions[i] = rule_based_prediction(
+                patient['current_medications'],
+                patient['drug_to_use'],
+                patient['preexisting_conditions'],
+                patient['age'],
+                patient['weight']
+            )['adverse_reactions']
+            # When no rule fires, common side effects are drawn at random;
+            # caching one draw would repeat it for the whole TTL
+            drawn = any(reaction['type'] == 'common-effect' for reaction in reactions[i])
+            if j in ml_by_miss:
+                reactions[i] = merge_reactions(ml_by_miss[j], reactions[i])
+            if not drawn:
+                analysis_cache.put(key, reactions[i])
+    
+    return [
+        {
+            'adverse_reactions': patient_reactions,
+            'medication_info': {
+                'drug_to_use': patient['drug_to_use'],
+                'current_medications': patient['current_medications'],
+                'preexisting_conditions': patient['preexisting_conditions']
+            },
+            'patient_info': {
+                'age': patient['age'],
+                'weight': patient['weight']
+            }
+        }
+        for patient, patient_reactions in zip(patients, reactions)
+    ]
+
+def reload_model():
+    """
+    Load MODEL_PATH again, e.g. after retraining, and drop the analyses
+    made with the previous model
+    """
+    if MODEL_PATH.exists():
+        predictor.reload(MODEL_PATH)
+    analysis_cache.clear()
+
+def reload_rule_tables():
+    """
+    Re-read the interaction tables of synthetic_data after they were edited,
+    and drop the analyses made with the previous ones
+    
+    The medication and condition vocabularies used for features and
+    suggestions stay as they were at startup.
+    """
+    global generate_adverse_reactions
+    import synthetic_data
+    generate_adverse_reactions = importlib.reload(synthetic_data).generate_adverse_reactions
+    analysis_cache.clear()
+
+def analysis_key(patient, use_ml):
+    """
+    Cache key holding only what the analysis of a patient depends on
+    
+    The rules match medication and condition names exactly and report
+    reactions in the order the names were given, so the lists join the key
+    as sent. Of age and weight the rules only ask whether the patient is
+    over 65 and under 50 kg, and the weight itself is quoted in the
+    low-weight explanation. The model sees exact age and weight, so they
+    join the key when its predictions are merged in, along with the model
+    generation so a reload retires older entries.
+    """
+    weight = patient['weight']
+    key = (
+        tuple(patient['current_medications']),
+        patient['drug_to_use'],
+        tuple(patient['preexisting_conditions']),
+        patient['age'] > 65,
+        weight if weight < 50 else None
+    )
+    if use_ml:
+        key += (predictor.generation, patient['age'], weight)
+    return key
+
+def predict_reactions(patients):
+    """
+    Score a batch of patients with the loaded reaction classifier
+    
+    Returns:
+        List with the ML-predicted reactions of each patient, or None if
+        the model could not be applied
+    """
+    try:
+        features = featurizer.transform(
+            [patient['current_medications'] for patient in patients],
+            [patient['preexisting_conditions'] for patient in patients],
+            [patient['drug_to_use'] for patient in patients],
+            [patient['age'] for patient in patients],
+            [patient['weight'] for patient in patients]
+        )
+        # Probability of the positive class, one column per reaction label
+        positive = predictor.reaction_probabilities(features)
+        labels = predictor.reaction_mlb.classes_
+    except Exception as e:
+        print(f"ML prediction failed, using rule-based predictions only: {e}")
+        return None
+    
+    predictions = []
+    for row in positive:
+        # Top 5 reactions, kept when the model is confident about them
+        top = np.argsort(-row, kind='stable')[:5]
+        predictions.append([
+            {
+                'reaction': labels[j],
+                'probability': f"{row[j]:.2f}",
+                'severity': 'HIGH' if row[j] > 0.7 else 'MEDIUM',
+                'source': 'ML prediction',
+                'mechanism': 'Statistical pattern from training data',
+                'type': 'ML-predicted'
+            }
+            for j in top if row[j] > 0.5
+        ])
+    return predictions
+
+def merge_reactions(ml_reactions, rule_reactions):
+    """Combine ML and rule-based reactions, ordered by severity"""
+    combined = list(ml_reactions)
+    for reaction in rule_reactions:
+        if not any(r.get('reaction') == reaction.get('reaction') for r in combined):
+            reaction['source'] = 'Rule-based'
+            combined.append(reaction)
+    
+    return [r for severity in ('HIGH', 'MEDIUM', 'LOW') for r in combined if r.get('severity') == severity]
+
+@app.route('/api/analyze/cache', methods=['GET'])
+def analysis_cache_stats():
+    """
+    API endpoint reporting the size and hit/miss counters of the analysis cache
+    
+    Returns:
+        JSON with the cache statistics
+    """
+    return jsonify({
+        'success': True,
+        'cache': analysis_cache.stats()
+    })
+
 @app.route('/api/medications', methods=['GET'])
 def get_medications():
     """
@@ -182,7 +523,7 @@ def get_medications():
     """
     return jsonify({
         'success': True,
-        'medications': sorted(ALL_MEDICATIONS)
+        'medications': SORTED_MEDICATIONS
     })
 
 @app.route('/api/conditions', methods=['GET'])
@@ -195,9 +536,41 @@ def get_conditions():
     """
     return jsonify({
         'success': True,
-        'conditions': sorted(ALL_CONDITIONS)
+        'conditions': SORTED_CONDITIONS
+    })
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest():
+    """
+    API endpoint for typeahead over the medication and condition names
+    
+    Query parameters: field (medication or condition), q (typed text) and
+    k (number of suggestions, default 10).
+    
+    Returns:
+        JSON with the names that have a word starting with q, alphabetically
+    """
+    try:
+        field, prefix, k = parse_suggest_params(
+            request.args.get('field'), request.args.get('q'), request.args.get('k'), SUGGESTIONS
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    return jsonify({
+        'success': True,
+        'suggestions': [name for name, _ in SUGGESTIONS[field].suggest(prefix, k)]
     })
 
 if __name__ == '__main__':
+    # Load the model in the background while the server starts
+    threading.Thread(target=predictor.warm_up, daemon=True).start()
+    
+    # kill -HUP reloads the model file and the interaction tables
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: (reload_rule_tables(), reload_model()))
+    
     # Start the Flask server without debug mode to prevent auto-restart
     app.run(debug=False, port=8084, host='0.0.0.0') 
\ No newline at end of file
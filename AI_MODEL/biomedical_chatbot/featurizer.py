@@ -0,0 +1,174 @@
+"""
+Vectorized feature extraction for the drug interaction model
+
+Produces exactly the layout of synthetic_data.generate_feature_vector, for
+a whole batch of patients at once:
+
+    [age / 100, weight / 200,
+     current medications one-hot (ALL_MEDICATIONS),
+     drug to check one-hot (ALL_MEDICATIONS),
+     pre-existing conditions one-hot (ALL_CONDITIONS),
+     number of medications / 10, number of conditions / 10]
+
+Names are resolved through precomputed name -> column maps, so a patient
+costs one dictionary lookup per listed medication or condition instead of a
+scan of the whole vocabulary.
+"""
+
+import numpy as np
+from typing import Any, Dict, List, Sequence
+
+from synthetic_data import ALL_MEDICATIONS, ALL_CONDITIONS
+
+# Bumped whenever the feature layout changes beyond its vocabularies
+FEATURE_SCHEMA_VERSION = 1
+
+
+def _column_map(names: List[str], offset: int) -> Dict[str, List[int]]:
+    """Map each name to its one-hot columns; a name listed twice sets both"""
+    columns = {}
+    for i, name in enumerate(names):
+        columns.setdefault(name, []).append(offset + i)
+    return columns
+
+
+class Featurizer:
+    """Turns batches of patients into feature matrices for DrugInteractionPredictor"""
+
+    def __init__(self, medications: List[str] = ALL_MEDICATIONS, conditions: List[str] = ALL_CONDITIONS):
+        self.medications = list(medications)
+        self.conditions = list(conditions)
+
+        self.medication_offset = 2
+        self.drug_offset = self.medication_offset + len(self.medications)
+        self.condition_offset = self.drug_offset + len(self.medications)
+        self.count_offset = self.condition_offset + len(self.conditions)
+        self.num_features = self.count_offset + 2
+
+        self.medication_columns = _column_map(self.medications, self.medication_offset)
+        self.drug_columns = _column_map(self.medications, self.drug_offset)
+        self.condition_columns = _column_map(self.conditions, self.condition_offset)
+
+    def schema(self) -> Dict[str, Any]:
+        """Describe the feature layout, for storing alongside a trained model"""
+        return {
+            'version': FEATURE_SCHEMA_VERSION,
+            'medications': list(self.medications),
+            'conditions': list(self.conditions)
+        }
+
+    def check_schema(self, schema: Dict[str, Any]):
+        """
+        Check that a model built for schema can be fed by this featurizer
+
+        Raises:
+            ValueError: If the layout version or either vocabulary differs
+        """
+        if int(schema['version']) != FEATURE_SCHEMA_VERSION:
+            raise ValueError(
+                f"Model uses feature schema version {schema['version']}, expected {FEATURE_SCHEMA_VERSION}"
+            )
+        if list(schema['medications']) != self.medications:
+            raise ValueError("Model was built for a different medication list (ALL_MEDICATIONS)")
+        if list(schema['conditions']) != self.conditions:
+            raise ValueError("Model was built for a different condition list (ALL_CONDITIONS)")
+
+    def transform(self, medications: Sequence[Sequence[str]], conditions: Sequence[Sequence[str]],
+                  drugs: Sequence[str], ages: Sequence[float], weights: Sequence[float],
+                  sparse: bool = False, dtype=np.float64):
+        """
+        Featurize a batch of patients given column by column
+
+        Args:
+            medications: Current medications of each patient
+            conditions: Pre-existing conditions of each patient
+            drugs: Drug to check for each patient
+            ages: Age of each patient in years
+            weights: Weight of each patient in kg
+            sparse: Return a scipy.sparse CSR matrix instead of a dense array
+            dtype: Element type; the default float64 matches generate_feature_vector bit for bit
+
+        Returns:
+            Matrix of shape (patients, num_features)
+        """
+        n = len(drugs)
+        rows = []
+        columns = []
+        medication_counts = np.empty(n, dtype=np.float64)
+        condition_counts = np.empty(n, dtype=np.float64)
+
+        medication_columns = self.medication_columns
+        drug_columns = self.drug_columns
+        condition_columns = self.condition_columns
+        for row, (meds, conds, drug) in enumerate(zip(medications, conditions, drugs)):
+            # Membership, not multiplicity, sets a column; counts include
+            # duplicate and unknown names, like len() in generate_feature_vector
+            for med in set(meds):
+                for column in medication_columns.get(med, ()):
+                    rows.append(row)
+                    columns.append(column)
+            for column in drug_columns.get(drug, ()):
+                rows.append(row)
+                columns.append(column)
+            for cond in set(conds):
+                for column in condition_columns.get(cond, ()):
+                    rows.append(row)
+                    columns.append(column)
+            medication_counts[row] = len(meds)
+            condition_counts[row] = len(conds)
+
+        dense = np.column_stack([
+            np.asarray(ages, dtype=np.float64) / 100.0,
+            np.asarray(weights, dtype=np.float64) / 200.0,
+            medication_counts / 10.0,
+            condition_counts / 10.0
+        ])
+        dense_columns = [0, 1, self.count_offset, self.count_offset + 1]
+
+        if sparse:
+            from scipy.sparse import csr_matrix
+            one_hot = csr_matrix(
+                (np.ones(len(rows), dtype=dtype), (rows, columns)),
+                shape=(n, self.num_features)
+            )
+            numeric = csr_matrix(
+                (dense.ravel().astype(dtype), (np.repeat(np.arange(n), 4), np.tile(dense_columns, n))),
+                shape=(n, self.num_features)
+            )
+            return (one_hot + numeric).tocsr()
+
+        matrix = np.zeros((n, self.num_features), dtype=dtype)
+        matrix[rows, columns] = 1
+        matrix[:, dense_columns] = dense
+        return matrix
+
+    def transform_samples(self, samples: Sequence[Dict[str, Any]], **kwargs):
+        """Featurize samples as produced by generate_synthetic_data()"""
+        return self.transform(
+            [sample['current_medications'] for sample in samples],
+            [sample['pre_existing_conditions'] for sample in samples],
+            [sample['drug_to_check'] for sample in samples],
+            [sample['age'] for sample in samples],
+            [sample['weight'] for sample in samples],
+            **kwargs
+        )
+
+    def transform_cohort(self, cohort: Dict[str, Any], **kwargs):
+        """Featurize a columnar cohort as produced by generate_cohort()"""
+        return self.transform(
+            cohort['current_medications'],
+            cohort['pre_existing_conditions'],
+            cohort['drug_to_check'],
+            cohort['age'],
+            cohort['weight'],
+            **kwargs
+        )
+
+    def transform_one(self, medications: Sequence[str], conditions: Sequence[str], drug: str,
+                      age: float, weight: float):
+        """Featurize a single patient into a (1, num_features) array"""
+        return self.transform([medications], [conditions], [drug], [age], [weight])
+
+
+# Shared instance over the standard vocabularies
+featurizer = Featurizer()
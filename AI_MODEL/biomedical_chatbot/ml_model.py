@@ -1,9 +1,16 @@
+import argparse
 import json
+import struct
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
 from typing import List, Dict, Any
 import os
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, HistGradientBoostingClassifier
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.multioutput import MultiOutputClassifier
 from sklearn.model_selection import train_test_split
@@ -11,8 +18,7 @@ import joblib
 from collections import Counter
 
 from synthetic_data import (
-    generate_synthetic_data, 
-    generate_feature_vector,
+    generate_cohort,
     generate_adverse_reactions,
     ALL_MEDICATIONS,
     ALL_CONDITIONS,
@@ -20,19 +26,138 @@ from synthetic_data import (
     INTERACTION_DICT,
     CONDITION_INTERACTION_DICT
 )
+from featurizer import featurizer
+from tree_compiler import CompiledGradientBoosting
+
+# Estimator used for each reaction label; the histogram-based one fits large
+# cohorts much faster but is served by sklearn instead of tree_compiler
+REACTION_BACKENDS = ('gradient_boosting', 'hist_gradient_boosting')
+# Version of the compact .npz export written by export_model()
+COMPACT_FORMAT_VERSION = 1
+MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drug_interaction_model.joblib')
+
+@contextmanager
+def timed(timings, stage):
+    """Record the wall-clock seconds spent in the with block under timings[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+def reaction_estimator(backend, random_state):
+    """Per-label estimator of the reaction head for a REACTION_BACKENDS name"""
+    if backend == 'gradient_boosting':
+        return GradientBoostingClassifier(n_estimators=100, random_state=random_state)
+    if backend == 'hist_gradient_boosting':
+        return HistGradientBoostingClassifier(max_iter=100, random_state=random_state)
+    raise ValueError(f"Unknown backend '{backend}', expected one of: {', '.join(REACTION_BACKENDS)}")
+
+def load_npz(path, mmap_mode='r'):
+    """
+    Arrays of an .npz file by name, with the members stored uncompressed
+    memory-mapped as np.load(mmap_mode=...) maps a .npy file
+    
+    np.load reads every member of an .npz into private memory. Mapped
+    members stay in the page cache instead, shared by every process that
+    loads the same file. Compressed and empty members are read.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            
+            # The .npy data follows the member's local header, whose name
+            # and extra fields have variable lengths
+            file.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<26xHH', file.read(30))
+            file.seek(name_length + extra_length, os.SEEK_CUR)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            if dtype.hasobject:
+                raise ValueError(f"{name}: object arrays cannot be loaded")
+            if not shape or 0 in shape:
+                arrays[name] = np.fromfile(file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=file.tell(),
+                                     shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+def fit_label(estimator, X, y):
+    """Fit the estimator of one label; returns it with the seconds it took"""
+    start = time.perf_counter()
+    estimator.fit(X, y)
+    return estimator, time.perf_counter() - start
+
+def fitted_multioutput(estimator, estimators, X):
+    """MultiOutputClassifier of estimator made from per-label estimators fitted on X"""
+    classifier = MultiOutputClassifier(estimator)
+    classifier.estimators_ = estimators
+    classifier.n_features_in_ = X.shape[1]
+    return classifier
 
 class DrugInteractionPredictor:
-    def __init__(self, model_path=None):
-        """Initialize the drug interaction predictor"""
+    def __init__(self, model_path=None, lazy=False):
+        """
+        Initialize the drug interaction predictor
+        
+        Args:
+            model_path: Saved model to load, if it exists
+            lazy: Defer loading model_path until the first prediction,
+                ensure_loaded() or warm_up()
+        """
         self.is_trained = False
         self.reaction_mlb = MultiLabelBinarizer()
         self.severity_mlb = MultiLabelBinarizer()
         self.reaction_classifier = None
         self.severity_classifier = None
+        # Flat-array form of reaction_classifier used for inference
+        self.compiled_reactions = None
+        # Wall-clock seconds of each stage of the last train() call
+        self.training_timings = {}
+        # Counts models trained or loaded, so cached results can tell they are stale
+        self.generation = 0
+        # Model file still to be loaded by ensure_loaded()
+        self.pending_model_path = None
+        self._load_lock = threading.Lock()
         
         if model_path and os.path.exists(model_path):
+            if lazy:
+                self.pending_model_path = model_path
+            else:
+                self.load_model(model_path)
+    
+    def ensure_loaded(self):
+        """Load the pending model file, if any; returns whether a trained model is available"""
+        if self.pending_model_path is not None:
+            with self._load_lock:
+                # Another thread may have loaded it while this one waited
+                if self.pending_model_path is not None:
+                    self.load_model(self.pending_model_path)
+                    self.pending_model_path = None
+        return self.is_trained
+    
+    def reload(self, model_path):
+        """Load model_path in place of the current model, e.g. after retraining"""
+        with self._load_lock:
+            self.pending_model_path = None
             self.load_model(model_path)
-        
+    
+    def warm_up(self):
+        """Load the model and run one prediction, so the first request does not pay for either"""
+        start = time.perf_counter()
+        if not self.ensure_loaded():
+            return
+        self.reaction_probabilities(featurizer.transform_one([], [], ALL_MEDICATIONS[0], 50, 70))
+        print(f"Model warmed up in {time.perf_counter() - start:.2f}s")
+    
     def prepare_data(self, X, y):
         """Prepare data for training the ML model"""
         # Extract reactions and severities
@@ -43,80 +168,128 @@ class DrugInteractionPredictor:
         reactions_binary = self.reaction_mlb.fit_transform(reactions)
         severities_binary = self.severity_mlb.fit_transform(severities)
         
-        return np.array(X), reactions_binary, severities_binary
+        return np.asarray(X), reactions_binary, severities_binary
     
-    def train(self, num_samples=5000, train_size=0.8, random_state=42):
-        """Train the drug interaction predictor on synthetic data"""
-        print(f"Generating {num_samples} synthetic training samples...")
-        # Generate synthetic data
-        data = generate_synthetic_data(num_samples)
+    def train(self, num_samples=5000, train_size=0.8, random_state=42, n_jobs=None,
+              backend='gradient_boosting'):
+        """
+        Train the drug interaction predictor on synthetic data seeded with random_state
         
-        # Prepare features and targets
-        X = []
-        y = []
+        Args:
+            n_jobs: Worker processes of the pool that fits every reaction
+                and severity label, both heads at once; None means one, -1
+                all cores. The fitted model does not depend on it.
+            backend: Reaction estimator, one of REACTION_BACKENDS
+        """
+        # Fail before the slow stages if the backend is unknown
+        reaction_estimator(backend, random_state)
+        timings = {}
         
-        for sample in data:
-            # Generate feature vector
-            features = generate_feature_vector(
-                sample['current_medications'],
-                sample['pre_existing_conditions'],
-                sample['drug_to_check'],
-                sample['age'],
-                sample['weight']
-            )
+        print(f"Generating {num_samples} synthetic training samples...")
+        with timed(timings, 'generate'):
+            cohort = generate_cohort(num_samples, seed=random_state)
+        
+        with timed(timings, 'featurize'):
+            # Featurize the whole cohort in one pass
+            X = featurizer.transform_cohort(cohort)
             
             # Extract target variables (adverse reactions)
-            reactions = [r['reaction'] for r in sample['adverse_reactions']]
-            severities = [r['severity'] for r in sample['adverse_reactions']]
+            y = [
+                {
+                    'reactions': [r['reaction'] for r in adverse_reactions],
+                    'severities': [r['severity'] for r in adverse_reactions]
+                }
+                for adverse_reactions in cohort['adverse_reactions']
+            ]
             
-            # Add to dataset
-            X.append(features)
-            y.append({'reactions': reactions, 'severities': severities})
-        
-        # Prepare data for training
-        X_array, reactions_binary, severities_binary = self.prepare_data(X, y)
+            # Prepare data for training
+            X_array, reactions_binary, severities_binary = self.prepare_data(X, y)
+            
+            # Split into training and validation sets
+            X_train, X_val, y_reactions_train, y_reactions_val, y_severities_train, y_severities_val = train_test_split(
+                X_array, reactions_binary, severities_binary, 
+                train_size=train_size, 
+                random_state=random_state
+            )
+            
+            # Gradient boosting needs both classes per label; drop reactions
+            # too rare to occur in the training split
+            trainable = y_reactions_train.min(axis=0) != y_reactions_train.max(axis=0)
+            if not trainable.all():
+                print(f"Skipping {int((~trainable).sum())} reactions absent from the training split")
+                self.reaction_mlb = MultiLabelBinarizer(classes=list(self.reaction_mlb.classes_[trainable])).fit([])
+                y_reactions_train = y_reactions_train[:, trainable]
+                y_reactions_val = y_reactions_val[:, trainable]
         
-        # Split into training and validation sets
-        X_train, X_val, y_reactions_train, y_reactions_val, y_severities_train, y_severities_val = train_test_split(
-            X_array, reactions_binary, severities_binary, 
-            train_size=train_size, 
-            random_state=random_state
+        print(f"Training reaction and severity models ({backend}, n_jobs={n_jobs})...")
+        reaction_template = reaction_estimator(backend, random_state)
+        severity_template = RandomForestClassifier(n_estimators=100, random_state=random_state)
+        # One task per label of either head, all in the same pool, so the
+        # reaction labels overlap the severity forests. The forests are the
+        # longest tasks and go first, leaving the short ones to fill in.
+        tasks = (
+            [(severity_template, y_severities_train[:, j]) for j in range(y_severities_train.shape[1])] +
+            [(reaction_template, y_reactions_train[:, j]) for j in range(y_reactions_train.shape[1])]
         )
+        with timed(timings, 'fit'):
+            fitted = joblib.Parallel(n_jobs=n_jobs)(
+                joblib.delayed(fit_label)(clone(template), X_train, labels) for template, labels in tasks
+            )
         
-        print("Training reaction prediction model...")
-        # Train reaction prediction model
-        self.reaction_classifier = MultiOutputClassifier(
-            GradientBoostingClassifier(n_estimators=100, random_state=random_state)
+        num_severities = y_severities_train.shape[1]
+        self.severity_classifier = fitted_multioutput(
+            severity_template, [estimator for estimator, _ in fitted[:num_severities]], X_train
         )
-        self.reaction_classifier.fit(X_train, y_reactions_train)
-        
-        print("Training severity prediction model...")
-        # Train severity prediction model
-        self.severity_classifier = MultiOutputClassifier(
-            RandomForestClassifier(n_estimators=100, random_state=random_state)
+        self.reaction_classifier = fitted_multioutput(
+            reaction_template, [estimator for estimator, _ in fitted[num_severities:]], X_train
         )
-        self.severity_classifier.fit(X_train, y_severities_train)
+        # Seconds of work per head, summed over its labels; with several
+        # workers 'fit' is less than their total
+        timings['fit_reactions_work'] = sum(seconds for _, seconds in fitted[num_severities:])
+        timings['fit_severities_work'] = sum(seconds for _, seconds in fitted[:num_severities])
         
-        # Calculate validation accuracy
-        reaction_acc = self.reaction_classifier.score(X_val, y_reactions_val)
-        severity_acc = self.severity_classifier.score(X_val, y_severities_val)
+        with timed(timings, 'validate'):
+            # Calculate validation accuracy
+            reaction_acc = self.reaction_classifier.score(X_val, y_reactions_val)
+            severity_acc = self.severity_classifier.score(X_val, y_severities_val)
         
         print(f"Validation accuracy - Reactions: {reaction_acc:.4f}, Severities: {severity_acc:.4f}")
+        print("Stage timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
         
+        self.training_timings = timings
         self.is_trained = True
+        self.generation += 1
+        self.compile()
         return self
     
+    def compile(self):
+        """Flatten the reaction trees for vectorized inference; sklearn is used if that fails"""
+        try:
+            self.compiled_reactions = CompiledGradientBoosting.from_multioutput(self.reaction_classifier)
+        except Exception as e:
+            print(f"Warning: Could not compile reaction model, using sklearn inference: {e}")
+            self.compiled_reactions = None
+    
+    def reaction_probabilities(self, features):
+        """Positive-class probability of each reaction label, shape (rows, labels)"""
+        if self.compiled_reactions is not None:
+            return self.compiled_reactions.predict_proba(features)
+        return np.column_stack([
+            label_probs[:, 1] if label_probs.shape[1] > 1 else np.zeros(len(label_probs))
+            for label_probs in self.reaction_classifier.predict_proba(features)
+        ])
+    
     def predict(self, current_medications: List[str], drug_to_use: str, 
                 preexisting_conditions: List[str], age: int, weight: float) -> Dict[str, Any]:
         """Predict potential adverse drug reactions using ML model and rule-based approach"""
         # Check if model is trained
-        if not self.is_trained:
+        if not self.ensure_loaded():
             print("Model not trained, using rule-based prediction only.")
             return self.rule_based_prediction(current_medications, drug_to_use, preexisting_conditions, age, weight)
         
         try:
             # Generate feature vector
-            features = generate_feature_vector(
+            features = featurizer.transform_one(
                 current_medications,
                 preexisting_conditions,
                 drug_to_use,
@@ -124,42 +297,14 @@ class DrugInteractionPredictor:
                 weight
             )
             
-            # Make predictions with ML model
-            reaction_pred = self.reaction_classifier.predict([features])[0]
-            
-            # Get probabilities
-            reaction_probs = []
-            try:
-                reaction_probs = self.reaction_classifier.predict_proba([features])
-            except Exception as e:
-                print(f"Warning: Error getting prediction probabilities: {e}")
+            # Probability of every reaction label in one pass
+            probabilities = self.reaction_probabilities(features)[0]
             
             # Get most likely reactions with probabilities
             reaction_probs_dict = {}
-            
-            # Fall back to rule-based if ML prediction fails
-            if len(reaction_probs) == 0 or reaction_pred.shape[0] == 0:
-                print("ML prediction failed, falling back to rule-based only")
-                return self.rule_based_prediction(current_medications, drug_to_use, preexisting_conditions, age, weight)
-            
-            # Get predicted reactions if possible
-            try:
-                predicted_reactions = self.reaction_mlb.inverse_transform(reaction_pred.reshape(1, -1))[0]
-            except Exception as e:
-                print(f"Warning: Could not transform reactions: {e}")
-                predicted_reactions = []
-            
-            # Process probabilities if available
-            if len(reaction_probs) > 0:
-                for i, estimator_probs in enumerate(reaction_probs):
-                    if i < len(self.reaction_classifier.estimators_) and len(estimator_probs[0]) > 1:
-                        try:
-                            label = self.reaction_mlb.classes_[i]
-                            prob = estimator_probs[0][1]  # Probability of positive class
-                            if prob > 0.3:  # Threshold for considering a reaction
-                                reaction_probs_dict[label] = prob
-                        except Exception as e:
-                            print(f"Warning: Error processing probability for class {i}: {e}")
+            for label, prob in zip(self.reaction_mlb.classes_, probabilities):
+                if prob > 0.3:  # Threshold for considering a reaction
+                    reaction_probs_dict[label] = prob
             
             # Sort by probability
             sorted_reactions = sorted(reaction_probs_dict.items(), key=lambda x: x[1], reverse=True)
@@ -222,24 +367,90 @@ class DrugInteractionPredictor:
         }
     
     def save_model(self, model_path: str):
-        """Save the trained model to disk"""
+        """
+        Save the trained model to disk
+        
+        A path ending in .npz gets the compact export of export_model().
+        Otherwise the file is a joblib pickle of the sklearn objects,
+        including the compiled reaction trees, for further training and
+        analysis. The export used for serving is then written next to it,
+        with the same name ending in .npz, whenever the reaction head could
+        be compiled.
+        """
         if not self.is_trained:
             raise ValueError("Model must be trained before saving")
         
+        if str(model_path).endswith('.npz'):
+            self.export_model(model_path)
+            return
+        
         model_data = {
             'reaction_classifier': self.reaction_classifier,
             'severity_classifier': self.severity_classifier,
             'reaction_mlb': self.reaction_mlb,
-            'severity_mlb': self.severity_mlb
+            'severity_mlb': self.severity_mlb,
+            'compiled_reactions': self.compiled_reactions,
+            'feature_schema': featurizer.schema()
         }
         
-        joblib.dump(model_data, model_path)
+        joblib.dump(model_data, model_path, compress=0)
         print(f"Model saved to {model_path}")
+        if self.compiled_reactions is not None:
+            self.export_model(os.path.splitext(str(model_path))[0] + '.npz')
+    
+    def export_model(self, model_path: str):
+        """
+        Save only what inference needs, as an .npz of plain arrays
+        
+        The file holds the compiled reaction trees (see
+        CompiledGradientBoosting.to_arrays), the reaction and severity label
+        vocabularies and the feature schema, and loads without unpickling.
+        The severity forest is not used for predictions and is left out.
+        Members are stored uncompressed so load_npz() can memory-map them.
+        """
+        if self.compiled_reactions is None:
+            raise ValueError("Only models with a compiled reaction head can be exported")
+        
+        schema = featurizer.schema()
+        np.savez(
+            model_path,
+            format_version=np.int32(COMPACT_FORMAT_VERSION),
+            schema_version=np.int32(schema['version']),
+            medications=np.array(schema['medications'], dtype=str),
+            conditions=np.array(schema['conditions'], dtype=str),
+            reaction_labels=np.array(list(self.reaction_mlb.classes_), dtype=str),
+            severity_labels=np.array(list(self.severity_mlb.classes_), dtype=str),
+            **self.compiled_reactions.to_arrays()
+        )
+        print(f"Model exported to {model_path}")
     
-    def load_model(self, model_path: str):
-        """Load a trained model from disk"""
+    def load_model(self, model_path: str, mmap_mode='r'):
+        """
+        Load a trained model from disk
+        
+        Args:
+            model_path: A joblib model, or a .npz export from export_model()
+            mmap_mode: How the arrays are mapped, as for np.load; with the
+                default 'r' they stay read-only in the page cache, shared by
+                every process serving the same file
+        
+        Only an .npz export is fully shared this way. Unpickling the sklearn
+        estimators of a joblib model copies their tree nodes into each
+        process, so servers should load the export.
+        
+        A model built for a different feature schema (e.g. another
+        ALL_MEDICATIONS list) is rejected.
+        """
         try:
-            model_data = joblib.load(model_path)
+            if str(model_path).endswith('.npz'):
+                self._load_export(model_path, mmap_mode)
+                print(f"Model loaded from {model_path}")
+                return
+            
+            model_data = joblib.load(model_path, mmap_mode=mmap_mode)
+            # Files saved before the schema was recorded are trusted as they are
+            if 'feature_schema' in model_data:
+                featurizer.check_schema(model_data['feature_schema'])
             
             self.reaction_classifier = model_data['reaction_classifier']
             self.severity_classifier = model_data['severity_classifier']
@@ -247,7 +458,57 @@ class DrugInteractionPredictor:
             self.severity_mlb = model_data['severity_mlb']
             
             self.is_trained = True
+            self.generation += 1
+            # Files saved before the compiled trees were stored get them now
+            self.compiled_reactions = model_data.get('compiled_reactions')
+            if self.compiled_reactions is None:
+                self.compile()
             print(f"Model loaded from {model_path}")
         except Exception as e:
             print(f"Error loading model: {e}")
-            self.is_trained = False 
\ No newline at end of file
+            self.is_trained = False
+    
+    def _load_export(self, model_path: str, mmap_mode='r'):
+        """Load a .npz written by export_model(); the sklearn classifiers stay unset"""
+        arrays = load_npz(model_path, mmap_mode)
+        version = int(arrays['format_version'])
+        if version != COMPACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format version {version}, expected {COMPACT_FORMAT_VERSION}")
+        featurizer.check_schema({
+            'version': arrays['schema_version'],
+            'medications': arrays['medications'].tolist(),
+            'conditions': arrays['conditions'].tolist()
+        })
+        compiled_reactions = CompiledGradientBoosting.from_arrays(arrays)
+        reaction_labels = arrays['reaction_labels'].tolist()
+        severity_labels = arrays['severity_labels'].tolist()
+        
+        if len(reaction_labels) != compiled_reactions.num_labels:
+            raise ValueError("Reaction labels do not match the compiled trees")
+        
+        self.reaction_classifier = None
+        self.severity_classifier = None
+        self.reaction_mlb = MultiLabelBinarizer(classes=reaction_labels).fit([])
+        self.severity_mlb = MultiLabelBinarizer(classes=severity_labels).fit([])
+        self.compiled_reactions = compiled_reactions
+        self.is_trained = True
+        self.generation += 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the drug interaction model on synthetic data')
+    parser.add_argument('--samples', type=int, default=5000, help='Synthetic patients to generate')
+    parser.add_argument('--jobs', type=int, default=-1, help='Parallel workers; -1 uses every core')
+    parser.add_argument('--backend', choices=REACTION_BACKENDS, default='gradient_boosting',
+                        help='Reaction estimator')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--output', default=MODEL_FILE,
+                        help='Model file path; a .npz path writes the compact export')
+    args = parser.parse_args()
+
+    predictor = DrugInteractionPredictor()
+    predictor.train(num_samples=args.samples, random_state=args.seed, n_jobs=args.jobs, backend=args.backend)
+    predictor.save_model(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -318,65 +318,139 @@ for category, drugs in MEDICATIONS.items():
                     'severity': severity
                 }
 
-def generate_synthetic_data(num_samples=1000):
-    """Generate synthetic training data for drug interaction prediction"""
-    data = []
-    
-    for _ in range(num_samples):
-        # Randomly select 1-4 current medications
-        num_current_meds = random.randint(1, 4)
-        current_medications = random.sample(ALL_MEDICATIONS, num_current_meds)
-        
-        # Randomly select 1-3 pre-existing conditions
-        num_conditions = random.randint(1, 3)
-        pre_existing_conditions = random.sample(ALL_CONDITIONS, num_conditions)
-        
-        # Randomly select a drug to check
-        drug_to_check = random.choice(ALL_MEDICATIONS)
-        
-        # Determine age with realistic distribution
-        # Higher probability of elderly patients (more likely to have multiple medications)
-        age_group = random.choices(
-            ["adult", "elderly", "very_elderly"], 
-            weights=[0.5, 0.3, 0.2], 
-            k=1
-        )[0]
-        
-        if age_group == "adult":
-            age = random.randint(18, 64)
-        elif age_group == "elderly":
-            age = random.randint(65, 85)
-        else:  # very_elderly
-            age = random.randint(86, 100)
-        
-        # Determine weight with realistic distribution based on age
-        # Use normal distribution around average weights for different age groups
-        if age < 65:
-            # Adult: mean weight ~70kg with standard deviation 15kg
-            weight = max(1, min(200, round(random.normalvariate(70.0, 15.0), 1)))
-        else:
-            # Elderly: slightly lower mean weight ~65kg with standard deviation 12kg
-            weight = max(1, min(200, round(random.normalvariate(65.0, 12.0), 1)))
-        
-        # Generate actual adverse reactions
-        adverse_reactions = generate_adverse_reactions(current_medications, drug_to_check, pre_existing_conditions, age, weight)
-        
-        # Create sample
-        sample = {
-            'current_medications': current_medications,
-            'pre_existing_conditions': pre_existing_conditions,
-            'drug_to_check': drug_to_check,
+# Age groups of the synthetic cohort: (name, probability, youngest, oldest)
+# Higher probability of elderly patients (more likely to have multiple medications)
+AGE_GROUPS = [
+    ('adult', 0.5, 18, 64),
+    ('elderly', 0.3, 65, 85),
+    ('very_elderly', 0.2, 86, 100)
+]
+
+# Weight distribution (mean kg, standard deviation kg) below and from age 65
+ADULT_WEIGHT = (70.0, 15.0)
+ELDERLY_WEIGHT = (65.0, 12.0)
+
+
+def _sample_without_replacement(rng, population_size, counts, max_count):
+    """
+    Draw counts[i] distinct indices below population_size for every row i
+    
+    Returns:
+        Array of shape (len(counts), max_count); only the first counts[i]
+        entries of row i are used
+    """
+    n = len(counts)
+    picks = rng.integers(0, population_size, size=(n, max_count))
+    # Redraw rows holding a repeated index until every row is distinct;
+    # rows are exchangeable, so the first counts[i] columns are a uniform
+    # sample without replacement
+    while True:
+        ordered = np.sort(picks, axis=1)
+        repeated = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+        if not len(repeated):
+            break
+        picks[repeated] = rng.integers(0, population_size, size=(len(repeated), max_count))
+    return picks
+
+
+def _names(picks, counts, names):
+    """Turn the used entries of each row of picks into a list of names"""
+    rows = np.array(names, dtype=object)[picks].tolist()
+    return [row[:count] for row, count in zip(rows, counts.tolist())]
+
+
+def generate_cohort(num_samples=1000, seed=None, with_reactions=True):
+    """
+    Generate a synthetic patient cohort column by column
+    
+    Every attribute is drawn for the whole cohort at once from a
+    numpy.random.Generator, so the same seed always gives the same cohort.
+    
+    Args:
+        num_samples: Number of patients
+        seed: Seed of the generator; None draws fresh entropy
+        with_reactions: Also derive each patient's adverse reactions
+    
+    Returns:
+        Dict of per-patient columns: 'current_medications',
+        'pre_existing_conditions' and 'drug_to_check' as lists of names,
+        'age' and 'weight' as NumPy arrays, and 'adverse_reactions' as a
+        list of reaction lists when with_reactions is set
+    """
+    rng = np.random.default_rng(seed)
+    
+    # 1-4 current medications, 1-3 pre-existing conditions, one drug to check
+    medication_counts = rng.integers(1, 5, size=num_samples)
+    medication_picks = _sample_without_replacement(rng, len(ALL_MEDICATIONS), medication_counts, 4)
+    condition_counts = rng.integers(1, 4, size=num_samples)
+    condition_picks = _sample_without_replacement(rng, len(ALL_CONDITIONS), condition_counts, 3)
+    drugs = [ALL_MEDICATIONS[i] for i in rng.integers(0, len(ALL_MEDICATIONS), size=num_samples).tolist()]
+    
+    # Age within a randomly chosen age group
+    groups = rng.choice(len(AGE_GROUPS), size=num_samples, p=[group[1] for group in AGE_GROUPS])
+    youngest = np.array([group[2] for group in AGE_GROUPS])[groups]
+    oldest = np.array([group[3] for group in AGE_GROUPS])[groups]
+    ages = rng.integers(youngest, oldest + 1)
+    
+    # Weight from a normal distribution that depends on age
+    elderly = ages >= 65
+    means = np.where(elderly, ELDERLY_WEIGHT[0], ADULT_WEIGHT[0])
+    deviations = np.where(elderly, ELDERLY_WEIGHT[1], ADULT_WEIGHT[1])
+    weights = np.clip(np.round(rng.normal(means, deviations), 1), 1, 200)
+    
+    cohort = {
+        'current_medications': _names(medication_picks, medication_counts, ALL_MEDICATIONS),
+        'pre_existing_conditions': _names(condition_picks, condition_counts, ALL_CONDITIONS),
+        'drug_to_check': drugs,
+        'age': ages,
+        'weight': weights
+    }
+    
+    if with_reactions:
+        # The rules pick common side effects at random; a stream seeded
+        # from the generator keeps them reproducible too
+        reaction_rng = random.Random(int(rng.integers(2 ** 63)))
+        cohort['adverse_reactions'] = [
+            generate_adverse_reactions(meds, drug, conds, age, weight, rng=reaction_rng)
+            for meds, drug, conds, age, weight in zip(
+                cohort['current_medications'], drugs, cohort['pre_existing_conditions'],
+                ages.tolist(), weights.tolist()
+            )
+        ]
+    
+    return cohort
+
+def generate_synthetic_data(num_samples=1000, seed=None):
+    """
+    Generate synthetic training data for drug interaction prediction
+    
+    Returns:
+        List of sample dicts; see generate_cohort() for the columnar form
+    """
+    cohort = generate_cohort(num_samples, seed)
+    return [
+        {
+            'current_medications': meds,
+            'pre_existing_conditions': conds,
+            'drug_to_check': drug,
             'age': age,
             'weight': weight,
-            'adverse_reactions': adverse_reactions
+            'adverse_reactions': reactions
         }
-        
-        data.append(sample)
-    
-    return data
+        for meds, conds, drug, age, weight, reactions in zip(
+            cohort['current_medications'], cohort['pre_existing_conditions'],
+            cohort['drug_to_check'], cohort['age'].tolist(), cohort['weight'].tolist(),
+            cohort['adverse_reactions']
+        )
+    ]
 
 def generate_feature_vector(medications, conditions, drug, age, weight):
-    """Generate a feature vector for ML model"""
+    """
+    Generate a feature vector for ML model
+    
+    Reference layout for one patient; featurizer.Featurizer produces the
+    same values for whole batches and is what training and prediction use.
+    """
     # Initialize feature vector
     features = []
     
@@ -406,8 +480,17 @@ def generate_feature_vector(medications, conditions, drug, age, weight):
     
     return features
 
-def generate_adverse_reactions(current_medications, drug_to_check, pre_existing_conditions, age, weight):
-    """Generate adverse reactions based on drug interactions and conditions"""
+def generate_adverse_reactions(current_medications, drug_to_check, pre_existing_conditions, age, weight, rng=None):
+    """
+    Generate adverse reactions based on drug interactions and conditions
+    
+    Args:
+        rng: random.Random used to pick common side effects; defaults to
+            the shared generator of the random module
+    """
+    if rng is None:
+        rng = random
+    
     adverse_reactions = []
     
     # Check drug-drug interactions
@@ -579,11 +662,11 @@ def generate_adverse_reactions(current_medications, drug_to_check, pre_existing_
         }
         
         # Add 1-2 common side effects
-        num_side_effects = random.randint(1, 2)
+        num_side_effects = rng.randint(1, 2)
         if category in side_effects:
-            selected_effects = random.sample(side_effects[category], min(num_side_effects, len(side_effects[category])))
+            selected_effects = rng.sample(side_effects[category], min(num_side_effects, len(side_effects[category])))
         else:
-            selected_effects = random.sample(side_effects['other'], min(num_side_effects, len(side_effects['other'])))
+            selected_effects = rng.sample(side_effects['other'], min(num_side_effects, len(side_effects['other'])))
         
         for effect in selected_effects:
             adverse_reactions.append({
@@ -596,29 +679,27 @@ def generate_adverse_reactions(current_medications, drug_to_check, pre_existing_
     
     return adverse_reactions
 
-def create_training_dataset(num_samples=5000):
-    """Create a training dataset for the ML model"""
-    data = generate_synthetic_data(num_samples)
+def create_training_dataset(num_samples=5000, seed=None):
+    """
+    Create a training dataset for the ML model
     
-    X = []
-    y = []
+    Returns:
+        Tuple of (X, y): X is a NumPy feature matrix, one row per sample in
+        the layout of generate_feature_vector, and y a list of
+        {'reactions', 'severities'} dicts
+    """
+    # Imported here since featurizer itself imports this module
+    from featurizer import featurizer
     
-    for sample in data:
-        # Generate feature vector
-        features = generate_feature_vector(
-            sample['current_medications'],
-            sample['pre_existing_conditions'],
-            sample['drug_to_check'],
-            sample['age'],
-            sample['weight']
-        )
-        
-        # Extract target variables (adverse reactions)
-        reactions = [r['reaction'] for r in sample['adverse_reactions']]
-        severities = [r['severity'] for r in sample['adverse_reactions']]
-        
-        # Add to dataset
-        X.append(features)
+    cohort = generate_cohort(num_samples, seed)
+    
+    X = featurizer.transform_cohort(cohort)
+    
+    # Extract target variables (adverse reactions)
+    y = []
+    for adverse_reactions in cohort['adverse_reactions']:
+        reactions = [r['reaction'] for r in adverse_reactions]
+        severities = [r['severity'] for r in adverse_reactions]
         y.append({'reactions': reactions, 'severities': severities})
     
     return X, y
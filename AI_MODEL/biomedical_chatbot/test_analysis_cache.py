@@ -0,0 +1,81 @@
+"""
+Tests for the analysis cache of app.py: reloading the model or the rule
+tables empties it, and randomly drawn side effects are never cached
+
+Run from this directory with: python -m pytest test_analysis_cache.py
+"""
+
+import pytest
+
+import process_manager
+
+# Importing app would otherwise stop every other running instance of the service
+process_manager.initialize = lambda: True
+
+import app
+from ml_model import DrugInteractionPredictor
+
+# Warfarin with aspirin is a known interaction, so no side effects are drawn
+INTERACTION = {
+    'current_medications': ['warfarin'],
+    'drug_to_use': 'aspirin',
+    'preexisting_conditions': [],
+    'age': 40,
+    'weight': 70
+}
+# Nothing fires for a drug the rules do not know, so side effects are drawn
+NO_INTERACTION = dict(INTERACTION, current_medications=[], drug_to_use='unknown drug')
+
+
+@pytest.fixture
+def client():
+    app.analysis_cache.clear()
+    yield app.app.test_client()
+    app.analysis_cache.clear()
+
+
+def reaction_types(client, payload):
+    response = client.post('/api/analyze', json=payload)
+    assert response.status_code == 200
+    return [reaction['type'] for reaction in response.get_json()['analysis']['adverse_reactions']]
+
+
+def test_rule_results_are_cached(client):
+    assert reaction_types(client, INTERACTION) == ['drug-drug']
+    assert len(app.analysis_cache) == 1
+    reaction_types(client, INTERACTION)
+    assert app.analysis_cache.stats()['hits'] == 1
+
+
+def test_drawn_side_effects_are_not_cached(client):
+    assert set(reaction_types(client, NO_INTERACTION)) == {'common-effect'}
+    assert len(app.analysis_cache) == 0
+
+    # Every request draws again
+    draws = {tuple(reaction_types(client, NO_INTERACTION)) for _ in range(30)}
+    assert len(draws) > 1
+    assert len(app.analysis_cache) == 0
+
+
+def test_reload_model_clears_cache(client, monkeypatch, tmp_path):
+    model_path = tmp_path / 'model.npz'
+    DrugInteractionPredictor().train(num_samples=100).save_model(str(model_path))
+    monkeypatch.setattr(app, 'MODEL_PATH', model_path)
+    monkeypatch.setattr(app, 'predictor', DrugInteractionPredictor())
+
+    reaction_types(client, INTERACTION)
+    assert len(app.analysis_cache) == 1
+
+    app.reload_model()
+    assert app.predictor.is_trained
+    assert app.predictor.generation == 1
+    assert len(app.analysis_cache) == 0
+
+
+def test_reload_rule_tables_clears_cache(client):
+    reaction_types(client, INTERACTION)
+    assert len(app.analysis_cache) == 1
+
+    app.reload_rule_tables()
+    assert len(app.analysis_cache) == 0
+    assert reaction_types(client, INTERACTION) == ['drug-drug']
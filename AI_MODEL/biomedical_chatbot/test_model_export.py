@@ -0,0 +1,75 @@
+"""
+Tests for the .npz export that serves the model: it predicts like the
+trained model, and its tree arrays are memory-mapped from the file rather
+than copied into each process
+
+Run from this directory with: python -m pytest test_model_export.py
+"""
+
+import mmap
+
+import numpy as np
+import pytest
+
+from featurizer import featurizer
+from ml_model import DrugInteractionPredictor, load_npz
+from synthetic_data import generate_cohort
+
+
+def is_mapped(array):
+    """Whether array's memory belongs to a memory map of a file"""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+@pytest.fixture(scope='module')
+def trained():
+    return DrugInteractionPredictor().train(num_samples=100)
+
+
+def test_load_npz_maps_stored_members(tmp_path):
+    path = tmp_path / 'arrays.npz'
+    np.savez(path, matrix=np.arange(12.0).reshape(3, 4), fortran=np.asfortranarray(np.ones((2, 3))),
+             scalar=np.int32(7), empty=np.zeros((0, 3)))
+
+    arrays = load_npz(path)
+    assert isinstance(arrays['matrix'], np.memmap)
+    assert np.array_equal(arrays['matrix'], np.arange(12.0).reshape(3, 4))
+    assert isinstance(arrays['fortran'], np.memmap) and arrays['fortran'].flags.f_contiguous
+    assert int(arrays['scalar']) == 7
+    assert arrays['empty'].shape == (0, 3)
+
+
+def test_load_npz_reads_compressed_members(tmp_path):
+    path = tmp_path / 'arrays.npz'
+    np.savez_compressed(path, matrix=np.arange(6).reshape(2, 3))
+
+    arrays = load_npz(path)
+    assert not is_mapped(arrays['matrix'])
+    assert np.array_equal(arrays['matrix'], np.arange(6).reshape(2, 3))
+
+
+def test_saving_joblib_writes_the_export(trained, tmp_path):
+    trained.save_model(str(tmp_path / 'model.joblib'))
+    assert (tmp_path / 'model.joblib').exists()
+    assert (tmp_path / 'model.npz').exists()
+
+
+def test_served_tree_arrays_are_mapped(trained, tmp_path):
+    path = tmp_path / 'model.npz'
+    trained.save_model(str(path))
+
+    served = DrugInteractionPredictor(path, lazy=True)
+    assert served.ensure_loaded()
+    compiled = served.compiled_reactions
+    for name in ('condition_features', 'condition_thresholds', 'node_conditions', 'leaf_values'):
+        assert is_mapped(getattr(compiled, name)), name
+    # Nothing was unpickled; the sklearn estimators are not loaded at all
+    assert served.reaction_classifier is None and served.severity_classifier is None
+
+    X = featurizer.transform_cohort(generate_cohort(200, seed=3, with_reactions=False))
+    assert np.array_equal(served.reaction_probabilities(X), trained.reaction_probabilities(X))
+    assert list(served.reaction_mlb.classes_) == list(trained.reaction_mlb.classes_)
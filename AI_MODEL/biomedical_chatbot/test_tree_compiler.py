@@ -0,0 +1,160 @@
+"""
+Tests for tree_compiler: the compiled reaction head must give exactly the
+probabilities and labels of the sklearn models it was compiled from
+
+Run from this directory with: python -m pytest test_tree_compiler.py
+"""
+
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier
+from sklearn.multioutput import MultiOutputClassifier
+
+from tree_compiler import MAX_DEPTH, CompiledGradientBoosting
+
+
+def make_data(rows=600, seed=0):
+    """One-hot-like binary columns followed by continuous ones, and 3 labels"""
+    rng = np.random.default_rng(seed)
+    X = np.hstack([
+        (rng.random((rows, 6)) < 0.3).astype(np.float64),
+        rng.normal(size=(rows, 3)) * [1.0, 10.0, 100.0]
+    ])
+    Y = np.column_stack([
+        (X[:, 0] > 0) ^ (X[:, 6] > 0.5),
+        (X[:, 7] + 5 * X[:, 2] + rng.normal(size=rows)) > 2,
+        rng.random(rows) < 0.2
+    ]).astype(int)
+    return X, Y
+
+
+def sklearn_proba(estimators, X):
+    return np.column_stack([estimator.predict_proba(X)[:, 1] for estimator in estimators])
+
+
+def assert_matches_sklearn(estimators, X):
+    compiled = CompiledGradientBoosting.from_estimators(estimators)
+    restored = CompiledGradientBoosting.from_arrays(compiled.to_arrays())
+    expected_proba = sklearn_proba(estimators, X)
+    expected = np.column_stack([estimator.predict(X) for estimator in estimators])
+
+    for model in (compiled, restored):
+        assert np.array_equal(model.predict_proba(X), expected_proba)
+        assert np.array_equal(model.predict(X), expected)
+
+
+def test_multioutput_matches_sklearn():
+    X, Y = make_data()
+    classifier = MultiOutputClassifier(
+        GradientBoostingClassifier(n_estimators=20, max_depth=3, random_state=0)
+    ).fit(X, Y)
+
+    compiled = CompiledGradientBoosting.from_multioutput(classifier)
+    proba = np.column_stack([p[:, 1] for p in classifier.predict_proba(X)])
+    assert np.array_equal(compiled.predict_proba(X), proba)
+    assert np.array_equal(compiled.predict(X), classifier.predict(X))
+    assert_matches_sklearn(classifier.estimators_, X)
+
+
+def test_unseen_rows_and_single_row():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=15, max_depth=4, random_state=0).fit(X, Y[:, label])
+        for label in range(Y.shape[1])
+    ]
+    X_new, _ = make_data(rows=300, seed=1)
+    assert_matches_sklearn(estimators, X_new)
+    assert_matches_sklearn(estimators, X_new[:1])
+
+
+def test_rows_on_split_thresholds():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=10, max_depth=3, random_state=0).fit(X, Y[:, label])
+        for label in range(Y.shape[1])
+    ]
+    compiled = CompiledGradientBoosting.from_estimators(estimators)
+
+    # Copies of the data with one feature moved to just below, at and just
+    # above the float32 value of each split threshold
+    split = np.isfinite(compiled.condition_thresholds)
+    rows = []
+    for feature, threshold in zip(compiled.condition_features[split], compiled.condition_thresholds[split]):
+        at = np.float32(threshold)
+        for value in (np.nextafter(at, np.float32(-np.inf)), at, np.nextafter(at, np.float32(np.inf))):
+            row = X[len(rows) % len(X)].copy()
+            row[feature] = value
+            rows.append(row)
+    assert_matches_sklearn(estimators, np.array(rows))
+
+
+def test_labels_with_different_depths():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=10, max_depth=depth, random_state=0).fit(X, Y[:, label])
+        for label, depth in enumerate([1, 3, MAX_DEPTH])
+    ]
+    assert_matches_sklearn(estimators, X)
+
+
+def test_unbalanced_trees_within_a_label():
+    # Limiting the leaves makes trees that stop at different depths per branch
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=10, max_depth=5, max_leaf_nodes=5,
+                                   random_state=0).fit(X, Y[:, label])
+        for label in range(Y.shape[1])
+    ]
+    assert_matches_sklearn(estimators, X)
+
+
+def test_stumps():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=25, max_depth=1, random_state=0).fit(X, Y[:, label])
+        for label in range(Y.shape[1])
+    ]
+    compiled = CompiledGradientBoosting.from_estimators(estimators)
+    assert compiled.depth == 1
+    assert_matches_sklearn(estimators, X)
+
+
+def test_zero_init_and_subsampling():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=15, max_depth=3, init='zero', subsample=0.7,
+                                   random_state=0).fit(X, Y[:, label])
+        for label in range(Y.shape[1])
+    ]
+    assert np.array_equal(CompiledGradientBoosting.from_estimators(estimators).intercepts, np.zeros(3))
+    assert_matches_sklearn(estimators, X)
+
+
+def test_rejects_other_estimators():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=5, max_depth=2, random_state=0).fit(X, Y[:, 0]),
+        HistGradientBoostingClassifier(max_iter=5).fit(X, Y[:, 1])
+    ]
+    with pytest.raises(ValueError, match='HistGradientBoostingClassifier'):
+        CompiledGradientBoosting.from_estimators(estimators)
+
+
+def test_rejects_trees_deeper_than_max_depth():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=5, max_depth=MAX_DEPTH + 1, random_state=0).fit(X, Y[:, 0])
+    ]
+    assert max(regressor.tree_.max_depth for regressor in estimators[0].estimators_[:, 0]) > MAX_DEPTH
+    with pytest.raises(ValueError, match='deeper'):
+        CompiledGradientBoosting.from_estimators(estimators)
+
+
+def test_rejects_labels_with_different_tree_counts():
+    X, Y = make_data()
+    estimators = [
+        GradientBoostingClassifier(n_estimators=5, max_depth=2, random_state=0).fit(X, Y[:, 0]),
+        GradientBoostingClassifier(n_estimators=8, max_depth=2, random_state=0).fit(X, Y[:, 1])
+    ]
+    with pytest.raises(ValueError, match='same trees'):
+        CompiledGradientBoosting.from_estimators(estimators)
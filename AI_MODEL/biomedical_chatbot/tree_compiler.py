@@ -0,0 +1,251 @@
+"""
+Compiled, vectorized inference for the reaction classifier
+
+DrugInteractionPredictor's reaction head is a MultiOutputClassifier holding
+one binary GradientBoostingClassifier per reaction label. Asking sklearn for
+its probabilities walks every estimator object in Python, which dominates
+the latency of a single prediction.
+
+CompiledGradientBoosting flattens all trees of all labels into contiguous
+arrays. Every tree is padded to a complete binary tree of the ensemble's
+depth, so the children of node i are 2i + 1 and 2i + 2 and need no arrays
+of their own; a leaf above the bottom level is extended with splits that
+always go left. Trees are laid out tree-major, one column per (tree, label):
+
+    node_conditions[node, column]   split condition of each internal node
+    leaf_values[leaf, column]       the tree's output at each bottom leaf
+
+The (feature, threshold) pairs of all splits are deduplicated first, since
+the trees split on the same one-hot columns over and over. A batch is
+evaluated by testing every distinct condition once, picking each level's
+branch for all rows and trees together, and accumulating leaf outputs in
+the same order and precision as sklearn, so predict_proba matches
+GradientBoostingClassifier.predict_proba exactly.
+"""
+
+import numpy as np
+from scipy.special import expit
+
+# Deepest trees that are compiled; a complete tree has 2 ** depth leaves
+MAX_DEPTH = 6
+# Upper bound on the (rows, nodes, columns) condition table built per chunk
+CHUNK_CELLS = 4_000_000
+
+
+class CompiledGradientBoosting:
+    """Flat-array form of a list of binary GradientBoostingClassifiers, one per label"""
+
+    def __init__(self, condition_features, condition_thresholds, node_conditions, leaf_values,
+                 intercepts, learning_rates, num_features):
+        self.condition_features = condition_features        # (conditions,) column tested
+        self.condition_thresholds = condition_thresholds    # (conditions,) go left when X <= threshold
+        self.node_conditions = node_conditions              # (2 ** depth - 1, trees * labels)
+        self.leaf_values = leaf_values                      # (2 ** depth, trees * labels)
+        self.intercepts = intercepts                        # (labels,) init estimator's raw prediction
+        self.learning_rates = learning_rates                # (labels,)
+        self.num_features = num_features
+
+        self.num_labels = len(intercepts)
+        self.num_trees = leaf_values.shape[1] // self.num_labels
+        self.depth = int(np.log2(leaf_values.shape[0]))
+
+    @classmethod
+    def from_multioutput(cls, classifier):
+        """Compile a fitted MultiOutputClassifier of GradientBoostingClassifiers"""
+        return cls.from_estimators(classifier.estimators_)
+
+    @classmethod
+    def from_estimators(cls, estimators):
+        """
+        Compile fitted binary GradientBoostingClassifiers, one per label
+
+        Raises:
+            ValueError: If an estimator is not a binary, log-loss gradient
+                boosting model with a constant init estimator, its trees are
+                deeper than MAX_DEPTH, or the estimators disagree on the
+                number of trees or features
+        """
+        if not estimators:
+            raise ValueError("Nothing to compile")
+
+        for label, estimator in enumerate(estimators):
+            if type(estimator).__name__ != 'GradientBoostingClassifier':
+                raise ValueError(f"Label {label}: {type(estimator).__name__} is not supported, "
+                                 "only GradientBoostingClassifier")
+
+        num_labels = len(estimators)
+        num_trees = estimators[0].estimators_.shape[0]
+        num_features = estimators[0].n_features_in_
+        intercepts = np.empty(num_labels, dtype=np.float64)
+        learning_rates = np.empty(num_labels, dtype=np.float64)
+
+        for label, estimator in enumerate(estimators):
+            if getattr(estimator, 'n_trees_per_iteration_', None) != 1 or len(estimator.classes_) != 2:
+                raise ValueError(f"Label {label}: only binary gradient boosting classifiers can be compiled")
+            if estimator.loss != 'log_loss':
+                raise ValueError(f"Label {label}: unsupported loss '{estimator.loss}'")
+            if estimator.estimators_.shape[0] != num_trees or estimator.n_features_in_ != num_features:
+                raise ValueError(f"Label {label}: all labels must have the same trees and features")
+            intercepts[label] = _intercept(estimator)
+            learning_rates[label] = estimator.learning_rate
+
+        depth = max(
+            max(regressor.tree_.max_depth for regressor in estimator.estimators_[:, 0])
+            for estimator in estimators
+        )
+        if depth > MAX_DEPTH:
+            raise ValueError(f"Trees of depth {depth} are deeper than the supported {MAX_DEPTH}")
+        depth = max(depth, 1)
+
+        columns = num_trees * num_labels
+        features = np.zeros((2 ** depth - 1, columns), dtype=np.int64)
+        # Padding splits test X[0] <= inf, which always goes left
+        thresholds = np.full((2 ** depth - 1, columns), np.inf)
+        leaf_values = np.zeros((2 ** depth, columns), dtype=np.float64)
+
+        for label, estimator in enumerate(estimators):
+            for t, regressor in enumerate(estimator.estimators_[:, 0]):
+                _place_tree(regressor.tree_, t * num_labels + label, depth, features, thresholds, leaf_values)
+
+        pairs = np.column_stack([features.ravel().astype(np.float64), thresholds.ravel()])
+        conditions, node_conditions = np.unique(pairs, axis=0, return_inverse=True)
+
+        return cls(
+            conditions[:, 0].astype(np.intp),
+            conditions[:, 1].copy(),
+            node_conditions.reshape(features.shape).astype(np.int32),
+            leaf_values,
+            intercepts,
+            learning_rates,
+            num_features
+        )
+
+    def to_arrays(self):
+        """
+        The arrays that define the compiled model, narrowed for storage
+
+        Thresholds become float32 rounded down, which sends every float32
+        feature value the same way as the float64 original; conditions and
+        nodes become int32. Leaf values and intercepts stay float64.
+        """
+        return {
+            'condition_features': self.condition_features.astype(np.int32),
+            'condition_thresholds': _float32_floor(self.condition_thresholds),
+            'node_conditions': self.node_conditions.astype(np.int32),
+            'leaf_values': self.leaf_values,
+            'intercepts': self.intercepts,
+            'learning_rates': self.learning_rates,
+            'num_features': np.int32(self.num_features)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild a compiled model from the output of to_arrays()
+
+        The arrays are used as they are, so memory-mapped ones stay mapped.
+        """
+        return cls(
+            np.asarray(arrays['condition_features']),
+            np.asarray(arrays['condition_thresholds']),
+            np.asarray(arrays['node_conditions']),
+            np.asarray(arrays['leaf_values']),
+            np.asarray(arrays['intercepts']),
+            np.asarray(arrays['learning_rates']),
+            int(arrays['num_features'])
+        )
+
+    def decision_function(self, X):
+        """Raw (log-odds) scores of shape (rows, labels)"""
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.num_features:
+            raise ValueError(f"Expected rows of {self.num_features} features, got shape {X.shape}")
+        if np.isnan(X).any():
+            raise ValueError("Rows must not contain NaN")
+
+        raw = np.empty((X.shape[0], self.num_labels), dtype=np.float64)
+        chunk_size = max(1, CHUNK_CELLS // self.node_conditions.size)
+        for start in range(0, X.shape[0], chunk_size):
+            raw[start:start + chunk_size] = self._raw_chunk(X[start:start + chunk_size])
+        return raw
+
+    def _raw_chunk(self, rows):
+        n = len(rows)
+        columns = self.leaf_values.shape[1]
+
+        # Which way every distinct condition sends every row, then per node
+        goes_right = rows[:, self.condition_features] > self.condition_thresholds
+        node_right = goes_right[:, self.node_conditions.ravel()].reshape(n, -1, columns)
+
+        # At each level, select the node on the path taken so far by halving
+        # that level's nodes once per earlier branch
+        branches = []
+        for level in range(self.depth):
+            nodes = node_right[:, 2 ** level - 1:2 ** (level + 1) - 1]
+            for branch in branches:
+                half = nodes.shape[1] // 2
+                nodes = np.where(branch[:, None, :], nodes[:, half:], nodes[:, :half])
+            branches.append(nodes[:, 0])
+
+        # The branches spell out the leaf index, most significant first;
+        # turn it into a flat index into leaf_values in place
+        position = branches[0].astype(np.int32)
+        for branch in branches[1:]:
+            position <<= 1
+            position |= branch
+        position *= columns
+        position += np.arange(columns, dtype=np.int32)
+        values = self.leaf_values.ravel()[position].reshape(n, self.num_trees, self.num_labels)
+
+        raw = np.broadcast_to(self.intercepts, (n, self.num_labels)).copy()
+        # One tree at a time, as sklearn's predict_stages does, so the
+        # floating-point sums come out identical
+        for t in range(self.num_trees):
+            raw += self.learning_rates * values[:, t]
+        return raw
+
+    def predict_proba(self, X):
+        """Positive-class probability of every label, shape (rows, labels)"""
+        return expit(self.decision_function(X))
+
+    def predict(self, X):
+        """0/1 label indicators, shape (rows, labels), as MultiOutputClassifier.predict"""
+        positive = self.predict_proba(X)
+        # GradientBoostingClassifier picks the larger of (1 - p, p)
+        return (positive > 1 - positive).astype(np.int64)
+
+
+def _place_tree(tree, column, depth, features, thresholds, leaf_values):
+    """Copy one sklearn tree into column of the complete-tree arrays"""
+    stack = [(0, 0, 0)]     # (sklearn node, complete-tree slot, level)
+    while stack:
+        node, slot, level = stack.pop()
+        if tree.children_left[node] == -1:
+            # Follow the always-left padding down to the bottom level
+            for _ in range(level, depth):
+                slot = 2 * slot + 1
+            leaf_values[slot - (2 ** depth - 1), column] = tree.value[node, 0, 0]
+            continue
+        features[slot, column] = tree.feature[node]
+        thresholds[slot, column] = tree.threshold[node]
+        stack.append((tree.children_left[node], 2 * slot + 1, level + 1))
+        stack.append((tree.children_right[node], 2 * slot + 2, level + 1))
+
+
+def _float32_floor(values):
+    """Largest float32 not above each float64 value"""
+    narrowed = values.astype(np.float32)
+    above = narrowed.astype(np.float64) > values
+    narrowed[above] = np.nextafter(narrowed[above], np.float32(-np.inf))
+    return narrowed
+
+
+def _intercept(estimator):
+    """Raw prediction of the init estimator, which must not depend on the row"""
+    if estimator.init_ == 'zero':
+        return 0.0
+    if type(estimator.init_).__name__ != 'DummyClassifier':
+        raise ValueError("Only the default (prior) or zero init estimator can be compiled")
+    row = np.zeros((1, estimator.n_features_in_), dtype=np.float32)
+    return float(estimator._raw_predict_init(row)[0, 0])
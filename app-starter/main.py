@@ -10,7 +10,6 @@ import logging
 from pathlib import Path
 import queue
 import datetime
-import csv
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +36,9 @@ DATA_FILE = os.path.join(PROJECT_ROOT, "adr_reports.csv")
 PATIENT_DATA_DIR = os.path.join(PROJECT_ROOT, "patient-portal", "data")
 PATIENT_ID_FILE = os.path.join(PATIENT_DATA_DIR, "patient_id_counter.txt")
 
+sys.path.insert(0, PROJECT_ROOT)
+from common.storage import SQLiteStorage, import_csv, open_storage
+
 # Configuration for ports
 MAIN_PORT = 8080
 DOCTOR_PORT = 8082
@@ -66,17 +68,19 @@ def ensure_data_directories():
         with open(PATIENT_ID_FILE, 'w') as f:
             f.write('2000')
     
-    # Ensure ADR reports CSV file exists with proper headers
-    if not os.path.exists(DATA_FILE):
-        logger.info(f"Creating ADR reports file: {DATA_FILE}")
-        with open(DATA_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'timestamp', 'drug_name', 'medical_condition', 'adverse_reaction', 
-                'severity', 'confidence', 'cause_of_administration', 'gender', 
-                'patient_id', 'current_medication'
-            ])
-        logger.info("Created ADR reports file with headers")
+    # Ensure ADR reports storage exists (the CSV file with proper headers,
+    # or the SQLite database when CLINIQA_STORAGE=sqlite)
+    storage = open_storage(DATA_FILE)
+    if not storage.exists():
+        if isinstance(storage, SQLiteStorage) and os.path.exists(DATA_FILE):
+            # One-shot import of the existing reports into the new database
+            logger.info(f"Importing {DATA_FILE} into {storage.path}")
+            count = import_csv(DATA_FILE, storage)
+            logger.info(f"Imported {count} ADR reports")
+        else:
+            logger.info(f"Creating ADR reports storage: {storage.path}")
+            storage.ensure()
+            logger.info("Created ADR reports storage")
     
     logger.info("Data directories check completed")
 
@@ -0,0 +1,6 @@
+"""
+Shared helpers for the CliniQAI portals
+
+The portal directories are not packages, so each server adds the project
+root to sys.path before importing from here.
+"""
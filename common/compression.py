@@ -0,0 +1,250 @@
+"""
+Negotiated Response Compression for the http.server Based Portals
+
+gzip is always available; brotli and zstd are used when their optional
+packages are installed. Bodies below a size threshold are sent as is, and
+compressed bodies of versioned data are cached so unchanged data is only
+compressed once.
+"""
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from common.http_cache import (
+    data_version, quote_etag, send_not_modified_if_fresh, validator_headers
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are not worth the compression overhead
+MIN_COMPRESS_SIZE = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Preferred encodings first; only those whose module is importable
+SUPPORTED_ENCODINGS = [
+    encoding for encoding, available in (
+        ('br', brotli is not None),
+        ('zstd', zstandard is not None),
+        ('gzip', True)
+    ) if available
+]
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'image/svg+xml'
+)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the best supported content coding from an Accept-Encoding header
+
+    Returns:
+        'br', 'zstd' or 'gzip', or None to send the body uncompressed
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type):
+    """Check whether a MIME type is text-like enough to benefit from compression"""
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _compressor(encoding):
+    # Returns (compress, flush) callables for a streaming compressor
+    if encoding == 'gzip':
+        stream = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return stream.compress, stream.flush
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=BROTLI_QUALITY)
+        return stream.process, stream.finish
+    if encoding == 'zstd':
+        stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return stream.compress, stream.flush
+    raise ValueError(f'Unsupported content coding: {encoding}')
+
+
+def iter_compressed(pieces, encoding):
+    """
+    Compress an iterable of str or bytes pieces as one stream
+
+    Yields:
+        Non-empty compressed bytes pieces
+    """
+    compress, flush = _compressor(encoding)
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        data = compress(piece)
+        if data:
+            yield data
+    data = flush()
+    if data:
+        yield data
+
+
+def compress_body(pieces, encoding):
+    """Compress an iterable of str or bytes pieces into one bytes body"""
+    return b''.join(iter_compressed(pieces, encoding))
+
+
+class CompressedBodyCache:
+    """Small LRU of compressed bodies keyed by resource, data version and encoding"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Return the cached body for key, building it with build() on a miss
+
+        Args:
+            key: Hashable tuple that changes whenever the body would
+            build: Callable returning the compressed bytes
+        """
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                return body
+
+        body = build()
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
+
+
+compressed_bodies = CompressedBodyCache()
+
+
+class CompressionMixin:
+    """
+    Adds negotiated compression to a SimpleHTTPRequestHandler subclass
+
+    List it before SimpleHTTPRequestHandler in the bases and call
+    send_static_compressed() from do_GET before falling back to the
+    default static file handling.
+    """
+
+    def accepted_encoding(self):
+        """Return the best encoding the client accepts, or None"""
+        return negotiate_encoding(self.headers.get('Accept-Encoding'))
+
+    def response_encoding(self, size):
+        """Return the encoding to use for a body of size bytes, or None if too small"""
+        if size < MIN_COMPRESS_SIZE:
+            return None
+        return self.accepted_encoding()
+
+    def send_body(self, body, content_type, encoding=None, headers=None, cache_key=None, status=200):
+        """
+        Send a complete response, compressing the body with encoding if given
+
+        Args:
+            body: Uncompressed response bytes
+            content_type: Value for the Content-type header
+            encoding: Result of response_encoding(), or None
+            headers: Optional dict of extra headers
+            cache_key: Hashable key identifying this exact body; when given,
+                the compressed form is cached under it
+        """
+        if encoding:
+            if cache_key is None:
+                body = compress_body([body], encoding)
+            else:
+                body = compressed_bodies.get(
+                    cache_key + (encoding,), lambda: compress_body([body], encoding)
+                )
+        self.send_encoded(body, content_type, encoding, headers, status)
+
+    def send_encoded(self, body, content_type, encoding, headers=None, status=200):
+        """Send a response whose body is already in the given content coding"""
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_static_compressed(self):
+        """
+        Serve the requested static file compressed, if that applies
+
+        Returns:
+            True if the response was sent; False to let the default handler
+            serve the file (directories, binary types, small files, or a
+            client that does not accept compression)
+        """
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            # Same directory index lookup as SimpleHTTPRequestHandler
+            for index in ('index.html', 'index.htm'):
+                if os.path.isfile(os.path.join(path, index)):
+                    path = os.path.join(path, index)
+                    break
+        if not os.path.isfile(path):
+            return False
+        content_type = self.guess_type(path)
+        if not is_compressible(content_type):
+            return False
+
+        file_stat = os.stat(path)
+        encoding = self.response_encoding(file_stat.st_size)
+        if not encoding:
+            return False
+
+        etag = quote_etag(data_version(file_stat), encoding)
+        if send_not_modified_if_fresh(self, etag, file_stat.st_mtime):
+            return True
+
+        def build():
+            with open(path, 'rb') as file:
+                return compress_body([file.read()], encoding)
+
+        body = compressed_bodies.get(
+            ('static', path, file_stat.st_mtime_ns, file_stat.st_size, encoding), build
+        )
+        self.send_encoded(
+            body, content_type, encoding, validator_headers(etag, file_stat.st_mtime)
+        )
+        return True
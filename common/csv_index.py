@@ -0,0 +1,312 @@
+"""
+Persisted Line-Offset Index over adr_reports.csv
+
+Records the byte offset at which each CSV record starts, so single rows and
+the newest N rows are read from a memory map of the file without parsing
+any other row. The offsets are saved next to the CSV (adr_reports.csv.idx)
+and extended with just the records appended since: new offsets are
+appended to the .idx file and only its fixed-size header is rewritten in
+place, so growing the index costs I/O proportional to the new records.
+Every process that reads the file maps the same page-cached bytes.
+
+Several server processes share the .idx file. Reading and writing it
+happen under an exclusive lock on adr_reports.csv.idx.lock, and an index
+whose offsets do not strictly increase within the covered bytes, or do
+not match the count in its header, is ignored and rebuilt.
+"""
+
+import csv
+import io
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl; lock the first byte of the file instead
+    fcntl = None
+    import msvcrt
+
+from common.csv_tail import TAIL_FINGERPRINT_SIZE, row_dict
+
+INDEX_SUFFIX = '.idx'
+LOCK_SUFFIX = '.lock'
+INDEX_MAGIC = b'ADRIDX02'
+
+# magic, inode of the CSV file, bytes of it covered by the index, number
+# of offsets, length of its header line, then the length and bytes of the
+# fingerprint taken just before the covered end; the offsets array follows
+INDEX_HEADER = struct.Struct(f'<8sQqqqq{TAIL_FINGERPRINT_SIZE}s')
+
+
+@contextmanager
+def _locked(lock_path):
+    """Hold an exclusive lock on lock_path, shared by every process"""
+    # 'a+' creates the file without truncating it
+    with open(lock_path, 'a+') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CSVLineIndex:
+    """Offsets of the records of a CSV file, extended as the file grows"""
+
+    def __init__(self, path, index_path=None):
+        self.path = str(path)
+        self.index_path = index_path or self.path + INDEX_SUFFIX
+        self.lock_path = self.index_path + LOCK_SUFFIX
+        self._lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.offsets = array('q')  # start of each data record, in file order
+        self.covered = 0  # end of the last complete record indexed
+        self.header_end = 0
+        self.file_id = None
+        self.fieldnames = None
+        self.tail_bytes = b''
+        # (offsets, covered) as last written to the index file, or None
+        # when the file must be rewritten whole
+        self._saved = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load(self):
+        # Adopt the persisted offsets if they still describe the file
+        try:
+            with _locked(self.lock_path):
+                with open(self.index_path, 'rb') as file:
+                    data = file.read()
+            magic, file_id, covered, count, header_end, tail_size, tail = INDEX_HEADER.unpack_from(data)
+            if magic != INDEX_MAGIC or len(data) != INDEX_HEADER.size + 8 * count:
+                return
+            with open(self.path, 'rb') as file:
+                file_stat = os.fstat(file.fileno())
+                if file_stat.st_ino != file_id or file_stat.st_size < covered:
+                    return
+                header = file.read(header_end)
+                file.seek(covered - tail_size)
+                if file.read(tail_size) != tail[:tail_size]:
+                    return
+        except (OSError, struct.error):
+            return
+
+        offsets = array('q', data[INDEX_HEADER.size:])
+        if not _is_valid(offsets, header_end, covered):
+            return
+        self.offsets = offsets
+        self._saved = (len(offsets), covered)
+        self.covered = covered
+        self.header_end = header_end
+        self.file_id = file_id
+        self.fieldnames = next(csv.reader(io.StringIO(header.decode('utf-8'), newline='')), None)
+        self.tail_bytes = tail[:tail_size]
+
+    def _header(self):
+        return INDEX_HEADER.pack(
+            INDEX_MAGIC, self.file_id, self.covered, len(self.offsets), self.header_end,
+            len(self.tail_bytes), self.tail_bytes
+        )
+
+    def _save(self):
+        try:
+            with _locked(self.lock_path):
+                if not self._append_saved():
+                    self._rewrite_saved()
+            self._saved = (len(self.offsets), self.covered)
+        except OSError:
+            # The in-memory index still works; it is only rebuilt on restart
+            self._saved = None
+
+    def _append_saved(self):
+        """
+        Append the offsets added since the last save and update the header
+        in place; the caller holds the index lock
+
+        Returns:
+            False if the file is not the one last written, so it has to be
+            rewritten whole
+        """
+        if self._saved is None:
+            return False
+        saved_count, saved_covered = self._saved
+        try:
+            file = open(self.index_path, 'r+b')
+        except FileNotFoundError:
+            return False
+        with file:
+            header = file.read(INDEX_HEADER.size)
+            if len(header) != INDEX_HEADER.size:
+                return False
+            magic, file_id, covered, count = INDEX_HEADER.unpack(header)[:4]
+            size = os.fstat(file.fileno()).st_size
+            if (magic != INDEX_MAGIC or file_id != self.file_id or covered != saved_covered
+                    or count != saved_count or size != INDEX_HEADER.size + 8 * saved_count):
+                return False
+            # Offsets first, then the header that makes them count
+            file.seek(size)
+            file.write(self.offsets[saved_count:].tobytes())
+            file.flush()
+            file.seek(0)
+            file.write(self._header())
+        return True
+
+    def _rewrite_saved(self):
+        # The caller holds the index lock
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        # Replace atomically so other processes never load a partial index
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(self._header())
+            file.write(self.offsets.tobytes())
+        os.replace(temp_path, self.index_path)
+
+    def _is_continuation(self, file_stat):
+        if self.covered == 0:
+            return True
+        if file_stat.st_ino != self.file_id or file_stat.st_size < self.covered:
+            return False
+        with open(self.path, 'rb') as file:
+            file.seek(self.covered - len(self.tail_bytes))
+            return file.read(len(self.tail_bytes)) == self.tail_bytes
+
+    def refresh(self):
+        """
+        Index the records appended since the last call
+
+        The index starts over if the file was replaced, truncated or
+        rewritten. Only complete records are indexed; newlines inside
+        quoted fields do not end a record.
+
+        Returns:
+            Number of records added
+        """
+        with self._lock:
+            try:
+                file_stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                return 0
+            if not self._is_continuation(file_stat):
+                self._reset()
+            if file_stat.st_size == self.covered:
+                return 0
+
+            with open(self.path, 'rb') as file:
+                file.seek(self.covered)
+                data = file.read(file_stat.st_size - self.covered)
+
+            start = 0
+            if self.covered == 0:
+                end = data.find(b'\n')
+                if end == -1:
+                    return 0
+                self.fieldnames = next(
+                    csv.reader(io.StringIO(data[:end + 1].decode('utf-8'), newline='')), None
+                )
+                self.header_end = start = end + 1
+                self.file_id = file_stat.st_ino
+
+            base = self.covered
+            added = 0
+            quotes = 0
+            position = start
+            while True:
+                end = data.find(b'\n', position)
+                if end == -1:
+                    break
+                quotes += data.count(b'"', position, end)
+                position = end + 1
+                if quotes % 2:
+                    continue
+                # Blank lines are skipped, as csv.DictReader does
+                if data[start:position].strip():
+                    self.offsets.append(base + start)
+                    added += 1
+                start = position
+                quotes = 0
+
+            self.tail_bytes = (self.tail_bytes + data[:start])[-TAIL_FINGERPRINT_SIZE:]
+            self.covered = base + start
+            self._save()
+            return added
+
+    def read_rows(self, positions):
+        """
+        Read the records at the given positions
+
+        Only the bytes of those records are touched, through a read-only
+        memory map of the file.
+
+        Returns:
+            Rows as dicts shaped like those of csv.DictReader
+        """
+        with self._lock:
+            offsets = self.offsets
+            covered = self.covered
+            fieldnames = self.fieldnames
+        positions = list(positions)
+        if not positions:
+            return []
+
+        rows = []
+        with open(self.path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for position in positions:
+                    start = offsets[position]
+                    end = offsets[position + 1] if position + 1 < len(offsets) else covered
+                    text = mapped[start:end].decode('utf-8')
+                    line = next((record for record in csv.reader(io.StringIO(text, newline='')) if record), [])
+                    rows.append(row_dict(fieldnames, line))
+        return rows
+
+    def row(self, position):
+        """Read the record at one position (0 is the oldest)"""
+        if not 0 <= position < len(self.offsets):
+            raise IndexError('row position out of range')
+        return self.read_rows([position])[0]
+
+    def newest(self, limit, before=None):
+        """
+        Read up to limit records, newest first
+
+        Args:
+            limit: Maximum number of records
+            before: Only return records at positions below this one, as
+                returned by the previous call; None starts at the newest
+
+        Returns:
+            Tuple of (rows, next_before); next_before is None once the
+            oldest record was returned
+        """
+        stop = len(self.offsets) if before is None else min(before, len(self.offsets))
+        first = max(stop - limit, 0)
+        rows = self.read_rows(range(stop - 1, first - 1, -1))
+        return rows, (first if first > 0 else None)
+
+
+def _is_valid(offsets, header_end, covered):
+    """Whether offsets strictly increase from header_end and stay below covered"""
+    if not offsets:
+        return True
+    if offsets[0] < header_end or offsets[-1] >= covered:
+        return False
+    return all(earlier < later for earlier, later in zip(offsets, offsets[1:]))
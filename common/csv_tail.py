@@ -0,0 +1,95 @@
+"""
+Incremental Reader for Append-Only CSV Files
+
+adr_reports.csv only ever grows while the portals are running, so readers
+remember how many bytes they have consumed and parse just the new rows.
+"""
+
+import csv
+import io
+import os
+
+# Bytes kept from just before the consumed offset to detect rewritten files
+TAIL_FINGERPRINT_SIZE = 64
+
+
+class CSVTail:
+    """Tracks how far into a CSV file the rows have been read"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fieldnames = None
+        self.offset = 0
+        self.file_id = None
+        self.header_bytes = b''
+        self.tail_bytes = b''
+
+    def is_continuation(self):
+        """
+        Check whether the file still starts with the bytes consumed so far
+
+        Returns False if the file was replaced, truncated or rewritten, in
+        which case the reader must be discarded and the file read afresh.
+        """
+        if self.offset == 0:
+            return True
+        file_stat = os.stat(self.path)
+        if (file_stat.st_dev, file_stat.st_ino) != self.file_id or file_stat.st_size < self.offset:
+            return False
+
+        with open(self.path, 'rb') as file:
+            if file.read(len(self.header_bytes)) != self.header_bytes:
+                return False
+            file.seek(self.offset - len(self.tail_bytes))
+            return file.read(len(self.tail_bytes)) == self.tail_bytes
+
+    def read_rows(self):
+        """
+        Return the rows appended since the last call
+
+        Only complete lines are consumed; a row still being written is
+        returned by the next call. Rows are dicts shaped like those of
+        csv.DictReader, keyed by the header row.
+        """
+        with open(self.path, 'rb') as file:
+            file_stat = os.fstat(file.fileno())
+            file.seek(self.offset)
+            data = file.read()
+
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return []
+
+        try:
+            lines = list(csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')))
+        except (UnicodeDecodeError, csv.Error):
+            # Most likely a multi-line record cut short; retry on the next call
+            return []
+
+        if self.offset == 0:
+            self.file_id = (file_stat.st_dev, file_stat.st_ino)
+            self.header_bytes = data[:data.find(b'\n') + 1]
+            self.fieldnames = lines.pop(0) if lines else None
+
+        self.tail_bytes = (self.tail_bytes + data[max(0, end - TAIL_FINGERPRINT_SIZE):end])[-TAIL_FINGERPRINT_SIZE:]
+        self.offset += end
+
+        if not self.fieldnames:
+            return []
+        return [row_dict(self.fieldnames, line) for line in lines if line]
+
+
+def row_dict(fieldnames, line):
+    """
+    Turn one parsed CSV record into a dict keyed by the header row
+
+    Same shape as csv.DictReader: missing fields are None and surplus
+    fields are collected in a list under the None key.
+    """
+    row = dict(zip(fieldnames, line))
+    if len(line) < len(fieldnames):
+        for key in fieldnames[len(line):]:
+            row[key] = None
+    elif len(line) > len(fieldnames):
+        row[None] = line[len(fieldnames):]
+    return row
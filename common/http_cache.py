@@ -0,0 +1,119 @@
+"""
+Conditional GET Support for the Portal Read APIs
+
+Read APIs carry a strong ETag derived from the version of adr_reports.csv
+they were built from, plus Last-Modified. Clients revalidate with
+If-None-Match / If-Modified-Since and get a bodiless 304 while the data
+is unchanged.
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def data_version(file_stat):
+    """Return a version string that changes whenever the file's content may have"""
+    if file_stat is None:
+        return '0'
+    return f'{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}'
+
+
+def quote_etag(version, encoding=None):
+    """
+    Return the strong entity tag for a data version
+
+    Compressed representations get their own tag, since a strong ETag
+    identifies the exact bytes sent.
+    """
+    if encoding:
+        return f'"{version}-{encoding}"'
+    return f'"{version}"'
+
+
+def http_date(timestamp):
+    """Format an epoch timestamp as an HTTP date"""
+    return formatdate(int(timestamp), usegmt=True)
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an entity tag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(headers, etag, last_modified):
+    """
+    Decide whether a conditional GET can be answered with 304
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted
+    when the client sent no entity tags.
+
+    Args:
+        headers: Request headers (an http.client.HTTPMessage or similar mapping)
+        etag: Current quoted entity tag
+        last_modified: Epoch timestamp of the current data, or None
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since.timestamp()
+    return False
+
+
+def validator_headers(etag, last_modified):
+    """Return the caching headers sent with both 200 and 304 responses"""
+    headers = {
+        'ETag': etag,
+        # Let browsers keep the body but revalidate it on every use
+        'Cache-Control': 'no-cache'
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def send_not_modified_if_fresh(handler, etag, last_modified):
+    """
+    Answer a request handler's conditional GET with 304 if the client's copy is current
+
+    Returns:
+        True if a 304 was sent and the handler has nothing more to do
+    """
+    if not is_not_modified(handler.headers, etag, last_modified):
+        return False
+    handler.send_response(304)
+    for name, value in validator_headers(etag, last_modified).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    return True
+
+
+def make_conditional_response(response, request, version, last_modified):
+    """
+    Tag a Flask/Werkzeug response with the data version and answer 304 if unchanged
+
+    Returns:
+        The response, turned into a bodiless 304 when the request's
+        validators match
+    """
+    response.set_etag(version)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
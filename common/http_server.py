@@ -0,0 +1,114 @@
+"""
+Thread-Pooled HTTP/1.1 Server for the http.server Based Portals
+
+Connections are served by a bounded pool of worker threads, so one slow
+response (a full report dump) no longer blocks static files or other API
+calls. At most CLINIQA_HTTP_QUEUE accepted connections may be in the
+server at once, running or waiting for a worker; beyond that a connection
+is answered with 503 and closed rather than queued without limit. Handlers are expected to speak HTTP/1.1, keeping connections open
+between requests; an idle connection is closed after KEEP_ALIVE_TIMEOUT.
+
+Sizing is configurable through the environment:
+    CLINIQA_HTTP_WORKERS   worker threads (default 16)
+    CLINIQA_HTTP_BACKLOG   listen backlog (default 128)
+    CLINIQA_HTTP_QUEUE     connections held at once (default 4 per worker)
+"""
+
+import http.server
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 16
+DEFAULT_BACKLOG = 128
+# Connections held per worker, running or queued, unless CLINIQA_HTTP_QUEUE says otherwise
+DEFAULT_QUEUE_PER_WORKER = 4
+
+# Sent to a connection that arrives while the server is full
+BUSY_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Retry-After: 1\r\n'
+    b'Content-Length: 0\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+)
+
+# Seconds an idle keep-alive connection may hold a worker
+KEEP_ALIVE_TIMEOUT = 15
+
+
+def _env_int(name, default):
+    value = os.environ.get(name, '').strip()
+    return int(value) if value else default
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that hands each connection to a bounded thread pool"""
+
+    def __init__(self, server_address, handler_class, max_workers=None, backlog=None, max_pending=None):
+        self.max_workers = max_workers or _env_int('CLINIQA_HTTP_WORKERS', DEFAULT_WORKERS)
+        # Read by server_activate() when it calls listen()
+        self.request_queue_size = backlog or _env_int('CLINIQA_HTTP_BACKLOG', DEFAULT_BACKLOG)
+        self.max_pending = max(self.max_workers, max_pending or _env_int(
+            'CLINIQA_HTTP_QUEUE', self.max_workers * DEFAULT_QUEUE_PER_WORKER
+        ))
+        # One slot per connection handed to the pool, freed when it is closed
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='http-worker'
+        )
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        # Accepted connections wait in the pool's queue until a worker is free
+        try:
+            self._executor.submit(self._process_request_thread, request, client_address)
+        except RuntimeError:
+            # The pool was shut down by server_close()
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _reject(self, request):
+        """Answer a connection the server has no room for with 503 and close it"""
+        try:
+            request.settimeout(1)
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+
+class KeepAliveMixin:
+    """
+    Switches a BaseHTTPRequestHandler subclass to HTTP/1.1 persistent connections
+
+    Every response must then carry a Content-Length, use chunked transfer
+    encoding, or close the connection.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Socket timeout; ends idle keep-alive connections
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def discard_request_body(self):
+        """Read and drop an unused request body so the connection can be reused"""
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > 0:
+            self.rfile.read(length)
@@ -0,0 +1,91 @@
+"""
+Block-Reserving ID Allocator
+
+Hands out report IDs such as PTD_2791 that stay unique across threads,
+processes and restarts. The counter file holds the next unreserved number;
+a process locks it, reserves a block of numbers by advancing it, and then
+serves IDs from memory until the block runs out. Numbers left in a block
+when a process exits are simply never used.
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl; lock the first byte of the file instead
+    fcntl = None
+    import msvcrt
+
+# Numbers reserved per counter file access
+BLOCK_SIZE = 1000
+
+
+def _lock(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class IDAllocator:
+    """Allocates prefixed sequential IDs from blocks reserved in a counter file"""
+
+    def __init__(self, counter_path, prefix, start=2000, block_size=BLOCK_SIZE):
+        """
+        Args:
+            counter_path: File holding the next unreserved number
+            prefix: Text put before the number, e.g. 'PTD_'
+            start: First number used when the counter file is missing or empty
+            block_size: Numbers reserved per access to the counter file
+        """
+        self.counter_path = str(counter_path)
+        self.prefix = prefix
+        self.start = start
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0  # first number past the reserved block
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.counter_path)), exist_ok=True)
+        # 'a+' creates the file without truncating it
+        with open(self.counter_path, 'a+') as file:
+            _lock(file)
+            try:
+                file.seek(0)
+                text = file.read().strip()
+                first = int(text) if text else self.start
+                file.seek(0)
+                file.truncate()
+                file.write(str(first + self.block_size))
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                _unlock(file)
+        self._next = first
+        self._end = first + self.block_size
+
+    def next_id(self):
+        """
+        Return a new, never before allocated ID
+
+        Raises:
+            ValueError: If the counter file does not hold an integer
+        """
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve_block()
+            number = self._next
+            self._next += 1
+        return f'{self.prefix}{number}'
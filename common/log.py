@@ -0,0 +1,155 @@
+"""
+Shared Logging for the Portal Servers
+
+Loggers are named cliniqa.<module>. Records are put on a queue by the
+request threads and written by a background listener, to stdout and to a
+rotating file under logs/, with one flush per batch of queued records.
+
+Configured through the environment:
+    CLINIQA_LOG_LEVEL      default level (default INFO)
+    CLINIQA_LOG_MODULES    per-module levels, e.g. "data_server=DEBUG,report_cache=OFF"
+    CLINIQA_LOG_DIR        directory of the rotating log files (default <repo>/logs)
+    CLINIQA_TRACE_SAMPLE   fraction of rows traced by RowTracer at DEBUG (default 0)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOGGER_PREFIX = 'cliniqa'
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+
+# Level name that disables a module's logger entirely
+OFF = 'OFF'
+
+_listener = None
+
+
+class DeferredFlushMixin:
+    """Leaves flushing to the listener, which flushes once per batch"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchedStreamHandler(DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchedRotatingFileHandler(DeferredFlushMixin, RotatingFileHandler):
+    pass
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener that flushes its handlers whenever the queue runs empty"""
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                flush_batch = getattr(handler, 'flush_batch', None)
+                if flush_batch is not None:
+                    flush_batch()
+            return self.queue.get(block)
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            flush_batch = getattr(handler, 'flush_batch', None)
+            if flush_batch is not None:
+                flush_batch()
+            handler.close()
+
+
+def _parse_level(name):
+    name = name.strip().upper()
+    if name == OFF:
+        return logging.CRITICAL + 1
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        raise ValueError(f'Unknown log level: {name}')
+    return level
+
+
+def setup_logging(process_name):
+    """
+    Route the cliniqa loggers through the queue listener
+
+    Call once at process start; later calls do nothing.
+
+    Args:
+        process_name: Names the log file, e.g. 'data_server' -> logs/data_server.log
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger(LOGGER_PREFIX)
+    root.setLevel(_parse_level(os.environ.get('CLINIQA_LOG_LEVEL', 'INFO')))
+    root.propagate = False
+    for entry in os.environ.get('CLINIQA_LOG_MODULES', '').split(','):
+        if '=' in entry:
+            module, level = entry.split('=', 1)
+            logging.getLogger(f'{LOGGER_PREFIX}.{module.strip()}').setLevel(_parse_level(level))
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [BatchedStreamHandler(sys.stdout)]
+    log_dir = os.environ.get('CLINIQA_LOG_DIR', os.path.join(ROOT_DIR, 'logs'))
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        handlers.append(BatchedRotatingFileHandler(
+            os.path.join(log_dir, f'{process_name}.log'),
+            maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8'
+        ))
+    except OSError as e:
+        root.warning(f"File logging disabled: {e}")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    _listener = BatchingQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(module):
+    """Return the logger of one module, e.g. get_logger('data_server')"""
+    return logging.getLogger(f'{LOGGER_PREFIX}.{module}')
+
+
+class RowTracer:
+    """
+    Per-row DEBUG tracing for a sampled fraction of rows
+
+    Disabled unless the logger is at DEBUG and CLINIQA_TRACE_SAMPLE is
+    above zero, so callers pay one check per operation, not per row.
+    """
+
+    def __init__(self, logger, rate=None):
+        self.logger = logger
+        if rate is None:
+            rate = float(os.environ.get('CLINIQA_TRACE_SAMPLE', '0') or 0)
+        self.rate = rate
+
+    def enabled(self):
+        return self.rate > 0 and self.logger.isEnabledFor(logging.DEBUG)
+
+    def sample(self, rows):
+        """Yield each of rows with probability rate"""
+        rate = self.rate
+        for row in rows:
+            if random.random() < rate:
+                yield row
@@ -0,0 +1,33 @@
+"""
+Pagination Parameters Shared by the Portal APIs
+
+Paginated endpoints take a page size (limit) and an opaque integer cursor
+returned as next_cursor by the previous page.
+"""
+
+# Largest page a paginated request may ask for
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page_params(limit, cursor):
+    """
+    Validate the limit/cursor pagination parameters of a request
+
+    Returns:
+        Tuple of (limit, cursor); limit is None when no pagination was requested
+
+    Raises:
+        ValueError: If either parameter is malformed
+    """
+    if limit in (None, ''):
+        return None, 0
+    try:
+        limit = int(limit)
+        cursor = int(cursor) if cursor not in (None, '') else 0
+    except (TypeError, ValueError):
+        raise ValueError('limit and cursor must be integers')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    if cursor < 0:
+        raise ValueError('cursor must not be negative')
+    return limit, cursor
@@ -0,0 +1,457 @@
+"""
+Storage Backends for the ADR Reports
+
+Every portal reads and appends reports through a ReportStorage. The default
+backend is the flat adr_reports.csv file; setting CLINIQA_STORAGE=sqlite
+switches to an SQLite database in WAL mode next to it (adr_reports.db),
+which gives concurrent readers, indexed lookups and crash-safe appends.
+
+Both backends expose the same incremental reader (tail()), so the in-memory
+caches of the portals extend themselves with only the rows added since
+their last refresh, whichever backend holds the data.
+
+The CSV file and the database can be converted into each other:
+
+    python -m common.storage import   # adr_reports.csv -> adr_reports.db
+    python -m common.storage export   # adr_reports.db -> adr_reports.csv
+"""
+
+import argparse
+import calendar
+import csv
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from common.csv_index import CSVLineIndex
+from common.csv_tail import CSVTail
+from common.http_cache import data_version
+
+FIELDNAMES = [
+    'timestamp', 'drug_name', 'medical_condition', 'adverse_reaction', 'severity',
+    'confidence', 'cause_of_administration', 'gender', 'patient_id', 'current_medication'
+]
+
+# Columns the SQLite backend keeps an index on; timestamps are indexed
+# through their sortable epoch value
+SQLITE_INDEXED_COLUMNS = ['drug_name', 'medical_condition', 'adverse_reaction', 'patient_id']
+
+TIMESTAMP_FORMAT = '%d-%m-%Y %H:%M'
+
+STORAGE_ENV = 'CLINIQA_STORAGE'
+
+# When appended rows are forced to disk: never (left to the OS), once per
+# append_many() call, or after every row
+FSYNC_POLICIES = ('none', 'batch', 'row')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CSV_FILE = os.path.join(ROOT_DIR, 'adr_reports.csv')
+
+
+def timestamp_epoch(text):
+    """Return the report timestamp as epoch seconds (naive wall clock), or None"""
+    try:
+        return calendar.timegm(datetime.datetime.strptime(text, TIMESTAMP_FORMAT).timetuple())
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_row(row):
+    """Return a dict holding exactly FIELDNAMES, with missing values as ''"""
+    return {field: (row.get(field) or '') for field in FIELDNAMES}
+
+
+class ReportStorage:
+    """
+    Interface shared by the storage backends
+
+    Rows are dicts keyed by FIELDNAMES.
+    """
+
+    path = None
+
+    def exists(self):
+        """Check whether the backing file exists"""
+        return os.path.exists(self.path)
+
+    def ensure(self):
+        """
+        Create an empty store if none exists yet
+
+        Returns:
+            True if a new store was created
+        """
+        raise NotImplementedError
+
+    def append(self, row, fsync='none'):
+        """Add one report row"""
+        self.append_many([row], fsync)
+
+    def append_many(self, rows, fsync='none'):
+        """
+        Add several report rows in one write
+
+        Args:
+            rows: Row dicts, oldest first
+            fsync: One of FSYNC_POLICIES; the rows are on disk when this
+                returns unless it is 'none'
+        """
+        raise NotImplementedError
+
+    def replace(self, rows):
+        """Atomically replace the whole contents with rows"""
+        raise NotImplementedError
+
+    def iter_rows(self):
+        """Yield every row, oldest first"""
+        raise NotImplementedError
+
+    def count(self):
+        """Return the number of stored rows"""
+        return sum(1 for _ in self.iter_rows())
+
+    def find(self, **criteria):
+        """Return the rows whose columns equal all the given values, oldest first"""
+        return [
+            row for row in self.iter_rows()
+            if all(row.get(column) == value for column, value in criteria.items())
+        ]
+
+    def newest(self, limit, before=None):
+        """
+        Return up to limit rows, newest first, without reading the others
+
+        Args:
+            limit: Maximum number of rows
+            before: Cursor returned by the previous call; None starts at
+                the newest row
+
+        Returns:
+            Tuple of (rows, next_before); next_before is None once the
+            oldest row was returned
+        """
+        raise NotImplementedError
+
+    def state(self):
+        """
+        Describe the current contents for change detection
+
+        Returns:
+            (version, last_modified) where version changes whenever the
+            contents may have, or None if the store does not exist
+        """
+        raise NotImplementedError
+
+    def tail(self):
+        """Return a reader with is_continuation() and read_rows(), starting at the first row"""
+        raise NotImplementedError
+
+
+class CSVStorage(ReportStorage):
+    """Reports in a flat, append-only CSV file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._line_index = None
+
+    def ensure(self):
+        if os.path.exists(self.path):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w', newline='', encoding='utf-8') as file:
+            csv.writer(file).writerow(FIELDNAMES)
+        return True
+
+    def append_many(self, rows, fsync='none'):
+        with open(self.path, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+            # Write header if file is new
+            if file.tell() == 0:
+                writer.writeheader()
+            if fsync == 'row':
+                for row in rows:
+                    writer.writerow(normalize_row(row))
+                    file.flush()
+                    os.fsync(file.fileno())
+                return
+            writer.writerows(normalize_row(row) for row in rows)
+            if fsync == 'batch':
+                file.flush()
+                os.fsync(file.fileno())
+
+    def replace(self, rows):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write next to the target and rename, so readers never see a
+        # half-written file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+                writer.writeheader()
+                writer.writerows(normalize_row(row) for row in rows)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def iter_rows(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                yield normalize_row(row)
+
+    def line_index(self):
+        """Return the file's line-offset index, brought up to date"""
+        if self._line_index is None:
+            self._line_index = CSVLineIndex(self.path)
+        self._line_index.refresh()
+        return self._line_index
+
+    def newest(self, limit, before=None):
+        # Cursors are row positions, which never change in an append-only file
+        return self.line_index().newest(limit, before)
+
+    def state(self):
+        try:
+            file_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return data_version(file_stat), file_stat.st_mtime
+
+    def tail(self):
+        return CSVTail(self.path)
+
+
+class SQLiteTail:
+    """Incremental reader over an SQLiteStorage, mirroring CSVTail"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.path = storage.path
+        self.fieldnames = FIELDNAMES
+        self.last_id = 0
+        self.generation = None
+
+    def is_continuation(self):
+        """
+        Check whether the rows read so far are still the start of the table
+
+        Returns False once the contents were replaced (e.g. by a CSV import),
+        in which case the reader must be discarded and the rows read afresh.
+        """
+        return self.generation is None or self.generation == self.storage.generation()
+
+    def read_rows(self):
+        """Return the rows added since the last call"""
+        connection = self.storage.connection()
+        # Both reads come from one snapshot
+        connection.execute('BEGIN')
+        try:
+            generation = self.storage.generation()
+            records = connection.execute(
+                f'SELECT id, {", ".join(FIELDNAMES)} FROM reports WHERE id > ? ORDER BY id',
+                (self.last_id,)
+            ).fetchall()
+        finally:
+            connection.execute('COMMIT')
+        if self.generation is None:
+            self.generation = generation
+        if records:
+            self.last_id = records[-1][0]
+        return [dict(zip(FIELDNAMES, record[1:])) for record in records]
+
+
+class SQLiteStorage(ReportStorage):
+    """Reports in an SQLite database in WAL mode"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            # WAL lets readers proceed while a report is being written;
+            # NORMAL sync is still crash-safe in WAL mode
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._create_schema(connection)
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self, connection):
+        columns = ', '.join(f"{field} TEXT NOT NULL DEFAULT ''" for field in FIELDNAMES)
+        with connection:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS reports ('
+                f'id INTEGER PRIMARY KEY AUTOINCREMENT, {columns}, timestamp_epoch INTEGER)'
+            )
+            for column in SQLITE_INDEXED_COLUMNS:
+                connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS reports_{column} ON reports ({column})'
+                )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS reports_timestamp ON reports (timestamp_epoch)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('generation', '1'), ('modified', ?)",
+                (repr(time.time()),)
+            )
+
+    def ensure(self):
+        created = not os.path.exists(self.path)
+        self.connection()
+        return created
+
+    def generation(self):
+        """Return the counter bumped whenever the contents are replaced"""
+        return int(self._meta('generation'))
+
+    def _meta(self, key):
+        return self.connection().execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()[0]
+
+    def _insert(self, connection, rows):
+        connection.executemany(
+            f'INSERT INTO reports ({", ".join(FIELDNAMES)}, timestamp_epoch) '
+            f'VALUES ({", ".join("?" * (len(FIELDNAMES) + 1))})',
+            (
+                [row[field] for field in FIELDNAMES] + [timestamp_epoch(row['timestamp'])]
+                for row in map(normalize_row, rows)
+            )
+        )
+        connection.execute(
+            "UPDATE meta SET value = ? WHERE key = 'modified'", (repr(time.time()),)
+        )
+
+    def append_many(self, rows, fsync='none'):
+        connection = self.connection()
+        # FULL syncs the WAL on every commit; NORMAL leaves it to checkpoints
+        connection.execute(f'PRAGMA synchronous={"NORMAL" if fsync == "none" else "FULL"}')
+        try:
+            if fsync == 'row':
+                for row in rows:
+                    with connection:
+                        self._insert(connection, [row])
+            else:
+                with connection:
+                    self._insert(connection, rows)
+        finally:
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+    def replace(self, rows):
+        connection = self.connection()
+        with connection:
+            connection.execute('DELETE FROM reports')
+            connection.execute(
+                "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'"
+            )
+            self._insert(connection, rows)
+
+    def iter_rows(self):
+        if not os.path.exists(self.path):
+            return
+        cursor = self.connection().execute(f'SELECT {", ".join(FIELDNAMES)} FROM reports ORDER BY id')
+        for record in cursor:
+            yield dict(zip(FIELDNAMES, record))
+
+    def count(self):
+        if not os.path.exists(self.path):
+            return 0
+        return self.connection().execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+
+    def find(self, **criteria):
+        unknown = set(criteria) - set(FIELDNAMES)
+        if unknown:
+            raise ValueError(f'Unknown report columns: {", ".join(sorted(unknown))}')
+        where = ' AND '.join(f'{column} = ?' for column in criteria) or '1'
+        cursor = self.connection().execute(
+            f'SELECT {", ".join(FIELDNAMES)} FROM reports WHERE {where} ORDER BY id',
+            tuple(criteria.values())
+        )
+        return [dict(zip(FIELDNAMES, record)) for record in cursor]
+
+    def newest(self, limit, before=None):
+        if not os.path.exists(self.path):
+            return [], None
+        # Cursors are row ids; one extra row tells whether older ones remain
+        cursor = self.connection().execute(
+            f'SELECT id, {", ".join(FIELDNAMES)} FROM reports WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (before if before is not None else 2 ** 63 - 1, limit + 1)
+        )
+        records = cursor.fetchall()
+        rows = [dict(zip(FIELDNAMES, record[1:])) for record in records[:limit]]
+        return rows, (records[limit - 1][0] if len(records) > limit else None)
+
+    def state(self):
+        if not os.path.exists(self.path):
+            return None
+        generation, modified, last_id = self.connection().execute(
+            "SELECT (SELECT value FROM meta WHERE key = 'generation'), "
+            "(SELECT value FROM meta WHERE key = 'modified'), "
+            "(SELECT MAX(id) FROM reports)"
+        ).fetchone()
+        return f'{int(generation):x}-{last_id or 0:x}', float(modified)
+
+    def tail(self):
+        return SQLiteTail(self)
+
+
+def open_storage(csv_path=DEFAULT_CSV_FILE):
+    """
+    Return the configured storage backend for the reports
+
+    Args:
+        csv_path: Location of adr_reports.csv; the SQLite database, when
+            selected with CLINIQA_STORAGE=sqlite, lives next to it
+    """
+    backend = os.environ.get(STORAGE_ENV, 'csv').strip().lower()
+    if backend == 'sqlite':
+        return SQLiteStorage(os.path.splitext(str(csv_path))[0] + '.db')
+    if backend != 'csv':
+        raise ValueError(f'Unknown {STORAGE_ENV} backend: {backend}')
+    return CSVStorage(csv_path)
+
+
+def import_csv(csv_path, storage):
+    """Replace the contents of storage with the rows of a CSV file"""
+    storage.replace(CSVStorage(csv_path).iter_rows())
+    return storage.count()
+
+
+def export_csv(storage, csv_path):
+    """Write every row of storage to a CSV file, replacing it"""
+    CSVStorage(csv_path).replace(storage.iter_rows())
+    return storage.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert ADR reports between CSV and SQLite')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('--csv', default=DEFAULT_CSV_FILE, help='CSV file path')
+    parser.add_argument('--db', default=os.path.splitext(DEFAULT_CSV_FILE)[0] + '.db',
+                        help='SQLite database path')
+    args = parser.parse_args()
+
+    database = SQLiteStorage(args.db)
+    if args.command == 'import':
+        count = import_csv(args.csv, database)
+        print(f"Imported {count} reports from {args.csv} into {args.db}")
+    else:
+        count = export_csv(database, args.csv)
+        print(f"Exported {count} reports from {args.db} to {args.csv}")
+
+
+if __name__ == '__main__':
+    main()
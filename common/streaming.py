@@ -0,0 +1,88 @@
+"""
+Incremental JSON Responses
+
+Builds large JSON responses piece by piece so a server never holds the
+whole serialized body in memory, and writes them from http.server handlers
+with chunked transfer encoding.
+"""
+
+import json
+
+from common.compression import iter_compressed
+
+# Number of array items serialized per yielded piece
+STREAM_BATCH_SIZE = 500
+
+
+def iter_json_object(fields, array_key, items, batch_size=STREAM_BATCH_SIZE, encode=json.dumps):
+    """
+    Serialize {**fields, array_key: [items...]} incrementally
+
+    Args:
+        fields: Dict of the small top-level fields, written first
+        array_key: Name of the array field, written last
+        items: Iterable of JSON-serializable items, consumed lazily
+        batch_size: Number of items serialized per yielded string
+        encode: Function turning one item into JSON text; pass str for
+            items that are already serialized
+
+    Yields:
+        str pieces whose concatenation is the complete JSON document
+    """
+    head = json.dumps(fields)[:-1]
+    yield head + (', ' if fields else '') + json.dumps(array_key) + ': ['
+
+    batch = []
+    first = True
+    for item in items:
+        batch.append(encode(item))
+        if len(batch) >= batch_size:
+            yield ('' if first else ', ') + ', '.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ', ') + ', '.join(batch)
+
+    yield ']}'
+
+
+def send_streamed(handler, pieces, content_type='application/json', status=200, headers=None, encoding=None):
+    """
+    Send a response body from an iterable of str or bytes pieces via a BaseHTTPRequestHandler
+
+    Uses chunked transfer encoding on HTTP/1.1 connections. HTTP/1.0 has no
+    chunked encoding, so there the body is delimited by closing the connection.
+
+    Args:
+        headers: Optional dict of extra response headers
+        encoding: Content coding from compression.negotiate_encoding(), or
+            None to send the pieces uncompressed
+    """
+    if encoding:
+        pieces = iter_compressed(pieces, encoding)
+    chunked = handler.request_version == 'HTTP/1.1' and handler.protocol_version == 'HTTP/1.1'
+
+    handler.send_response(status)
+    handler.send_header('Content-type', content_type)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    if encoding:
+        handler.send_header('Content-Encoding', encoding)
+    handler.send_header('Vary', 'Accept-Encoding')
+    if chunked:
+        handler.send_header('Transfer-Encoding', 'chunked')
+    else:
+        handler.send_header('Connection', 'close')
+        handler.close_connection = True
+    handler.end_headers()
+
+    for piece in pieces:
+        data = piece.encode('utf-8') if isinstance(piece, str) else piece
+        if not data:
+            continue
+        if chunked:
+            handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            handler.wfile.write(data)
+    if chunked:
+        handler.wfile.write(b'0\r\n\r\n')
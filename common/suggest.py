@@ -0,0 +1,176 @@
+"""
+Frequency-Ranked Prefix Trie for Typeahead Suggestions
+
+Values are indexed in a compressed (radix) trie under every word start, so
+"dia" suggests both "Diabetes" and "Type 2 Diabetes". Each node records the
+highest count in its subtree, and a query expands nodes best-first, so the
+top k matches are found without visiting every value under the prefix.
+Counts only ever grow, which keeps those per-node maxima exact.
+"""
+
+import heapq
+import threading
+
+# Suggestions returned when the request does not say how many
+DEFAULT_SUGGESTIONS = 10
+# Most suggestions one request may ask for
+MAX_SUGGESTIONS = 50
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def word_starts(text):
+    """Return the tails of normalized text that begin at a word boundary"""
+    return [
+        text[i:] for i in range(len(text))
+        if text[i].isalnum() and (i == 0 or not text[i - 1].isalnum())
+    ]
+
+
+class _Node:
+    __slots__ = ('label', 'children', 'values', 'best')
+
+    def __init__(self, label=''):
+        self.label = label      # edge text leading into this node
+        self.children = {}      # first character of child label -> child
+        self.values = None      # normalized values with a word start ending here
+        self.best = 0           # highest count of any value in this subtree
+
+
+class PrefixTrie:
+    """Thread-safe typeahead index of values and their report counts"""
+
+    def __init__(self):
+        self._root = _Node()
+        self.counts = {}    # normalized value -> count
+        self.display = {}   # normalized value -> text shown, as first added
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, value, count=1):
+        """Add count occurrences of value, inserting it on first sight"""
+        key = normalize(value)
+        if not key:
+            return
+        with self._lock:
+            if key not in self.display:
+                self.display[key] = value.strip()
+            total = self.counts[key] = self.counts.get(key, 0) + count
+            for tail in word_starts(key):
+                self._insert(tail, key, total)
+
+    def _insert(self, text, key, total):
+        node = self._root
+        node.best = max(node.best, total)
+        i = 0
+        while i < len(text):
+            child = node.children.get(text[i])
+            if child is None:
+                child = node.children[text[i]] = _Node(text[i:])
+            else:
+                label = child.label
+                common = 1
+                while common < len(label) and i + common < len(text) and label[common] == text[i + common]:
+                    common += 1
+                if common < len(label):
+                    # Split the edge where text leaves it
+                    middle = _Node(label[:common])
+                    middle.best = child.best
+                    child.label = label[common:]
+                    middle.children[child.label[0]] = child
+                    node.children[text[i]] = middle
+                    child = middle
+            child.best = max(child.best, total)
+            node = child
+            i += len(node.label)
+        if node.values is None:
+            node.values = set()
+        node.values.add(key)
+
+    def _find(self, prefix):
+        node = self._root
+        i = 0
+        while i < len(prefix):
+            node = node.children.get(prefix[i])
+            if node is None:
+                return None
+            step = min(len(node.label), len(prefix) - i)
+            if node.label[:step] != prefix[i:i + step]:
+                return None
+            i += step
+        return node
+
+    def suggest(self, prefix, k=DEFAULT_SUGGESTIONS):
+        """
+        Return the k most frequent values with a word starting with prefix
+
+        Returns:
+            List of (value, count), highest count first; equal counts are
+            ordered alphabetically
+        """
+        prefix = normalize(prefix)
+        results = []
+        with self._lock:
+            start = self._find(prefix)
+            if start is None or k < 1:
+                return results
+
+            counts = self.counts
+            seen = set()
+            # Entries are (-bound, sequence, node, value); value entries
+            # carry their exact count, node entries their subtree maximum
+            heap = [(-start.best, 0, start, None)]
+            sequence = 1
+            tied = []
+            tied_count = None
+            while heap:
+                if tied and -heap[0][0] < tied_count:
+                    results.extend(sorted(tied, key=lambda value: self.display[value].lower()))
+                    tied = []
+                    if len(results) >= k:
+                        break
+                bound, _, node, value = heapq.heappop(heap)
+                if node is None:
+                    if value not in seen:
+                        seen.add(value)
+                        tied.append(value)
+                        tied_count = -bound
+                    continue
+                for value in node.values or ():
+                    heapq.heappush(heap, (-counts[value], sequence, None, value))
+                    sequence += 1
+                for child in node.children.values():
+                    heapq.heappush(heap, (-child.best, sequence, child, None))
+                    sequence += 1
+            results.extend(sorted(tied, key=lambda value: self.display[value].lower()))
+            return [(self.display[value], counts[value]) for value in results[:k]]
+
+
+def parse_suggest_params(field, query, k, fields):
+    """
+    Validate the field/q/k parameters of a suggestion request
+
+    Args:
+        fields: Accepted field names
+
+    Returns:
+        Tuple of (field, query, k)
+
+    Raises:
+        ValueError: If a parameter is missing or malformed
+    """
+    if field not in fields:
+        raise ValueError(f"field must be one of: {', '.join(sorted(fields))}")
+    if k in (None, ''):
+        k = DEFAULT_SUGGESTIONS
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        raise ValueError('k must be an integer')
+    if k < 1 or k > MAX_SUGGESTIONS:
+        raise ValueError(f'k must be between 1 and {MAX_SUGGESTIONS}')
+    return field, query or '', k
@@ -0,0 +1,115 @@
+"""
+Group-Commit Writer for Report Submissions
+
+Each process appends reports through one writer thread. Submissions that
+arrive within a few milliseconds of each other are written to storage in a
+single batch, and every submitter is answered only once its batch is
+durable under the configured fsync policy (CLINIQA_FSYNC=none|batch|row,
+default batch).
+"""
+
+import os
+import queue
+import threading
+import time
+
+from common.storage import FSYNC_POLICIES
+
+FSYNC_ENV = 'CLINIQA_FSYNC'
+
+# Submissions allowed to wait for the writer before submit() blocks
+MAX_QUEUED = 1024
+# Most rows written in one batch
+MAX_BATCH = 256
+# How long the writer keeps collecting a batch after its first row
+BATCH_DELAY = 0.002
+# How long submit() waits for a place in a full queue
+SUBMIT_TIMEOUT = 10
+
+
+def fsync_policy():
+    """Return the fsync policy configured through CLINIQA_FSYNC"""
+    policy = os.environ.get(FSYNC_ENV, 'batch').strip().lower()
+    if policy not in FSYNC_POLICIES:
+        raise ValueError(f'Unknown {FSYNC_ENV} policy: {policy}')
+    return policy
+
+
+class Submission:
+    """One queued row and the outcome of writing it"""
+
+    __slots__ = ('row', 'done', 'error')
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitWriter:
+    """Serializes report appends through a single thread, batching concurrent ones"""
+
+    def __init__(self, storage, fsync=None, max_queued=MAX_QUEUED, max_batch=MAX_BATCH,
+                 batch_delay=BATCH_DELAY):
+        self.storage = storage
+        self.fsync = fsync or fsync_policy()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {self.fsync}')
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started on first use so importing a server module spawns no thread
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='report-writer', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, row, timeout=SUBMIT_TIMEOUT):
+        """
+        Queue a row and wait until it has been written
+
+        Raises:
+            TimeoutError: If the queue stayed full for timeout seconds
+            Exception: Whatever writing the row's batch raised
+        """
+        self._ensure_started()
+        submission = Submission(row)
+        try:
+            self._queue.put(submission, timeout=timeout)
+        except queue.Full:
+            raise TimeoutError('Report write queue is full')
+        submission.done.wait()
+        if submission.error is not None:
+            raise submission.error
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            error = None
+            try:
+                self.storage.append_many([submission.row for submission in batch], self.fsync)
+            except Exception as e:
+                error = e
+            for submission in batch:
+                submission.error = error
+                submission.done.set()
@@ -0,0 +1,599 @@
+"""
+Columnar ADR Report Store for the Doctor Portal
+
+Holds the rows of adr_reports.csv column by column instead of as one dict per
+row. Low-cardinality text columns are dictionary-encoded into integer codes,
+and timestamps are parsed once at load into epoch seconds, so searches test
+each distinct value once and then only compare integers per row.
+"""
+
+import calendar
+import datetime
+from collections import Counter
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from common.storage import FIELDNAMES
+from common.suggest import PrefixTrie
+
+# Columns stored as integer codes into a per-column dictionary
+ENCODED_COLUMNS = [
+    'drug_name', 'medical_condition', 'adverse_reaction', 'severity',
+    'confidence', 'cause_of_administration', 'gender', 'current_medication'
+]
+
+# Columns searched by substring; these get a trigram index over their
+# distinct values and a row posting list per value
+INDEXED_COLUMNS = ['drug_name', 'adverse_reaction', 'medical_condition']
+
+TRIGRAM_SIZE = 3
+
+# /api/suggest field name -> column whose values are suggested
+SUGGEST_FIELDS = {
+    'drug': 'drug_name',
+    'condition': 'medical_condition',
+    'reaction': 'adverse_reaction'
+}
+
+# Normalized values that stand for "nothing reported" rather than a real value
+PLACEHOLDER_VALUES = frozenset(['', 'none', 'n/a', 'not specified', 'not applicable', 'not reported'])
+
+TIMESTAMP_FORMAT = "%d-%m-%Y %H:%M"
+
+# Epoch value stored for rows whose timestamp could not be parsed
+UNPARSED_TIMESTAMP = -2 ** 63
+
+
+def parse_timestamp(text):
+    """
+    Parse a report timestamp into epoch seconds
+
+    Timestamps are naive wall-clock times, so they are converted as if they
+    were UTC; compare them against now_epoch(), never against time.time().
+
+    Returns:
+        Tuple of (epoch, canonical) where canonical is False when the text
+        would not be reproduced exactly by formatting the epoch back, or
+        (UNPARSED_TIMESTAMP, False) if the text is not a valid timestamp
+    """
+    # Fast path for the "dd-mm-YYYY HH:MM" layout every writer produces
+    if (len(text) == 16 and text[2] == '-' and text[5] == '-'
+            and text[10] == ' ' and text[13] == ':'):
+        try:
+            parsed = datetime.datetime(
+                int(text[6:10]), int(text[3:5]), int(text[0:2]),
+                int(text[11:13]), int(text[14:16])
+            )
+            return calendar.timegm(parsed.timetuple()), True
+        except ValueError:
+            pass
+
+    try:
+        parsed = datetime.datetime.strptime(text.strip(), TIMESTAMP_FORMAT)
+    except ValueError:
+        return UNPARSED_TIMESTAMP, False
+    return calendar.timegm(parsed.timetuple()), False
+
+
+def format_timestamp(epoch):
+    """Format epoch seconds produced by parse_timestamp() back into report form"""
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
+def now_epoch():
+    """Current local wall-clock time on the same scale as parse_timestamp()"""
+    return calendar.timegm(datetime.datetime.now().timetuple())
+
+
+def trigrams(text):
+    """Return the set of overlapping character trigrams in text"""
+    return {text[i:i + TRIGRAM_SIZE] for i in range(len(text) - TRIGRAM_SIZE + 1)}
+
+
+class ColumnDictionary:
+    """Maps the distinct values of one column to dense integer codes"""
+
+    __slots__ = ('values', 'normalized', '_codes', 'trigram_index')
+
+    def __init__(self, indexed=False):
+        self.values = []       # code -> original value
+        self.normalized = []   # code -> value.lower().strip(), computed once
+        self._codes = {}
+        # trigram -> set of codes whose normalized value contains it
+        self.trigram_index = {} if indexed else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """Return the code for a value, adding it to the dictionary if new"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            normalized = value.lower().strip()
+            self._codes[value] = code
+            self.values.append(value)
+            self.normalized.append(normalized)
+            if self.trigram_index is not None:
+                for gram in trigrams(normalized):
+                    self.trigram_index.setdefault(gram, set()).add(code)
+        return code
+
+    def code(self, value):
+        """Return the code of value, or None if the dictionary does not hold it"""
+        return self._codes.get(value)
+
+    def matching(self, predicate):
+        """Return the set of codes whose normalized value satisfies predicate"""
+        return {code for code, value in enumerate(self.normalized) if predicate(value)}
+
+    def containing(self, query):
+        """
+        Return the set of codes whose normalized value contains query
+
+        With a trigram index, only values sharing every trigram of the query
+        are checked; queries shorter than a trigram scan the distinct values.
+        """
+        if self.trigram_index is None or len(query) < TRIGRAM_SIZE:
+            return self.matching(lambda value: query in value)
+
+        candidates = None
+        for gram in sorted(trigrams(query), key=lambda g: len(self.trigram_index.get(g, ()))):
+            codes = self.trigram_index.get(gram)
+            if not codes:
+                return set()
+            candidates = set(codes) if candidates is None else candidates & codes
+            if not candidates:
+                return set()
+        return {code for code in candidates if query in self.normalized[code]}
+
+
+class TokenIndex:
+    """
+    Comma-separated values of one column, split into interned tokens
+
+    Each distinct value is split, normalized and interned once, when its
+    code is first seen; placeholder tokens are dropped there. A query then
+    resolves to the value codes holding a matching token through the
+    token -> value codes postings, and rows follow from the column's own
+    posting lists.
+    """
+
+    def __init__(self):
+        self.tokens = ColumnDictionary(indexed=True)  # token -> token id
+        self.value_tokens = []   # value code -> frozenset of token ids
+        self.token_values = []   # token id -> set of value codes
+
+    def add_value(self, code, normalized):
+        """Tokenize a new value of the column; codes must arrive in order"""
+        token_ids = set()
+        for token in normalized.split(','):
+            token = token.strip()
+            if token in PLACEHOLDER_VALUES:
+                continue
+            token_id = self.tokens.encode(token)
+            if token_id == len(self.token_values):
+                self.token_values.append(set())
+            self.token_values[token_id].add(code)
+            token_ids.add(token_id)
+        self.value_tokens.append(frozenset(token_ids))
+
+    def tokens_overlapping(self, query):
+        """Return the ids of tokens that contain query or are contained in it"""
+        token_ids = self.tokens.containing(query)
+        # Tokens inside the query are found by looking up its substrings,
+        # which costs O(len(query)^2) regardless of the vocabulary size
+        for start in range(len(query)):
+            for end in range(start + 1, len(query) + 1):
+                token_id = self.tokens.code(query[start:end])
+                if token_id is not None:
+                    token_ids.add(token_id)
+        return token_ids
+
+    def value_codes(self, token_ids):
+        """Return the codes of the values holding any of token_ids"""
+        codes = set()
+        for token_id in token_ids:
+            codes |= self.token_values[token_id]
+        return codes
+
+
+class TimeIndex:
+    """
+    Report rows ordered by timestamp, for date range lookups by binary search
+
+    Rows arrive in file order, which is mostly but not strictly time order.
+    New rows are buffered and merged on the next lookup: rows at or after
+    the current end are appended, anything older triggers one re-sort.
+    Rows whose timestamp could not be parsed are kept in a separate bucket.
+    """
+
+    def __init__(self):
+        self.epochs = array('q')   # ascending epoch seconds
+        self.rows = array('i')     # row index for each entry of epochs
+        self.unparsed = array('i')
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.epochs) + len(self._pending)
+
+    def add(self, index, epoch):
+        """Record the timestamp of a newly appended row"""
+        if epoch == UNPARSED_TIMESTAMP:
+            self.unparsed.append(index)
+        else:
+            self._pending.append((epoch, index))
+
+    def _merge_pending(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        pending.sort()
+        if not self.epochs or pending[0][0] >= self.epochs[-1]:
+            self.epochs.extend(epoch for epoch, _ in pending)
+            self.rows.extend(index for _, index in pending)
+            return
+        merged = sorted(list(zip(self.epochs, self.rows)) + pending)
+        self.epochs = array('q', (epoch for epoch, _ in merged))
+        self.rows = array('i', (index for _, index in merged))
+
+    def rows_after(self, cutoff):
+        """
+        Return the rows with a timestamp later than cutoff
+
+        Returns:
+            List of row indices in ascending row order
+        """
+        with self._lock:
+            self._merge_pending()
+            start = bisect_right(self.epochs, cutoff)
+            return sorted(self.rows[start:])
+
+    def count_after(self, cutoff):
+        """Return how many rows have a timestamp later than cutoff"""
+        with self._lock:
+            self._merge_pending()
+            return len(self.epochs) - bisect_right(self.epochs, cutoff)
+
+
+class DrugStats:
+    """
+    Report counts per drug, per (drug, condition) and per (drug, severity)
+
+    Kept up to date as rows are appended, so counts and percentages for a
+    drug are sums over a few counters instead of scans over its rows. All
+    keys are the integer codes of the store's column dictionaries.
+    """
+
+    # Columns counted per drug
+    PAIR_COLUMNS = ('medical_condition', 'severity')
+
+    def __init__(self):
+        self.totals = Counter()  # drug code -> rows
+        # column -> drug code -> Counter(value code -> rows)
+        self.pairs = {column: {} for column in self.PAIR_COLUMNS}
+
+    def add(self, drug, codes):
+        """Count one row of drug code drug; codes maps each PAIR_COLUMNS column to its code"""
+        for column in self.PAIR_COLUMNS:
+            counts = self.pairs[column].get(drug)
+            if counts is None:
+                counts = self.pairs[column][drug] = Counter()
+            counts[codes[column]] += 1
+        # The total is bumped last, so a reader never sees a drug total
+        # that its pair counts do not yet add up to
+        self.totals[drug] += 1
+
+    def total(self, drugs):
+        """Return the number of rows with any of the drug codes in drugs"""
+        totals = self.totals
+        return sum(totals.get(drug, 0) for drug in drugs)
+
+    def pair_count(self, drugs, column, codes):
+        """Return the number of rows with one of drugs and one of codes in column"""
+        count = 0
+        for drug in drugs:
+            counts = self.pairs[column].get(drug)
+            if not counts:
+                continue
+            if len(codes) < len(counts):
+                count += sum(counts.get(code, 0) for code in codes)
+            else:
+                count += sum(n for code, n in list(counts.items()) if code in codes)
+        return count
+
+    def breakdown(self, drugs, column):
+        """Return Counter(value code -> rows) of column over the rows of drugs"""
+        merged = Counter()
+        for drug in drugs:
+            counts = self.pairs[column].get(drug)
+            if counts:
+                merged.update(dict(counts))
+        return merged
+
+
+def percentage(part, whole):
+    """Return part as a percentage of whole, rounded to two decimals (0 if whole is 0)"""
+    return round((part * 100) / whole, 2) if whole else 0
+
+
+class ADRStore:
+    """In-memory, dictionary-encoded view of the ADR reports"""
+
+    def __init__(self):
+        self.dictionaries = {
+            column: ColumnDictionary(indexed=column in INDEXED_COLUMNS) for column in ENCODED_COLUMNS
+        }
+        self.codes = {column: array('i') for column in ENCODED_COLUMNS}
+        # column -> code -> ascending row indices holding that value
+        self.postings = {column: [] for column in INDEXED_COLUMNS}
+        self.timestamps = array('q')
+        self.patient_ids = []
+        # Row index -> raw timestamp text for values that cannot be
+        # reproduced from the epoch (unparseable or non-canonical)
+        self.raw_timestamps = {}
+        self.time_index = TimeIndex()
+        self.drug_stats = DrugStats()
+        self.condition_tokens = TokenIndex()
+        # column -> typeahead trie of its values, ranked by report count
+        self.suggestions = {column: PrefixTrie() for column in SUGGEST_FIELDS.values()}
+
+        # Read position in the backing report storage
+        self.source = None
+
+    @classmethod
+    def from_storage(cls, storage):
+        """Build a store from a report storage backend (see common.storage)"""
+        store = cls()
+        store.ingest(storage)
+        return store
+
+    def is_continuation(self, storage):
+        """
+        Check whether storage still starts with the rows this store consumed
+
+        Returns False if the data was replaced, truncated or rewritten, in
+        which case the store must be rebuilt rather than extended.
+        """
+        return self.source is None or (self.source.path == storage.path and self.source.is_continuation())
+
+    def ingest(self, storage):
+        """
+        Append the rows added to storage since the last call
+
+        For CSV files only complete lines are consumed; a row still being
+        written is picked up by the next call. Call is_continuation() first,
+        since the data is assumed to only ever grow.
+
+        Returns:
+            Number of rows added
+        """
+        if self.source is None:
+            self.source = storage.tail()
+        start = len(self)
+        for row in self.source.read_rows():
+            self.append(row)
+        self.update_suggestions(start)
+        return len(self) - start
+
+    def update_suggestions(self, start):
+        """Add the rows from index start on to the typeahead tries, one update per distinct value"""
+        for column, trie in self.suggestions.items():
+            dictionary = self.dictionaries[column]
+            for code, count in Counter(self.codes[column][start:]).items():
+                if dictionary.normalized[code] not in PLACEHOLDER_VALUES:
+                    trie.add(dictionary.values[code], count)
+
+    def suggest(self, field, prefix, k):
+        """
+        Return up to k values of an /api/suggest field with a word starting with prefix
+
+        Returns:
+            List of {'value', 'count'} dicts, most reported first
+        """
+        trie = self.suggestions[SUGGEST_FIELDS[field]]
+        return [{'value': value, 'count': count} for value, count in trie.suggest(prefix, k)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, row):
+        """
+        Add one report row
+
+        Args:
+            row: Mapping of CSV field names to values, as produced by csv.DictReader
+
+        Returns:
+            Index of the new row, or None if the row was empty and skipped
+        """
+        values = {field: (row.get(field) or '') for field in FIELDNAMES}
+        if not any(values.values()):
+            return None
+
+        index = len(self.timestamps)
+        row_codes = {}
+        for column in ENCODED_COLUMNS:
+            dictionary = self.dictionaries[column]
+            code = row_codes[column] = dictionary.encode(values[column])
+            self.codes[column].append(code)
+            if column == 'medical_condition' and code == len(self.condition_tokens.value_tokens):
+                self.condition_tokens.add_value(code, dictionary.normalized[code])
+            postings = self.postings.get(column)
+            if postings is not None:
+                if code == len(postings):
+                    postings.append(array('i'))
+                postings[code].append(index)
+
+        epoch, canonical = parse_timestamp(values['timestamp'])
+        if not canonical:
+            self.raw_timestamps[index] = values['timestamp']
+        self.patient_ids.append(values['patient_id'])
+
+        # The timestamp column defines len(self), so it is extended last and
+        # concurrent readers never see a partially appended row
+        self.timestamps.append(epoch)
+        self.time_index.add(index, epoch)
+        self.drug_stats.add(row_codes['drug_name'], row_codes)
+        return index
+
+    def value(self, column, index):
+        """Return the original text of one cell"""
+        if column == 'timestamp':
+            raw = self.raw_timestamps.get(index)
+            return raw if raw is not None else format_timestamp(self.timestamps[index])
+        if column == 'patient_id':
+            return self.patient_ids[index]
+        return self.dictionaries[column].values[self.codes[column][index]]
+
+    def row(self, index):
+        """Rebuild one row as a dict keyed by CSV field name"""
+        return {field: self.value(field, index) for field in FIELDNAMES}
+
+    def codes_matching(self, column, predicate):
+        """Return the codes of a column whose normalized value satisfies predicate"""
+        return self.dictionaries[column].matching(predicate)
+
+    def codes_containing(self, column, query):
+        """Return the codes of a column whose normalized value contains query"""
+        return self.dictionaries[column].containing(query)
+
+    def condition_codes(self, query):
+        """
+        Return the medical_condition codes matching a searched condition
+
+        A value matches when the query contains, or is contained in, one of
+        its comma-separated tokens, or when the query is a substring of the
+        whole value. Placeholder values never match.
+
+        Args:
+            query: Searched condition, lower-cased and stripped
+        """
+        index = self.condition_tokens
+        codes = index.value_codes(index.tokens_overlapping(query))
+        value_tokens = index.value_tokens
+        codes.update(
+            code for code in self.codes_containing('medical_condition', query)
+            if value_tokens[code]
+        )
+        return codes
+
+    def match_count(self, column, codes):
+        """Return how many rows hold one of codes, from posting lengths if indexed"""
+        postings = self.postings.get(column)
+        if postings is None:
+            return len(self.rows_with(column, codes))
+        return sum(len(postings[code]) for code in codes if code < len(postings))
+
+    def rows_with(self, column, codes, candidates=None):
+        """
+        Select rows whose code in column is one of codes
+
+        Indexed columns are answered from their posting lists, so the cost
+        depends on the number of matches rather than on the number of rows.
+
+        Args:
+            column: Encoded column name
+            codes: Set of codes to accept
+            candidates: Optional list of row indices to restrict the scan to
+
+        Returns:
+            List of matching row indices in ascending order
+        """
+        if not codes:
+            return []
+        column_codes = self.codes[column]
+        if candidates is not None:
+            return [index for index in candidates if column_codes[index] in codes]
+
+        count = len(self)
+        postings = self.postings.get(column)
+        if postings is None:
+            return [index for index, code in enumerate(islice(column_codes, count)) if code in codes]
+
+        lists = [postings[code] for code in codes if code < len(postings)]
+        rows = list(lists[0]) if len(lists) == 1 else list(heapq.merge(*lists))
+        # Drop a row that is still being appended by another thread
+        del rows[bisect_left(rows, count):]
+        return rows
+
+    def drug_codes(self, drug_name):
+        """Return the codes of every drug_name value equal to drug_name once normalized"""
+        drug_name = drug_name.lower().strip()
+        return self.codes_matching('drug_name', lambda value: value == drug_name)
+
+    def drug_summary(self, drug_codes):
+        """
+        Summarize the reports of a drug from the per-drug counters alone
+
+        Args:
+            drug_codes: Codes of the drug_name values to combine, see drug_codes()
+
+        Returns:
+            Dict with the drug's total report count and, for each of
+            'conditions' and 'severities', a {value: {'count', 'percentage'}}
+            breakdown; values differing only in case or spacing are merged
+        """
+        total = self.drug_stats.total(drug_codes)
+        summary = {'total': total}
+        for key, column in (('conditions', 'medical_condition'), ('severities', 'severity')):
+            counts = Counter()
+            values = self.dictionaries[column].values
+            for code, count in self.drug_stats.breakdown(drug_codes, column).items():
+                counts[values[code].strip()] += count
+            summary[key] = {
+                value: {'count': count, 'percentage': percentage(count, total)}
+                for value, count in counts.most_common()
+            }
+        return summary
+
+    def rows_after(self, cutoff, include_unparsed=True):
+        """
+        Return the rows reported after cutoff epoch seconds, in row order
+
+        Args:
+            cutoff: Exclusive lower bound on the timestamp, see now_epoch()
+            include_unparsed: Also return rows whose timestamp could not be parsed
+        """
+        rows = self.time_index.rows_after(cutoff)
+        if include_unparsed and self.time_index.unparsed:
+            rows = sorted(rows + list(self.time_index.unparsed))
+        return rows
+
+    def count_after(self, cutoff, include_unparsed=True):
+        """Return how many rows rows_after() would return"""
+        count = self.time_index.count_after(cutoff)
+        if include_unparsed:
+            count += len(self.time_index.unparsed)
+        return count
+
+    def distinct(self, column):
+        """Return the distinct stripped, non-empty values of an encoded column"""
+        return {value.strip() for value in self.dictionaries[column].values if value.strip()}
+
+
+def paginate(rows, limit, cursor):
+    """
+    Select one page of matching rows
+
+    Pages are ordered by row index, which is the order reports were
+    appended, so a cursor stays valid while new reports arrive.
+
+    Args:
+        rows: Ascending sequence of matching row indices
+        limit: Maximum number of rows on the page
+        cursor: First row index the page may start at
+
+    Returns:
+        Tuple of (page, next_cursor); next_cursor is None on the last page
+    """
+    start = bisect_left(rows, cursor)
+    page = rows[start:start + limit]
+    end = start + limit
+    next_cursor = str(rows[end]) if end < len(rows) else None
+    return page, next_cursor
@@ -1,33 +1,65 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request
 import os
-import csv
 import subprocess
 from pathlib import Path
 import sys
 import socket
+import threading
 import time
 import datetime
 import json
-import random
 import requests
 
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from adr_store import (
+    SUGGEST_FIELDS, ADRStore, UNPARSED_TIMESTAMP, now_epoch, paginate
+)
+from common.http_cache import data_version, make_conditional_response
+from common.id_allocator import IDAllocator
+from common.pagination import parse_page_params
+from common.storage import open_storage
+from common.suggest import parse_suggest_params
+from common.streaming import iter_json_object
+from common.write_queue import GroupCommitWriter
+
 app = Flask(__name__)
 
 # Configuration
-ROOT_DIR = Path(__file__).parent.parent
 DATA_FILE = ROOT_DIR / 'adr_reports.csv'
+DOCTOR_ID_FILE = Path(__file__).parent / 'data' / 'doctor_id_counter.txt'
 AI_MODEL_PATH = ROOT_DIR / 'AI_MODEL' / 'biomedical_chatbot' / 'app.py'
 AI_MODEL_PORT = 8084
 
+storage = open_storage(DATA_FILE)
+# All report appends go through one writer thread that batches them
+report_writer = GroupCommitWriter(storage)
+# Doctor-submitted report IDs; numbering starts at the current epoch second
+# so they stay above the timestamp-based DOC_ IDs issued before
+doctor_ids = IDAllocator(DOCTOR_ID_FILE, 'DOC_', start=int(time.time()))
+
+# Maximum report age in days for each date_range search option
+DATE_RANGE_DAYS = {
+    '1month': 30,
+    '3months': 90,
+    '6months': 180,
+    '1year': 365
+}
+
 # Cache variables
 csv_cache = {
-    'data': [],
+    'store': ADRStore(),
     'last_modified': 0,
+    'version': data_version(None),
     'unique_drugs': [],
     'unique_conditions': [],
     'unique_reactions': []
 }
 
+# Serializes cache refreshes so concurrent requests never ingest the same rows twice
+cache_lock = threading.Lock()
+
 # Preload the data cache at startup
 def preload_data_cache():
     get_cached_data()
@@ -62,56 +94,64 @@ def get_cached_data():
     global csv_cache
     
     try:
-        file_modified_time = os.path.getmtime(DATA_FILE) if os.path.exists(DATA_FILE) else 0
-        
-        if not os.path.exists(DATA_FILE):
+        state = storage.state()
+        if state is None:
             csv_cache.update({
-                'data': [],
+                'store': ADRStore(),
                 'last_modified': 0,
+                'version': data_version(None),
                 'unique_drugs': [],
                 'unique_conditions': [],
                 'unique_reactions': []
             })
             return csv_cache
-            
-        if file_modified_time > csv_cache['last_modified']:
-            csv_data = []
-            unique_drugs = set()
-            unique_conditions = set()
-            unique_reactions = set()
-            
-            with open(DATA_FILE, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    csv_data.append(row)
-                    drug = row.get('drug_name', '').strip()
-                    if drug:
-                        unique_drugs.add(drug)
-                    condition = row.get('medical_condition', '').strip()
-                    if condition and condition.lower() != 'n/a':
-                        unique_conditions.add(condition)
-                    reaction = row.get('adverse_reaction', '').strip()
-                    if reaction and reaction.lower() != 'n/a' and reaction.lower() != 'not reported':
-                        unique_reactions.add(reaction)
-            
-            csv_cache.update({
-                'data': csv_data,
-                'last_modified': file_modified_time,
-                'unique_drugs': sorted(list(unique_drugs)),
-                'unique_conditions': sorted(list(unique_conditions)),
-                'unique_reactions': sorted(list(unique_reactions))
-            })
+        
+        version, last_modified = state
+        
+        if version != csv_cache['version']:
+            with cache_lock:
+                store = csv_cache['store']
+                # Only the newly appended rows are read; a full rebuild
+                # happens when the data shrank or was rewritten
+                if not store.is_continuation(storage):
+                    store = ADRStore()
+                store.ingest(storage)
+                csv_cache.update({
+                    'store': store,
+                    'last_modified': last_modified,
+                    'version': version
+                })
+                refresh_unique_values(store)
             
         return csv_cache
     except Exception as e:
         print(f"Error refreshing cache: {str(e)}")
-        return {'data': [], 'unique_drugs': [], 'unique_conditions': [], 'unique_reactions': []}
+        return {
+            'store': ADRStore(),
+            'last_modified': 0,
+            'version': data_version(None),
+            'unique_drugs': [],
+            'unique_conditions': [],
+            'unique_reactions': []
+        }
+
+def refresh_unique_values(store):
+    """Rebuild the dropdown option lists from the store's column dictionaries"""
+    csv_cache.update({
+        'unique_drugs': sorted(store.distinct('drug_name')),
+        'unique_conditions': sorted(
+            c for c in store.distinct('medical_condition') if c.lower() != 'n/a'
+        ),
+        'unique_reactions': sorted(
+            r for r in store.distinct('adverse_reaction') if r.lower() not in ('n/a', 'not reported')
+        )
+    })
 
 def add_new_drug_report(drug_name, medical_condition, adverse_reaction, severity, cause, gender, current_medication):
-    """Add a new drug report to the CSV file"""
+    """Add a new drug report to the report storage"""
     try:
         # Generate a unique patient ID
-        patient_id = f"DOC_{int(time.time())}"
+        patient_id = doctor_ids.next_id()
         timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M")
         
         new_row = {
@@ -127,25 +167,35 @@ def add_new_drug_report(drug_name, medical_condition, adverse_reaction, severity
             'current_medication': current_medication or 'Not specified'
         }
         
-        # Append to the CSV file
-        with open(DATA_FILE, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=new_row.keys())
-            if os.path.getsize(DATA_FILE) == 0:
-                writer.writeheader()
-            writer.writerow(new_row)
+        report_writer.submit(new_row)
         
-        # Update the cache
-        cached_data = get_cached_data()
-        cached_data['data'].append(new_row)
-        if drug_name not in cached_data['unique_drugs']:
-            cached_data['unique_drugs'].append(drug_name)
-            cached_data['unique_drugs'].sort()
+        # Refresh the cache so the new row is searchable immediately
+        get_cached_data()
         
         return True
     except Exception as e:
         print(f"Error adding drug report: {str(e)}")
         return False
 
+def conditional_json(payload, cached_data):
+    """JSON response tagged with the cache's data version, or 304 if the client is current"""
+    return make_conditional_response(
+        jsonify(payload), request, cached_data['version'], cached_data['last_modified'] or None
+    )
+
+def search_result(store, index):
+    """Build the /api/search result entry for one row"""
+    return {
+        'id': store.patient_ids[index],
+        'drug_name': store.value('drug_name', index),
+        'adverse_reaction': store.value('adverse_reaction', index),
+        'medical_condition': store.value('medical_condition', index),
+        'severity': store.value('severity', index),
+        'date': store.value('timestamp', index),
+        'gender': store.value('gender', index),
+        'current_medication': store.value('current_medication', index)
+    }
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -158,59 +208,69 @@ def search():
         adverse_reaction = data.get('adverse_reaction', '').lower().strip()
         medical_condition = data.get('medical_condition', '').lower().strip()
         date_range = data.get('date_range', 'all')
+        
+        try:
+            limit, cursor = parse_page_params(data.get('limit'), data.get('cursor'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e),
+                'results': []
+            }), 400
     
-        cached_data = get_cached_data()
-        results = []
+        store = get_cached_data()['store']
         
-        for row in cached_data['data']:
-            row_drug = row.get('drug_name', '').lower().strip()
-            row_reaction = row.get('adverse_reaction', '').lower().strip()
-            row_condition = row.get('medical_condition', '').lower().strip()
-            row_date = row.get('timestamp', '')
-            
-            # Filter by criteria
-            if drug_name and drug_name not in row_drug:
-                continue
-            if adverse_reaction and adverse_reaction not in row_reaction:
-                continue
-            if medical_condition and medical_condition not in row_condition:
-                continue
-            
-            # Filter by date range
-            if date_range != 'all':
-                try:
-                    report_date = datetime.datetime.strptime(row_date, "%d-%m-%Y %H:%M")
-                    current_date = datetime.datetime.now()
-                    
-                    if date_range == '1month' and (current_date - report_date).days > 30:
-                        continue
-                    elif date_range == '3months' and (current_date - report_date).days > 90:
-                        continue
-                    elif date_range == '6months' and (current_date - report_date).days > 180:
-                        continue
-                    elif date_range == '1year' and (current_date - report_date).days > 365:
-                        continue
-                except:
-                    # If date parsing fails, include the record anyway
-                    pass
-            
-            # Add matching result
-            results.append({
-                'id': row.get('patient_id', f"P{random.randint(10000, 99999)}"),
-                'drug_name': row.get('drug_name', ''),
-                'adverse_reaction': row.get('adverse_reaction', ''),
-                'medical_condition': row.get('medical_condition', ''),
-                'severity': row.get('severity', 'Unknown'),
-                'date': row.get('timestamp', ''),
-                'gender': row.get('gender', ''),
-                'current_medication': row.get('current_medication', '')
+        # Filter by criteria: the trigram index resolves each substring to
+        # value codes, and the most selective criterion supplies the
+        # candidate rows from its posting lists
+        criteria = []
+        for column, query in (('drug_name', drug_name),
+                              ('adverse_reaction', adverse_reaction),
+                              ('medical_condition', medical_condition)):
+            if query:
+                codes = store.codes_containing(column, query)
+                criteria.append((store.match_count(column, codes), column, codes))
+        
+        # Filter by date range: a report is kept while it is less than
+        # (days + 1) whole days old, and records whose date could not be
+        # parsed are included anyway
+        if date_range in DATE_RANGE_DAYS:
+            cutoff = now_epoch() - (DATE_RANGE_DAYS[date_range] + 1) * 86400
+            criteria.append((store.count_after(cutoff), 'timestamp', cutoff))
+        
+        matches = None
+        for _, column, condition in sorted(criteria, key=lambda criterion: criterion[0]):
+            if column != 'timestamp':
+                matches = store.rows_with(column, condition, matches)
+            elif matches is None:
+                matches = store.rows_after(condition)
+            else:
+                timestamps = store.timestamps
+                matches = [
+                    index for index in matches
+                    if timestamps[index] > condition or timestamps[index] == UNPARSED_TIMESTAMP
+                ]
+            if not matches:
+                break
+        if matches is None:
+            matches = range(len(store))
+        
+        if limit is not None:
+            page, next_cursor = paginate(matches, limit, cursor)
+            return jsonify({
+                'success': True,
+                'count': len(matches),
+                'results': [search_result(store, index) for index in page],
+                'next_cursor': next_cursor
             })
         
-        return jsonify({
-            'success': True,
-            'count': len(results),
-            'results': results
-        })
+        # Without a limit, stream every match so the serialized body is
+        # never held in memory at once
+        results = (search_result(store, index) for index in matches)
+        return Response(
+            iter_json_object({'success': True, 'count': len(matches)}, 'results', results),
+            mimetype='application/json'
+        )
     except Exception as e:
         return jsonify({
             'success': False,
@@ -229,26 +289,62 @@ def analyze():
 @app.route('/api/drugs', methods=['GET'])
 def get_drugs():
     cached_data = get_cached_data()
-    return jsonify({
+    return conditional_json({
         'success': True,
         'drugs': cached_data['unique_drugs']
-    })
+    }, cached_data)
 
 @app.route('/api/reactions', methods=['GET'])
 def get_reactions():
     cached_data = get_cached_data()
-    return jsonify({
+    return conditional_json({
         'success': True,
         'reactions': cached_data['unique_reactions']
-    })
+    }, cached_data)
 
 @app.route('/api/conditions', methods=['GET'])
 def get_conditions():
     cached_data = get_cached_data()
-    return jsonify({
+    return conditional_json({
         'success': True,
         'conditions': cached_data['unique_conditions']
-    })
+    }, cached_data)
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest():
+    """Typeahead: the most reported drugs, conditions or reactions with a word starting with q"""
+    try:
+        field, prefix, k = parse_suggest_params(
+            request.args.get('field'), request.args.get('q'), request.args.get('k'), SUGGEST_FIELDS
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e),
+            'suggestions': []
+        }), 400
+    cached_data = get_cached_data()
+    return conditional_json({
+        'success': True,
+        'suggestions': cached_data['store'].suggest(field, prefix, k)
+    }, cached_data)
+
+@app.route('/api/stats/drug/<path:drug_name>', methods=['GET'])
+def get_drug_stats(drug_name):
+    """Report counts of one drug by condition and severity, from the ingest-time counters"""
+    cached_data = get_cached_data()
+    store = cached_data['store']
+    summary = store.drug_summary(store.drug_codes(drug_name))
+    if not summary['total']:
+        return jsonify({
+            'success': False,
+            'message': f"No reports found for drug '{drug_name.strip()}'"
+        }), 404
+    return conditional_json({
+        'success': True,
+        'drug_name': drug_name.strip(),
+        **summary
+    }, cached_data)
 
 @app.route('/api/drugs/add', methods=['POST'])
 def add_drug():
@@ -1,134 +1,203 @@
 import http.server
-import socketserver
 import os
 import webbrowser
 import json
-import csv
-import time
+import logging
+import sys
+import threading
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, unquote
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from adr_store import SUGGEST_FIELDS, ADRStore, paginate, percentage
+from common.compression import CompressionMixin
+from common.http_cache import (
+    data_version, quote_etag, send_not_modified_if_fresh, validator_headers
+)
+from common.http_server import KeepAliveMixin, PooledHTTPServer
+from common.log import RowTracer, get_logger, setup_logging
+from common.pagination import parse_page_params
+from common.storage import open_storage
+from common.suggest import parse_suggest_params
+from common.streaming import iter_json_object, send_streamed
 
 # Configuration
 PORT = 8085
 DIRECTORY = "templates"
 DATA_FILE = "../adr_reports.csv"  # Path to main directory
+DRUG_STATS_PREFIX = '/api/stats/drug/'
+
+setup_logging('data_server')
+log = get_logger('data_server')
+# Sampled per-row DEBUG tracing of search matches (CLINIQA_TRACE_SAMPLE)
+row_trace = RowTracer(log)
 
 # Validate and resolve the DATA_FILE path
 try:
     data_file_path = os.path.abspath(DATA_FILE)
-    print(f"Absolute data file path: {data_file_path}")
+    log.info("Absolute data file path: %s", data_file_path)
     data_dir = os.path.dirname(data_file_path)
     if not os.path.exists(data_dir):
-        print(f"Warning: Data directory does not exist: {data_dir}")
-        print("Will create directory when needed")
+        log.warning("Data directory does not exist: %s; will create it when needed", data_dir)
 except Exception as e:
-    print(f"Error resolving data file path: {e}")
+    log.error("Error resolving data file path: %s", e)
+
+storage = open_storage(DATA_FILE)
 
 # Cache variables
 csv_cache = {
-    'data': [],
+    'store': ADRStore(),
     'last_modified': 0,
+    'version': data_version(None),
     'unique_drugs': [],
     'unique_conditions': []
 }
 
+# Requests are served concurrently; refreshes must not ingest the same rows twice
+cache_lock = threading.Lock()
+
 # Make sure the directory exists
 dir_path = Path(DIRECTORY)
 if not dir_path.exists():
-    print(f"Creating directory {DIRECTORY}...")
+    log.info("Creating directory %s...", DIRECTORY)
     os.makedirs(dir_path, exist_ok=True)
 
 # Preload the data cache at startup
 def preload_data_cache():
     try:
-        print("Preloading data cache...")
+        log.info("Preloading data cache...")
         get_cached_data()
-        print("Data cache preloaded successfully")
-    except Exception as e:
-        print(f"Error preloading data cache: {str(e)}")
+        log.info("Data cache preloaded successfully")
+    except Exception:
+        log.exception("Error preloading data cache")
 
 # Function to refresh cache if needed
 def get_cached_data():
+    # One refresh at a time; concurrent callers wait and then share its result
+    with cache_lock:
+        return refresh_cached_data()
+
+def refresh_cached_data():
     global csv_cache
     
     try:
-        # If file doesn't exist, initialize empty cache
-        if not os.path.exists(DATA_FILE):
-            print("Data file does not exist, returning empty data set")
-            return {'data': [], 'unique_drugs': [], 'unique_conditions': []}
-            
-        # Check if file has been modified since last cache
+        # Check if the data has changed since last cache
         try:
-            file_modified_time = os.path.getmtime(DATA_FILE)
+            state = storage.state()
         except Exception as e:
-            print(f"Error getting file modification time: {str(e)}")
+            log.error("Error getting data file state: %s", e)
             return csv_cache  # Return existing cache on error
         
-        # If file modified time is newer than our cached version, refresh the cache
-        if file_modified_time > csv_cache['last_modified']:
-            print("Refreshing CSV cache...")
-            
-            csv_data = []
-            unique_drugs = set()
-            unique_conditions = set()
+        # If data doesn't exist, initialize empty cache
+        if state is None:
+            log.warning("Data file does not exist, returning empty data set")
+            return {'store': ADRStore(), 'unique_drugs': [], 'unique_conditions': []}
+        
+        version, last_modified = state
+        
+        # If the data version changed, refresh the cache
+        if version != csv_cache['version']:
+            log.debug("Refreshing CSV cache...")
             
             try:
-                # Print the full resolved path for debugging
-                full_path = os.path.abspath(DATA_FILE)
-                print(f"Loading data from: {full_path}")
+                store = csv_cache['store']
                 
-                with open(DATA_FILE, 'r', newline='', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        # Skip empty rows
-                        if not any(row.values()):
-                            continue
-                            
-                        csv_data.append(row)
-                        
-                        # Build unique sets for dropdown options
-                        drug = row.get('drug_name', '').strip()
-                        if drug:
-                            unique_drugs.add(drug)
-                            
-                        condition = row.get('medical_condition', '').strip()
-                        if condition and condition.lower() != 'n/a' and condition.lower() != 'none':
-                            unique_conditions.add(condition)
+                # Only read rows appended since the last refresh, unless the
+                # data shrank or was rewritten
+                if store.is_continuation(storage):
+                    new_rows = store.ingest(storage)
+                    log.debug("Ingested %d appended records", new_rows)
+                else:
+                    log.info("Data file was rewritten, reloading from: %s",
+                             os.path.abspath(storage.path))
+                    store = ADRStore.from_storage(storage)
+                    
+                    # Log the first record for debugging
+                    if len(store) and log.isEnabledFor(logging.DEBUG):
+                        log.debug("Sample data (first record): %s", store.row(0))
+                
+                # Build unique sets for dropdown options
+                unique_drugs = store.distinct('drug_name')
+                unique_conditions = {
+                    c for c in store.distinct('medical_condition')
+                    if c.lower() != 'n/a' and c.lower() != 'none'
+                }
                 
                 # Update cache
                 csv_cache = {
-                    'data': csv_data,
-                    'last_modified': file_modified_time,
+                    'store': store,
+                    'last_modified': last_modified,
+                    'version': version,
                     'unique_drugs': sorted(list(unique_drugs)),
                     'unique_conditions': sorted(list(unique_conditions))
                 }
-                print(f"Cache refreshed. Found {len(csv_data)} records, {len(unique_drugs)} unique drugs, {len(unique_conditions)} unique conditions")
+                log.info("Cache refreshed. Found %d records, %d unique drugs, %d unique conditions",
+                         len(store), len(unique_drugs), len(unique_conditions))
                 
-                # Print the first few records for debugging
-                if csv_data:
-                    print("Sample data (first record):")
-                    for key, value in csv_data[0].items():
-                        print(f"  {key}: {value}")
-                else:
-                    print("WARNING: No data was loaded from the CSV file")
-            except Exception as e:
-                print(f"Error reading CSV file: {str(e)}")
+                if not len(store):
+                    log.warning("No data was loaded from the CSV file")
+            except Exception:
+                log.exception("Error reading CSV file")
                 # Continue with old cache if available, or return empty if not
-                if not csv_cache['data']:
-                    return {'data': [], 'unique_drugs': [], 'unique_conditions': []}
-        else:
-            print("Cache is current, no refresh needed")
-            
+                if not len(csv_cache['store']):
+                    return {'store': ADRStore(), 'unique_drugs': [], 'unique_conditions': []}
         return csv_cache
-    except Exception as e:
-        print(f"Unexpected error refreshing cache: {str(e)}")
-        return {'data': [], 'unique_drugs': [], 'unique_conditions': []}
+    except Exception:
+        log.exception("Unexpected error refreshing cache")
+        return {'store': ADRStore(), 'unique_drugs': [], 'unique_conditions': []}
+
+def search_result(store, index):
+    """Build the /api/search result entry for one row"""
+    return {
+        'timestamp': store.value('timestamp', index),
+        'drug_name': store.value('drug_name', index),
+        'medical_condition': store.value('medical_condition', index),
+        'adverse_reaction': store.value('adverse_reaction', index),
+        'severity': store.value('severity', index),
+        'confidence': store.value('confidence', index),
+        'cause_of_administration': store.value('cause_of_administration', index),
+        'gender': store.value('gender', index),
+        'patient_id': store.patient_ids[index],
+        'current_medication': store.value('current_medication', index)
+    }
 
 # Enhanced HTTP server that can handle API requests
-class DoctorPortalHandler(http.server.SimpleHTTPRequestHandler):
+class DoctorPortalHandler(KeepAliveMixin, CompressionMixin, http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
     
+    def send_json(self, payload, status=200):
+        """Send a complete JSON response, compressed if large enough"""
+        body = json.dumps(payload).encode()
+        self.send_body(body, 'application/json', self.response_encoding(len(body)), status=status)
+    
+    def send_json_versioned(self, payload, cached_data):
+        """Send a JSON response tagged with the cache's data version, or 304 if unchanged"""
+        version = cached_data.get('version', data_version(None))
+        body = json.dumps(payload).encode()
+        encoding = self.response_encoding(len(body))
+        etag = quote_etag(version, encoding)
+        last_modified = cached_data.get('last_modified') or None
+        if send_not_modified_if_fresh(self, etag, last_modified):
+            return
+        
+        self.send_body(
+            body,
+            'application/json',
+            encoding,
+            headers=validator_headers(etag, last_modified),
+            cache_key=(self.path, version)
+        )
+    
+    def log_message(self, format, *args):
+        # Per-request access lines go through the queued logger at DEBUG
+        # instead of being written to stderr synchronously
+        log.debug("%s - " + format, self.address_string(), *args)
+    
+    def log_error(self, format, *args):
+        log.warning("%s - " + format, self.address_string(), *args)
+    
     def do_GET(self):
         # Parse URL query parameters
         url_parts = urlparse(self.path)
@@ -139,163 +208,176 @@ class DoctorPortalHandler(http.server.SimpleHTTPRequestHandler):
             drug_name = query_params.get('drug', [''])[0].lower().strip()
             medical_condition = query_params.get('condition', [''])[0].lower().strip()
             
-            print(f"Search request received - Drug: '{drug_name}', Condition: '{medical_condition}'")
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
+            log.debug("Search request received - Drug: '%s', Condition: '%s'", drug_name, medical_condition)
             
             # Validate input
             if not drug_name and not medical_condition:
-                print("Search rejected: Missing required parameters")
-                self.wfile.write(json.dumps({
+                log.debug("Search rejected: Missing required parameters")
+                self.send_json({
                     'success': False,
                     'message': 'Either drug name or symptoms are required for search',
                     'results': []
-                }).encode())
+                })
+                return
+            
+            try:
+                limit, cursor = parse_page_params(
+                    query_params.get('limit', [''])[0],
+                    query_params.get('cursor', [''])[0]
+                )
+            except ValueError as e:
+                log.debug("Search rejected: %s", e)
+                self.send_json({
+                    'success': False,
+                    'message': str(e),
+                    'results': []
+                })
                 return
             
             # Get cached data
             cached_data = get_cached_data()
             
-            if not cached_data['data']:
-                print("Search returned no results: No data available in cache")
-                self.wfile.write(json.dumps({
+            store = cached_data['store']
+            
+            if not len(store):
+                log.debug("Search returned no results: No data available in cache")
+                self.send_json({
                     'success': True,
                     'message': 'No data available for search',
                     'count': 0,
                     'results': []
-                }).encode())
+                })
                 return
             
-            # Search for matching records
-            results = []
-            total_drug_count = 0
-            
-            print("Debug: Starting search with parameters:")
-            print(f"  - Drug: '{drug_name}'")
-            print(f"  - Condition: '{medical_condition}'")
-            print(f"  - Total records to search: {len(cached_data['data'])}")
+            # Resolve both criteria against the distinct column values first
+            drug_codes = store.drug_codes(drug_name) if drug_name else None
+            condition_codes = None
+            if medical_condition:
+                # Conditions were split into tokens at ingest, so this is a
+                # lookup in the token postings rather than a scan
+                condition_codes = store.condition_codes(medical_condition)
             
-            for idx, row in enumerate(cached_data['data']):
-                row_drug = row.get('drug_name', '').lower().strip()
-                row_symptoms = row.get('medical_condition', '').lower().strip()
-                
-                print(f"\nDebug - Record #{idx+1}:")
-                print(f"  Drug: '{row_drug}'")
-                print(f"  Symptoms: '{row_symptoms}'")
-                
-                # Count total occurrences of the drug if drug name was provided
-                drug_match = True
-                if drug_name:
-                    if row_drug == drug_name:
-                        total_drug_count += 1
-                    else:
-                        drug_match = False
-                
-                # Skip this record if drug doesn't match
-                if not drug_match:
-                    continue
-                    
-                # Check for partial symptoms match in comma-separated list
-                symptoms_match = True
-                if medical_condition:
-                    # Reset to false when a condition is provided and needs to be matched
-                    symptoms_match = False
-                    
-                    # Convert to lowercase for comparison
-                    row_symptoms_lower = row_symptoms.lower()
-                    medical_condition_lower = medical_condition.lower()
-                    
-                    print(f"Comparing '{medical_condition_lower}' with '{row_symptoms_lower}'")
-                    
-                    # Skip empty or placeholder conditions
-                    if row_symptoms_lower in ['none', 'n/a', 'not specified', 'not applicable', '']:
-                        print(f"Skipping placeholder value: '{row_symptoms}'")
-                        continue
-                    
-                    # Simplest matching logic: direct substring match
-                    if medical_condition_lower in row_symptoms_lower:
-                        symptoms_match = True
-                        print(f"MATCHED (condition in symptoms): '{medical_condition_lower}' is in '{row_symptoms_lower}'")
-                    elif row_symptoms_lower in medical_condition_lower:
-                        symptoms_match = True
-                        print(f"MATCHED (symptoms in condition): '{row_symptoms_lower}' is in '{medical_condition_lower}'")
-                    
-                    # If no direct match, try matching individual words if there are multiple conditions
-                    if not symptoms_match and ',' in row_symptoms:
-                        conditions = [c.strip().lower() for c in row_symptoms.split(',')]
-                        for condition in conditions:
-                            if medical_condition_lower in condition or condition in medical_condition_lower:
-                                symptoms_match = True
-                                print(f"MATCHED (in list): '{medical_condition_lower}' matches with '{condition}'")
-                                break
-                
-                # Add to results if all criteria match
-                if drug_match and symptoms_match:
-                    results.append({
-                        'timestamp': row.get('timestamp', ''),
-                        'drug_name': row.get('drug_name', ''),
-                        'medical_condition': row.get('medical_condition', ''),
-                        'adverse_reaction': row.get('adverse_reaction', ''),
-                        'severity': row.get('severity', ''),
-                        'confidence': row.get('confidence', '0.0'),
-                        'cause_of_administration': row.get('cause_of_administration', 'Not specified'),
-                        'gender': row.get('gender', 'Not specified'),
-                        'patient_id': row.get('patient_id', 'Not assigned'),
-                        'current_medication': row.get('current_medication', 'Not specified')
-                    })
+            # Counts and the match percentage come from the per-drug counters
+            # kept at ingest, without touching individual rows
+            total_drug_count = 0
+            if drug_codes is not None:
+                total_drug_count = store.drug_stats.total(drug_codes)
+                match_count = total_drug_count
+                if condition_codes is not None:
+                    match_count = store.drug_stats.pair_count(
+                        drug_codes, 'medical_condition', condition_codes
+                    )
+            else:
+                match_count = store.match_count('medical_condition', condition_codes)
+            match_percentage = percentage(match_count, total_drug_count)
             
-            # Calculate percentage of matching results
-            match_percentage = 0
-            if total_drug_count > 0:
-                match_percentage = round((len(results) * 100) / total_drug_count, 2)
+            # Rows are only selected for the results, by comparing integer codes
+            matches = []
+            if match_count:
+                if drug_codes is not None:
+                    matches = store.rows_with('drug_name', drug_codes)
+                    if condition_codes is not None:
+                        matches = store.rows_with('medical_condition', condition_codes, matches)
+                else:
+                    matches = store.rows_with('medical_condition', condition_codes)
             
-            print(f"Search completed: Found {len(results)} matches out of {total_drug_count} drug instances ({match_percentage}%)")
+            log.debug("Search completed: Found %d matches out of %d drug instances (%s%%)",
+                      len(matches), total_drug_count, match_percentage)
+            if row_trace.enabled():
+                for index in row_trace.sample(matches):
+                    log.debug("Matched row %d: %s", index, store.row(index))
             
             response = {
                 'success': True,
-                'count': len(results),
+                'count': len(matches),
                 'total_drug_count': total_drug_count,
-                'match_percentage': match_percentage,
-                'results': results
+                'match_percentage': match_percentage
             }
             
-            if len(results) == 0:
+            if len(matches) == 0:
                 response['message'] = 'No matching records found for this drug and symptoms combination.'
             
-            self.wfile.write(json.dumps(response).encode())
+            if limit is not None:
+                page, next_cursor = paginate(matches, limit, cursor)
+                response['results'] = [search_result(store, index) for index in page]
+                response['next_cursor'] = next_cursor
+                self.send_json(response)
+                return
+            
+            # Without a limit, stream every match in chunks instead of
+            # serializing the whole result list at once
+            results = (search_result(store, index) for index in matches)
+            send_streamed(
+                self,
+                iter_json_object(response, 'results', results),
+                encoding=self.accepted_encoding() if len(matches) else None
+            )
+            return
+        
+        # Typeahead: the most reported values with a word starting with q
+        elif url_parts.path == '/api/suggest':
+            query_params = parse_qs(url_parts.query)
+            try:
+                field, prefix, k = parse_suggest_params(
+                    query_params.get('field', [''])[0],
+                    query_params.get('q', [''])[0],
+                    query_params.get('k', [''])[0],
+                    SUGGEST_FIELDS
+                )
+            except ValueError as e:
+                self.send_json({'success': False, 'message': str(e), 'suggestions': []}, status=400)
+                return
+            
+            cached_data = get_cached_data()
+            self.send_json_versioned({
+                'success': True,
+                'suggestions': cached_data['store'].suggest(field, prefix, k)
+            }, cached_data)
+            return
+        
+        # API endpoint with the report counts of one drug, by condition and severity
+        elif url_parts.path.startswith(DRUG_STATS_PREFIX):
+            drug_name = unquote(url_parts.path[len(DRUG_STATS_PREFIX):]).strip()
+            cached_data = get_cached_data()
+            store = cached_data['store']
+            summary = store.drug_summary(store.drug_codes(drug_name)) if drug_name else None
+            if not summary or not summary['total']:
+                self.send_json({
+                    'success': False,
+                    'message': f"No reports found for drug '{drug_name}'"
+                }, status=404)
+                return
+            
+            self.send_json_versioned({
+                'success': True,
+                'drug_name': drug_name,
+                **summary
+            }, cached_data)
             return
         
         # API endpoint to get all unique drug names
         elif self.path == '/api/drugs':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             cached_data = get_cached_data()
             
-            self.wfile.write(json.dumps({
+            self.send_json_versioned({
                 'success': True,
                 'drugs': cached_data['unique_drugs']
-            }).encode())
+            }, cached_data)
             return
         
         # API endpoint to get all unique medical conditions
         elif self.path == '/api/conditions':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             cached_data = get_cached_data()
             
-            self.wfile.write(json.dumps({
+            self.send_json_versioned({
                 'success': True,
                 'conditions': cached_data['unique_conditions']
-            }).encode())
+            }, cached_data)
             return
         
-        # Default to serving static files
+        # Default to serving static files, compressed where worthwhile
+        if self.send_static_compressed():
+            return
         return super().do_GET()
     
     def end_headers(self):
@@ -305,7 +387,7 @@ class DoctorPortalHandler(http.server.SimpleHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         except Exception as e:
-            print(f"Error adding CORS headers: {str(e)}")
+            log.error("Error adding CORS headers: %s", e)
         # Call parent implementation to finish sending headers
         super().end_headers()
     
@@ -316,17 +398,18 @@ class DoctorPortalHandler(http.server.SimpleHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            self.send_header('Content-Length', '0')
             self.end_headers()
-            print("OPTIONS request handled (CORS preflight)")
-        except Exception as e:
-            print(f"Error handling OPTIONS request: {str(e)}")
+        except Exception:
+            log.exception("Error handling OPTIONS request")
             self.send_response(500)
+            self.send_header('Content-Length', '0')
             self.end_headers()
 
-print(f"Starting Doctor Portal server at http://localhost:{PORT}")
-print(f"Serving files from {os.path.abspath(DIRECTORY)}")
-print(f"Reading data from {os.path.abspath(DATA_FILE)}")
-print("Press Ctrl+C to stop the server")
+log.info("Starting Doctor Portal server at http://localhost:%d", PORT)
+log.info("Serving files from %s", os.path.abspath(DIRECTORY))
+log.info("Reading data from %s", os.path.abspath(storage.path))
+log.info("Press Ctrl+C to stop the server")
 
 # Open browser
 webbrowser.open(f"http://localhost:{PORT}")
@@ -335,8 +418,8 @@ webbrowser.open(f"http://localhost:{PORT}")
 preload_data_cache()
 
 # Start server
-with socketserver.TCPServer(("", PORT), DoctorPortalHandler) as httpd:
+with PooledHTTPServer(("", PORT), DoctorPortalHandler) as httpd:
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\nServer stopped.") 
\ No newline at end of file
+        log.info("Server stopped.") 
\ No newline at end of file
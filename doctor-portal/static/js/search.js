@@ -19,10 +19,9 @@ document.addEventListener('DOMContentLoaded', () => {
     const adverseReactionDropdown = document.getElementById('adverse-reaction-dropdown');
     const medicalConditionDropdown = document.getElementById('medical-condition-dropdown');
     
-    // Lists of items for each dropdown
-    let drugsList = [];
-    let reactionsList = [];
-    let conditionsList = [];
+    // Suggestions shown per dropdown, fetched from the server as the user types
+    const SUGGESTION_LIMIT = 10;
+    const SUGGEST_DELAY_MS = 80;
     
     // Initialize
     setupSearch();
@@ -30,14 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
     /**
      * Set up search functionality
      */
-    async function setupSearch() {
-        // Load dropdown data
-        await Promise.all([
-            loadDrugs(),
-            loadReactions(),
-            loadConditions()
-        ]);
-        
+    function setupSearch() {
         // Set up event listeners
         if (searchForm) {
             searchForm.addEventListener('submit', handleSearchSubmit);
@@ -48,9 +40,9 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         // Set up dropdown functionality
-        setupDropdown(drugNameInput, drugNameDropdown, drugsList);
-        setupDropdown(adverseReactionInput, adverseReactionDropdown, reactionsList);
-        setupDropdown(medicalConditionInput, medicalConditionDropdown, conditionsList);
+        setupDropdown(drugNameInput, drugNameDropdown, 'drug');
+        setupDropdown(adverseReactionInput, adverseReactionDropdown, 'reaction');
+        setupDropdown(medicalConditionInput, medicalConditionDropdown, 'condition');
         
         // Close dropdowns when clicking outside
         document.addEventListener('click', (e) => {
@@ -78,71 +70,52 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
     /**
-     * Load drugs list from API
-     */
-    async function loadDrugs() {
-        try {
-            const response = await fetch('/api/drugs');
-            const data = await response.json();
-            
-            if (data.success && Array.isArray(data.drugs)) {
-                drugsList = data.drugs;
-                console.log(`Loaded ${drugsList.length} drugs`);
-            }
-        } catch (error) {
-            console.error('Error loading drugs:', error);
-        }
-    }
-    
-    /**
-     * Load adverse reactions list from API
+     * Fetch the most reported values of a field that have a word starting with query
      */
-    async function loadReactions() {
-        try {
-            const response = await fetch('/api/reactions');
-            const data = await response.json();
-            
-            if (data.success && Array.isArray(data.reactions)) {
-                reactionsList = data.reactions;
-                console.log(`Loaded ${reactionsList.length} reactions`);
-            }
-        } catch (error) {
-            console.error('Error loading reactions:', error);
-        }
-    }
-    
-    /**
-     * Load medical conditions list from API
-     */
-    async function loadConditions() {
-        try {
-            const response = await fetch('/api/conditions');
-            const data = await response.json();
-            
-            if (data.success && Array.isArray(data.conditions)) {
-                conditionsList = data.conditions;
-                console.log(`Loaded ${conditionsList.length} conditions`);
-            }
-        } catch (error) {
-            console.error('Error loading conditions:', error);
+    async function fetchSuggestions(field, query, signal) {
+        const params = new URLSearchParams({ field, q: query, k: SUGGESTION_LIMIT });
+        const response = await fetch(`/api/suggest?${params}`, { signal });
+        const data = await response.json();
+        
+        if (data.success && Array.isArray(data.suggestions)) {
+            return data.suggestions.map(suggestion => suggestion.value);
         }
+        return [];
     }
     
     /**
      * Set up dropdown functionality for an input field
      */
-    function setupDropdown(inputElement, dropdownElement, itemsList) {
+    function setupDropdown(inputElement, dropdownElement, field) {
         if (!inputElement || !dropdownElement) return;
         
+        let pendingTimer = null;
+        let pendingRequest = null;
+        
+        // Ask the server for suggestions shortly after typing pauses,
+        // cancelling any request still in flight for older input
+        function updateSuggestions(delay = SUGGEST_DELAY_MS) {
+            clearTimeout(pendingTimer);
+            pendingTimer = setTimeout(async () => {
+                if (pendingRequest) pendingRequest.abort();
+                pendingRequest = new AbortController();
+                const query = inputElement.value;
+                try {
+                    const items = await fetchSuggestions(field, query, pendingRequest.signal);
+                    populateDropdown(dropdownElement, items, query);
+                } catch (error) {
+                    if (error.name !== 'AbortError') {
+                        console.error(`Error loading ${field} suggestions:`, error);
+                    }
+                }
+            }, delay);
+        }
+        
         // Show dropdown on input focus
-        inputElement.addEventListener('focus', () => {
-            populateDropdown(dropdownElement, itemsList, inputElement.value);
-        });
+        inputElement.addEventListener('focus', () => updateSuggestions(0));
         
         // Update dropdown on input
-        inputElement.addEventListener('input', () => {
-            populateDropdown(dropdownElement, itemsList, inputElement.value);
-        });
+        inputElement.addEventListener('input', () => updateSuggestions());
         
         // Handle keyboard navigation
         inputElement.addEventListener('keydown', (e) => {
@@ -152,8 +125,7 @@ document.addEventListener('DOMContentLoaded', () => {
             
             // Show dropdown on arrow down if it's closed
             if (e.key === 'ArrowDown' && dropdownElement.style.display !== 'block') {
-                populateDropdown(dropdownElement, itemsList, inputElement.value);
-                dropdownElement.style.display = 'block';
+                updateSuggestions(0);
                 e.preventDefault();
             }
             
@@ -167,7 +139,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // Show dropdown when clicking on input
         inputElement.addEventListener('click', (e) => {
             e.stopPropagation();
-            populateDropdown(dropdownElement, itemsList, inputElement.value);
+            updateSuggestions(0);
         });
         
         // Handle clicks on dropdown items
@@ -192,34 +164,19 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
     /**
-     * Populate dropdown with filtered items
+     * Populate dropdown with the server's suggestions, most reported first
      */
-    function populateDropdown(dropdownElement, itemsList, filter = '') {
+    function populateDropdown(dropdownElement, items, filter = '') {
         dropdownElement.innerHTML = '';
         
-        if (!itemsList || itemsList.length === 0) {
-            const noItems = document.createElement('div');
-            noItems.className = 'dropdown-item no-results';
-            noItems.textContent = 'No options available';
-            dropdownElement.appendChild(noItems);
-            return;
-        }
-        
-        // Filter items based on input
-        const filteredItems = filter ? 
-            itemsList.filter(item => item.toLowerCase().includes(filter.toLowerCase())) : 
-            itemsList;
-        
         // Sort exact matches to the top
-        filteredItems.sort((a, b) => {
+        const displayItems = items.slice();
+        displayItems.sort((a, b) => {
             if (a.toLowerCase() === filter.toLowerCase()) return -1;
             if (b.toLowerCase() === filter.toLowerCase()) return 1;
             return 0;
         });
         
-        // Limit to 10 items
-        const displayItems = filteredItems.slice(0, 10);
-        
         // Add filtered items to dropdown
         if (displayItems.length > 0) {
             displayItems.forEach((item, index) => {
@@ -1,14 +1,25 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 import os
-import csv
 import datetime
+import sys
 from pathlib import Path
 
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from common.http_cache import data_version, make_conditional_response
+from common.id_allocator import IDAllocator
+from common.storage import open_storage
+from common.write_queue import GroupCommitWriter
+from report_cache import ReportCache, newest_reports_page
+
 app = Flask(__name__)
 
 # Configuration
-ROOT_DIR = Path(__file__).parent.parent
 CSV_FILE = ROOT_DIR / 'adr_reports.csv'
+storage = open_storage(CSV_FILE)
+# All report appends go through one writer thread that batches them
+report_writer = GroupCommitWriter(storage)
 PATIENT_ID_FILE = Path(__file__).parent / 'data' / 'patient_id_counter.txt'
 
 # Initialize patient ID counter
@@ -17,6 +28,12 @@ if not os.path.exists(PATIENT_ID_FILE):
     with open(PATIENT_ID_FILE, 'w') as f:
         f.write('2000')
 
+# Patient IDs come from blocks reserved in the counter file, shared with server.py
+patient_ids = IDAllocator(PATIENT_ID_FILE, 'PTD_')
+
+# Newest-first view of the reports, extended as rows are appended
+report_cache = ReportCache(storage)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -24,24 +41,23 @@ def index():
 @app.route('/api/reports', methods=['GET', 'POST'])
 def reports():
     if request.method == 'GET':
-        reports = []
-        if os.path.exists(CSV_FILE):
-            with open(CSV_FILE, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    reports.append(row)
-        reports.reverse()
-        return jsonify({'reports': reports})
+        # Paginated requests read just the newest rows from storage
+        if 'limit' in request.args:
+            version, last_modified = storage.state() or (data_version(None), None)
+            try:
+                payload = newest_reports_page(storage, request.args['limit'], request.args.get('cursor'))
+            except ValueError as e:
+                return jsonify({'reports': [], 'error': str(e)}), 400
+            return make_conditional_response(jsonify(payload), request, version, last_modified)
+
+        report_cache.refresh()
+        response = Response(report_cache.iter_json(), mimetype='application/json')
+        return make_conditional_response(response, request, report_cache.version, report_cache.last_modified)
 
     if request.method == 'POST':
         data = request.get_json()
         try:
-            with open(PATIENT_ID_FILE, 'r') as f:
-                patient_id_counter = int(f.read().strip())
-            patient_id = f"PTD_{patient_id_counter}"
-
-            with open(PATIENT_ID_FILE, 'w') as f:
-                f.write(str(patient_id_counter + 1))
+            patient_id = patient_ids.next_id()
 
             timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M")
             row_data = {
@@ -57,13 +73,7 @@ def reports():
                 'current_medication': data.get('current_medication', 'Not specified')
             }
 
-            file_exists = os.path.isfile(CSV_FILE) and os.path.getsize(CSV_FILE) > 0
-
-            with open(CSV_FILE, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=row_data.keys())
-                if not file_exists:
-                    writer.writeheader()
-                writer.writerow(row_data)
+            report_writer.submit(row_data)
 
             return jsonify({'success': True, 'patient_id': patient_id})
 
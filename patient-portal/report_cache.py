@@ -0,0 +1,105 @@
+"""
+Cached Newest-First View of the ADR Reports
+
+Keeps every stored report serialized as JSON, in insertion order, and
+extends it with only the rows appended since the last request. GET
+/api/reports then streams the rows in reverse without re-reading the data.
+
+Paginated requests (?limit=N) skip the cache and read just the newest rows
+from the storage backend.
+"""
+
+import json
+import threading
+
+from common.http_cache import data_version
+from common.pagination import parse_page_params
+from common.streaming import iter_json_object
+
+
+class ReportCache:
+    """Incrementally maintained, pre-serialized list of report rows"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.rows = []  # JSON text of each row, oldest first
+        self._tail = storage.tail()
+        self._lock = threading.Lock()
+        # Version and modification time of the stored data the rows reflect
+        self.version = data_version(None)
+        self.last_modified = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def refresh(self):
+        """
+        Pick up rows appended to the storage since the last refresh
+
+        The cache is rebuilt from scratch only if the data was replaced,
+        truncated or rewritten.
+
+        Returns:
+            Number of rows added
+        """
+        state = self.storage.state()
+        if state is None:
+            with self._lock:
+                self._reset()
+            return 0
+
+        version, last_modified = state
+        with self._lock:
+            # Checked under the lock, as concurrent requests may refresh at once
+            if version == self.version:
+                return 0
+            if not self._tail.is_continuation():
+                self._reset()
+            new_rows = [json.dumps(row) for row in self._tail.read_rows()]
+            self.rows.extend(new_rows)
+            self.version = version
+            self.last_modified = last_modified
+        return len(new_rows)
+
+    def _reset(self):
+        self.rows = []
+        self._tail = self.storage.tail()
+        self.version = data_version(None)
+        self.last_modified = None
+
+    def iter_newest_first(self):
+        """Yield the serialized rows newest first, as of the time of the call"""
+        rows = self.rows
+        for index in range(len(rows) - 1, -1, -1):
+            yield rows[index]
+
+    def iter_json(self):
+        """Yield the {'reports': [...]} response body in pieces, newest report first"""
+        return iter_json_object({}, 'reports', self.iter_newest_first(), encode=str)
+
+
+def newest_reports_page(storage, limit, cursor):
+    """
+    Build one page of GET /api/reports, newest report first
+
+    Only the rows on the page are read from the storage backend.
+
+    Args:
+        limit: The request's limit parameter
+        cursor: The request's cursor parameter: next_cursor of the previous
+            page, or empty for the newest reports
+
+    Returns:
+        The {'reports': [...], 'next_cursor': ...} response payload
+
+    Raises:
+        ValueError: If limit or cursor is malformed
+    """
+    limit, cursor = parse_page_params(limit, cursor)
+    if limit is None:
+        raise ValueError('limit must not be empty')
+    rows, next_before = storage.newest(limit, cursor or None)
+    return {
+        'reports': rows,
+        'next_cursor': str(next_before) if next_before is not None else None
+    }
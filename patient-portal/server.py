@@ -1,12 +1,22 @@
 import http.server
-import socketserver
 import os
 import webbrowser
 import json
-import csv
 import datetime
-import random
-import traceback
+import sys
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.compression import CompressionMixin, compress_body, compressed_bodies
+from common.http_cache import data_version, quote_etag, send_not_modified_if_fresh, validator_headers
+from common.http_server import KeepAliveMixin, PooledHTTPServer
+from common.id_allocator import IDAllocator
+from common.log import get_logger, setup_logging
+from common.storage import open_storage
+from common.streaming import send_streamed
+from common.write_queue import GroupCommitWriter
+from report_cache import ReportCache, newest_reports_page
 
 # Configuration
 PORT = 8080
@@ -14,108 +24,136 @@ DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public")
 CSV_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adr_reports.csv")
 PATIENT_ID_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "patient_id_counter.txt")
 
-print(f"Starting server on port {PORT}")
-print(f"Serving files from: {DIRECTORY}")
-print(f"CSV file location: {CSV_FILE}")
+setup_logging('patient_server')
+log = get_logger('patient_server')
+
+# CSV file, or the SQLite database next to it when CLINIQA_STORAGE=sqlite
+storage = open_storage(CSV_FILE)
+# All report appends go through one writer thread that batches them
+report_writer = GroupCommitWriter(storage)
+
+# Newest-first view of the reports, extended as rows are appended
+report_cache = ReportCache(storage)
+
+log.info("Starting server on port %d", PORT)
+log.info("Serving files from: %s", DIRECTORY)
+log.info("Report storage location: %s", storage.path)
 
 # Initialize patient ID counter
 if not os.path.exists(PATIENT_ID_FILE):
     try:
         with open(PATIENT_ID_FILE, 'w') as f:
             f.write('2000')
-        print(f"Created new patient ID counter file at {PATIENT_ID_FILE}")
+        log.info("Created new patient ID counter file at %s", PATIENT_ID_FILE)
     except Exception as e:
-        print(f"ERROR creating patient ID file: {str(e)}")
-        print(f"Path attempted: {PATIENT_ID_FILE}")
+        log.error("Error creating patient ID file %s: %s", PATIENT_ID_FILE, e)
+
+# Patient IDs come from blocks reserved in the counter file, shared with app.py
+patient_ids = IDAllocator(PATIENT_ID_FILE, 'PTD_')
 
-# Create CSV file if it doesn't exist
-if not os.path.exists(CSV_FILE):
+# Create report storage if it doesn't exist
+if not storage.exists():
     try:
-        os.makedirs(os.path.dirname(CSV_FILE), exist_ok=True)
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['timestamp', 'drug_name', 'medical_condition', 'adverse_reaction', 'severity', 
-                         'confidence', 'cause_of_administration', 'gender', 'patient_id', 'current_medication'])
-            # No sample data will be added
-            print("Created empty CSV file")
+        # No sample data will be added
+        storage.ensure()
+        log.info("Created empty report storage")
     except Exception as e:
-        print(f"ERROR creating CSV file: {str(e)}")
-        print(f"Path attempted: {CSV_FILE}")
+        log.error("Error creating report storage %s: %s", storage.path, e)
 else:
-    print(f"CSV file exists at {CSV_FILE}")
-    # Check if file is readable
+    log.info("Report storage exists at %s", storage.path)
+    # Check if storage is readable
     try:
-        with open(CSV_FILE, 'r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            header = next(reader, None)
-            if header:
-                print(f"CSV header: {header}")
-                row_count = sum(1 for _ in reader)
-                print(f"CSV contains {row_count} rows of data")
-            else:
-                print("CSV file appears to be empty")
+        log.info("Storage contains %d rows of data", storage.count())
     except Exception as e:
-        print(f"Error reading CSV file: {str(e)}")
-        print(f"Path attempted: {CSV_FILE}")
+        log.error("Error reading report storage %s: %s", storage.path, e)
 
-class ADRHandler(http.server.SimpleHTTPRequestHandler):
+class ADRHandler(KeepAliveMixin, CompressionMixin, http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
     
     def log_message(self, format, *args):
-        """Log messages with more detail for debugging"""
-        print(f"{self.address_string()} - [{self.log_date_time_string()}] {format % args}")
+        """Access lines go through the queued logger at DEBUG, formatted only if enabled"""
+        log.debug("%s - " + format, self.address_string(), *args)
+    
+    def log_error(self, format, *args):
+        log.warning("%s - " + format, self.address_string(), *args)
+    
+    def send_reports_page(self, query_params):
+        """Send one page of reports, newest first, reading only the rows on it"""
+        try:
+            state = storage.state()
+            version, last_modified = state if state else (data_version(None), None)
+            payload = newest_reports_page(
+                storage,
+                query_params['limit'][0],
+                query_params.get('cursor', [''])[0]
+            )
+        except ValueError as e:
+            log.debug("Reports page rejected: %s", e)
+            body = json.dumps({'reports': [], 'error': str(e)}).encode()
+            self.send_body(body, 'application/json', status=400)
+            return
+        
+        body = json.dumps(payload).encode()
+        encoding = self.response_encoding(len(body))
+        etag = quote_etag(version, encoding)
+        if send_not_modified_if_fresh(self, etag, last_modified):
+            return
+        log.debug("Sending %d newest reports", len(payload['reports']))
+        self.send_body(body, 'application/json', encoding, headers=validator_headers(etag, last_modified))
     
     def do_GET(self):
-        print(f"GET request: {self.path}")
+        url_parts = urlparse(self.path)
         # Handle API request for reports
-        if self.path == '/api/reports':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
+        if url_parts.path == '/api/reports':
+            query_params = parse_qs(url_parts.query)
+            if 'limit' in query_params:
+                self.send_reports_page(query_params)
+                return
             try:
-                # Read CSV file and convert to JSON
-                reports = []
-                if os.path.exists(CSV_FILE):
-                    try:
-                        with open(CSV_FILE, 'r', newline='', encoding='utf-8') as file:
-                            print(f"Reading from CSV file: {CSV_FILE}")
-                            reader = csv.DictReader(file)
-                            for row in reader:
-                                reports.append(row)
-                            print(f"Read {len(reports)} reports from CSV file")
-                    except Exception as e:
-                        print(f"Error reading CSV file in API: {str(e)}")
-                        reports = []
-                else:
-                    print(f"CSV file not found at: {CSV_FILE}")
+                if not storage.exists():
+                    log.warning("Report storage not found at: %s", storage.path)
+                new_rows = report_cache.refresh()
+                if new_rows:
+                    log.debug("Loaded %d new reports from storage", new_rows)
                 
-                # Return reports (newest first)
-                reports.reverse()
-                json_data = json.dumps({'reports': reports})
-                print(f"Sending {len(reports)} reports, data length: {len(json_data)} bytes")
-                self.wfile.write(json_data.encode())
+                # Unchanged data costs the client only a header exchange
+                version = report_cache.version
+                encoding = self.accepted_encoding() if len(report_cache) else None
+                etag = quote_etag(version, encoding)
+                if send_not_modified_if_fresh(self, etag, report_cache.last_modified):
+                    return
+                
+                # Return reports (newest first), streamed from the cache
+                log.debug("Sending %d reports", len(report_cache))
+                headers = validator_headers(etag, report_cache.last_modified)
+                if encoding:
+                    # The compressed dump is a fraction of the size, so it is
+                    # built once per data version and reused until rows change
+                    body = compressed_bodies.get(
+                        ('reports', version, encoding),
+                        lambda: compress_body(report_cache.iter_json(), encoding)
+                    )
+                    self.send_encoded(body, 'application/json', encoding, headers)
+                else:
+                    send_streamed(self, report_cache.iter_json(), headers=headers)
             except Exception as e:
-                print(f"ERROR serving reports: {str(e)}")
-                traceback.print_exc()
+                log.exception("Error serving reports")
                 # Return empty array with error
                 error_response = json.dumps({'reports': [], 'error': str(e)})
-                self.wfile.write(error_response.encode())
+                self.send_body(error_response.encode(), 'application/json')
             return
             
         # Handle static files for all other requests - sanitize path to prevent directory traversal
         try:
+            if self.send_static_compressed():
+                return
             return super().do_GET()
         except Exception as e:
-            print(f"Error serving static file: {str(e)}")
-            self.send_response(404)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(b"File not found")
+            log.error("Error serving static file: %s", e)
+            self.send_body(b"File not found", 'text/plain', status=404)
     
     def do_POST(self):
-        print(f"POST request: {self.path}")
         if self.path == '/api/reports':
             try:
                 content_length = int(self.headers['Content-Length'])
@@ -124,106 +162,74 @@ class ADRHandler(http.server.SimpleHTTPRequestHandler):
                 try:
                     # Parse the JSON data
                     data = json.loads(post_data)
-                    print(f"Received POST data: {data}")
+                    log.debug("Received POST data: %s", data)
                     
                     # Generate a patient ID
-                    try:
-                        with open(PATIENT_ID_FILE, 'r') as f:
-                            patient_id_counter = int(f.read().strip())
-                    except Exception as e:
-                        print(f"Error reading patient ID file: {e}")
-                        patient_id_counter = 2000
-                    
-                    patient_id = f"PTD_{patient_id_counter}"
-                    
-                    # Increment patient ID counter
-                    try:
-                        with open(PATIENT_ID_FILE, 'w') as f:
-                            f.write(str(patient_id_counter + 1))
-                    except Exception as e:
-                        print(f"Error updating patient ID counter: {e}")
+                    patient_id = patient_ids.next_id()
                     
                     # Get current timestamp
                     timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M")
                     
                     # Prepare row data
-                    row_data = [
-                        timestamp,
-                        data.get('drug_name', ''),
-                        data.get('medical_condition', ''),
-                        data.get('adverse_reaction', ''),
-                        data.get('severity', ''),
-                        '0',  # confidence
-                        data.get('cause_of_administration', ''),
-                        data.get('gender', ''),
-                        patient_id,
-                        data.get('current_medication', 'Not specified')
-                    ]
-                    
-                    # Debug print the data being written
-                    print(f"Writing to CSV: {row_data}")
+                    row_data = {
+                        'timestamp': timestamp,
+                        'drug_name': data.get('drug_name', ''),
+                        'medical_condition': data.get('medical_condition', ''),
+                        'adverse_reaction': data.get('adverse_reaction', ''),
+                        'severity': data.get('severity', ''),
+                        'confidence': '0',
+                        'cause_of_administration': data.get('cause_of_administration', ''),
+                        'gender': data.get('gender', ''),
+                        'patient_id': patient_id,
+                        'current_medication': data.get('current_medication', 'Not specified')
+                    }
                     
-                    # Check if file exists and has headers
-                    file_exists = os.path.isfile(CSV_FILE) and os.path.getsize(CSV_FILE) > 0
+                    log.debug("Writing report: %s", row_data)
                     
-                    # Append to CSV with proper encoding
+                    # Append to the report storage; returns once the write is durable
                     try:
-                        with open(CSV_FILE, 'a', newline='', encoding='utf-8') as file:
-                            writer = csv.writer(file)
-                            # Write header if file is new
-                            if not file_exists:
-                                writer.writerow(['timestamp', 'drug_name', 'medical_condition', 'adverse_reaction', 'severity', 
-                                             'confidence', 'cause_of_administration', 'gender', 'patient_id', 'current_medication'])
-                            # Write data row
-                            writer.writerow(row_data)
+                        report_writer.submit(row_data)
                         
-                        print(f"Saved new report to CSV with patient ID: {patient_id}")
+                        log.info("Saved new report with patient ID: %s", patient_id)
                         
                         # Send success response
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
+                        self.send_body(json.dumps({
                             'success': True,
                             'patient_id': patient_id
-                        }).encode())
+                        }).encode(), 'application/json')
                     except Exception as e:
-                        print(f"ERROR writing to CSV: {str(e)}")
+                        log.error("Error writing report: %s", e)
                         raise e
                     
                 except json.JSONDecodeError as e:
-                    print(f"ERROR parsing JSON: {str(e)}")
-                    print(f"Invalid JSON data received: {post_data}")
+                    log.error("Error parsing JSON: %s", e)
+                    log.debug("Invalid JSON data received: %s", post_data)
                     raise e
                 
             except Exception as e:
-                print(f"ERROR processing submission: {str(e)}")
-                traceback.print_exc()
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                log.exception("Error processing submission")
+                self.send_body(json.dumps({
                     'success': False,
                     'error': str(e)
-                }).encode())
+                }).encode(), 'application/json', status=500)
             return
         
         # Default response for other POST requests
+        self.discard_request_body()
         self.send_response(404)
+        self.send_header('Content-Length', '0')
         self.end_headers()
         return
     
     def do_OPTIONS(self):
-        print(f"OPTIONS request: {self.path}")
         try:
             self.send_response(200)
+            self.send_header('Content-Length', '0')
             self.end_headers()
-            print("OPTIONS request handled (CORS preflight)")
-        except Exception as e:
-            print(f"Error handling OPTIONS request: {str(e)}")
+        except Exception:
+            log.exception("Error handling OPTIONS request")
             self.send_response(500)
+            self.send_header('Content-Length', '0')
             self.end_headers()
 
     def end_headers(self):
@@ -233,21 +239,21 @@ class ADRHandler(http.server.SimpleHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         except Exception as e:
-            print(f"Error adding CORS headers: {str(e)}")
+            log.error("Error adding CORS headers: %s", e)
         super().end_headers()
 
 # Start the server
-print(f"Server running at http://localhost:{PORT}")
-print(f"API endpoint: http://localhost:{PORT}/api/reports")
+log.info("Server running at http://localhost:%d", PORT)
+log.info("API endpoint: http://localhost:%d/api/reports", PORT)
 
 # Open the correct URL in browser
 webbrowser.open(f"http://localhost:{PORT}")
 
 # Create server
-with socketserver.TCPServer(("", PORT), ADRHandler) as httpd:
+with PooledHTTPServer(("", PORT), ADRHandler) as httpd:
     try:
-        print("Server is running, press Ctrl+C to stop")
+        log.info("Server is running, press Ctrl+C to stop")
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\nShutting down server...")
+        log.info("Shutting down server...")
         httpd.server_close() 
\ No newline at end of file